@@ -1,11 +1,24 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from datetime import datetime, date
+from flask import Blueprint, Response, request, jsonify, current_app
+from flask_jwt_extended import (
+    create_access_token, jwt_required, get_jwt_identity, get_jwt, get_jwt_request_location, verify_jwt_in_request
+)
+from datetime import datetime, date, timedelta
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from functools import wraps
 import json
 
-from models import db, Admin, Cafe, Reservation, Table, Zone, AdminRole, Role
+from models import db, Admin, Cafe, Reservation, ArchivedReservation, Table, Zone, AdminRole, Role
+from routing import read_only, write_transaction
+from archive import may_be_archived, paginate_history
+from allocator import load_bookings, load_tables, repack
+from reports import BUCKET_SIZES, occupancy_report
+from stats import daily_report, record_change, snapshot
+import changes
+import dashboard
+import events
+import outbox
+import shards
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -13,6 +26,7 @@ def admin_required(f):
     """Decorator to require admin authentication"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        verify_jwt_in_request()
         claims = get_jwt()
         if claims.get('type') != 'admin':
             return jsonify({'success': False, 'message': 'Admin access required'}), 403
@@ -26,6 +40,7 @@ def check_cafe_access(admin_id, cafe_id):
 
 @admin_bp.route('/dashboard/<cafe_id>', methods=['GET'])
 @admin_required
+@read_only
 def get_dashboard(cafe_id):
     try:
         admin_id = get_jwt_identity()
@@ -34,73 +49,87 @@ def get_dashboard(cafe_id):
         if not check_cafe_access(admin_id, cafe_id):
             return jsonify({'success': False, 'message': 'Access denied to this cafe'}), 403
         
-        today = date.today()
-        
-        # Get today's stats
-        today_reservations = Reservation.query.filter(
-            Reservation.cafe_id == cafe_id,
-            Reservation.date == today
-        ).count()
-        
-        pending_reservations = Reservation.query.filter(
-            Reservation.cafe_id == cafe_id,
-            Reservation.status == 'pending'
-        ).count()
-        
-        available_tables = Table.query.filter(
-            Table.cafe_id == cafe_id,
-            Table.is_active == True,
-            Table.status == 'available'
-        ).count()
-        
-        total_tables = Table.query.filter(
-            Table.cafe_id == cafe_id,
-            Table.is_active == True
-        ).count()
-        
-        # Get recent reservations
-        recent_reservations = Reservation.query.filter(
-            Reservation.cafe_id == cafe_id
-        ).order_by(Reservation.created_at.desc()).limit(10).all()
-        
-        recent_reservations_data = []
-        for r in recent_reservations:
-            reservation_dict = {
-                'id': r.id,
-                'reservation_number': r.reservation_number,
-                'guest_name': r.guest_name,
-                'date': r.date.isoformat(),
-                'time': r.time,
-                'guests': r.guests,
-                'status': r.status,
-                'table': None,
-                'created_at': r.created_at.isoformat()
-            }
-            
-            if r.table:
-                reservation_dict['table'] = {
-                    'number': r.table.number,
-                    'zone': r.table.zone.name
-                }
-            
-            recent_reservations_data.append(reservation_dict)
-        
+        # One joined query for the recent list instead of a lazy load per row
         return jsonify({
             'success': True,
-            'stats': {
-                'todayReservations': today_reservations,
-                'pendingReservations': pending_reservations,
-                'availableTables': available_tables,
-                'totalTables': total_tables
-            },
-            'recentReservations': recent_reservations_data
+            'stats': dashboard.counters(cafe_id),
+            'recentReservations': dashboard.recent_reservations(cafe_id)
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@admin_bp.route('/events/<cafe_id>/token', methods=['POST'])
+@admin_required
+def create_events_token(cafe_id):
+    """A short-lived token that only opens the cafe's event stream, for the ?jwt= of an EventSource URL"""
+    try:
+        admin_id = get_jwt_identity()
+        
+        if not check_cafe_access(admin_id, cafe_id):
+            return jsonify({'success': False, 'message': 'Access denied to this cafe'}), 403
+        
+        expires_in = current_app.config['EVENTS_TOKEN_SECONDS']
+        token = create_access_token(
+            identity=admin_id,
+            additional_claims={'type': 'events', 'cafeId': cafe_id},
+            expires_delta=timedelta(seconds=expires_in)
+        )
+        return jsonify({'success': True, 'token': token, 'expiresIn': expires_in})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@admin_bp.route('/events/<cafe_id>', methods=['GET'])
+@read_only
+def stream_events(cafe_id):
+    """Server-sent events with reservation changes and refreshed dashboard counters"""
+    # EventSource cannot set headers, so the URL may carry a stream token (?jwt=) instead. URLs end up
+    # in access logs, so an admin's own token is only accepted in the Authorization header
+    verify_jwt_in_request(locations=['headers', 'query_string'])
+    claims = get_jwt()
+    if get_jwt_request_location() == 'query_string':
+        allowed = claims.get('type') == 'events' and claims.get('cafeId') == cafe_id
+    else:
+        allowed = claims.get('type') == 'admin'
+    if not allowed:
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    try:
+        if not check_cafe_access(get_jwt_identity(), cafe_id):
+            return jsonify({'success': False, 'message': 'Access denied to this cafe'}), 403
+        
+        # Browsers resend the last id they saw when reconnecting
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        
+        config = current_app.config
+        # Counters are read now; the stream itself does not touch the database
+        stream = events.stream(
+            cafe_id,
+            last_id=last_event_id,
+            snapshot=dashboard.counters(cafe_id),
+            heartbeat=config['EVENTS_HEARTBEAT_SECONDS'],
+            max_seconds=config['EVENTS_MAX_STREAM_SECONDS'],
+            max_streams=config['EVENTS_MAX_STREAMS']
+        )
+        
+        return Response(stream, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # let nginx pass events through unbuffered
+        })
+        
+    except events.StreamsFull:
+        raise
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @admin_bp.route('/reservations/<cafe_id>', methods=['GET'])
 @admin_required
+@read_only
 def get_reservations(cafe_id):
     try:
         admin_id = get_jwt_identity()
@@ -116,46 +145,28 @@ def get_reservations(cafe_id):
         offset = int(request.args.get('offset', 0))
         
         # Build query
-        query = Reservation.query.filter_by(cafe_id=cafe_id)
+        filters = {'cafe_id': cafe_id}
+        target_date = None
         
         if status:
-            query = query.filter_by(status=status)
+            filters['status'] = status
         
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter_by(date=target_date)
+                filters['date'] = target_date
             except ValueError:
                 return jsonify({'success': False, 'message': 'Invalid date format'}), 400
         
-        total = query.count()
-        reservations = query.order_by(Reservation.created_at.desc()).offset(offset).limit(limit).all()
-        
-        reservations_data = []
-        for r in reservations:
-            reservation_dict = {
-                'id': r.id,
-                'reservation_number': r.reservation_number,
-                'guest_name': r.guest_name,
-                'guest_email': r.guest_email,
-                'guest_phone': r.guest_phone,
-                'date': r.date.isoformat(),
-                'time': r.time,
-                'guests': r.guests,
-                'status': r.status,
-                'special_requests': r.special_requests,
-                'table': None,
-                'created_at': r.created_at.isoformat()
-            }
-            
-            if r.table:
-                reservation_dict['table'] = {
-                    'id': r.table.id,
-                    'number': r.table.number,
-                    'zone': r.table.zone.name
-                }
-            
-            reservations_data.append(reservation_dict)
+        # History older than ARCHIVE_AFTER_DAYS is read from the archive as well. The page's tables
+        # and zones come with the rows, so admin_reservation finds them in the session
+        query = Reservation.query.options(joinedload(Reservation.table).joinedload(Table.zone)).filter_by(**filters)
+        archived_query = None
+        if may_be_archived(status, target_date):
+            archived_query = ArchivedReservation.query.filter_by(**filters)
+        total, reservations = paginate_history(query, archived_query, offset, limit)
+        
+        reservations_data = [dashboard.admin_reservation(r) for r in reservations]
         
         return jsonify({
             'success': True,
@@ -170,7 +181,53 @@ def get_reservations(cafe_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@admin_bp.route('/changes/<cafe_id>', methods=['GET'])
+@admin_required
+@read_only
+def get_changes(cafe_id):
+    try:
+        admin_id = get_jwt_identity()
+        
+        # Check access
+        if not check_cafe_access(admin_id, cafe_id):
+            return jsonify({'success': False, 'message': 'Access denied to this cafe'}), 403
+        
+        # Without a cursor, return where to start; fetch the cursor before the full list
+        since = request.args.get('since')
+        if since is None:
+            return jsonify({'success': True, 'changes': [], 'cursor': changes.head_cursor(), 'hasMore': False,
+                            'retryAfter': None})
+        
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        
+        if changes.is_expired(since):
+            return jsonify({
+                'success': False,
+                'message': 'Cursor has expired; reload the reservation list',
+                'cursor': changes.head_cursor()
+            }), 410
+        
+        limit = max(1, min(request.args.get('limit', 500, type=int), 1000))
+        rows, has_more, retry_after = changes.changes_since(
+            cafe_id, since, limit, current_app.config['CHANGES_SETTLE_SECONDS']
+        )
+        
+        return jsonify({
+            'success': True,
+            'changes': [row.to_dict() for row in rows],
+            'cursor': rows[-1].id if rows else since,
+            'hasMore': has_more,
+            'retryAfter': retry_after
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @admin_bp.route('/reservations/<reservation_id>', methods=['PUT'])
+@write_transaction
 @admin_required
 def update_reservation(reservation_id):
     try:
@@ -180,7 +237,7 @@ def update_reservation(reservation_id):
         if not data:
             return jsonify({'success': False, 'message': 'No data provided'}), 400
         
-        reservation = Reservation.query.get(reservation_id)
+        reservation = shards.find(lambda: Reservation.query.get(reservation_id), write=True)
         if not reservation:
             return jsonify({'success': False, 'message': 'Reservation not found'}), 404
         
@@ -193,7 +250,7 @@ def update_reservation(reservation_id):
         table_id = data.get('tableId')
         notes = data.get('notes')
         
-        old_status = reservation.status
+        before = snapshot(reservation)
         
         if status:
             reservation.status = status
@@ -215,19 +272,150 @@ def update_reservation(reservation_id):
         
         reservation.updated_at = datetime.utcnow()
         
+        # Daily counters, the change log and the guest email/POS webhook are written in the same transaction
+        op = 'cancelled' if status == 'cancelled' else 'updated'
+        record_change(before, reservation)
+        change = changes.record(op, reservation)
+        if reservation.status != before.status:
+            outbox.reservation_event(reservation.status, reservation)
+        
         db.session.commit()
         
+        dashboard.publish_reservation(f'reservation.{op}', reservation, change)
+        
         return jsonify({
             'success': True,
             'reservation': reservation.to_dict()
         })
         
+    except shards.CafeUnavailable:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@admin_bp.route('/reservations/<cafe_id>/repack', methods=['POST'])
+@write_transaction
+@admin_required
+def repack_reservations(cafe_id):
+    try:
+        admin_id = get_jwt_identity()
+        
+        # Check access
+        if not check_cafe_access(admin_id, cafe_id):
+            return jsonify({'success': False, 'message': 'Access denied to this cafe'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        date_str = data.get('date')
+        if not date_str:
+            return jsonify({'success': False, 'message': 'Date is required'}), 400
+        
+        try:
+            target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+        
+        # Re-assign the day's unseated reservations so large tables are kept for large parties
+        bookings = load_bookings(cafe_id, target_date)
+        plan = repack(load_tables(cafe_id), bookings)
+        if plan is None:
+            return jsonify({'success': False, 'message': 'Not every reservation fits; table assignments left unchanged'}), 409
+        
+        moves = {b.id: plan[b.id] for b in bookings if plan[b.id] != b.table_id}
+        changes.apply_table_moves(moves)
+        moved = len(moves)
+        
+        db.session.commit()
+        
+        if moved:
+            events.publish(cafe_id, 'reservations.repacked', {'date': date_str, 'moved': moved})
+        
+        return jsonify({
+            'success': True,
+            'date': date_str,
+            'reservations': len(bookings),
+            'moved': moved
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@admin_bp.route('/reports/<cafe_id>/occupancy', methods=['GET'])
+@admin_required
+@read_only
+def get_occupancy_report(cafe_id):
+    try:
+        admin_id = get_jwt_identity()
+        
+        # Check access
+        if not check_cafe_access(admin_id, cafe_id):
+            return jsonify({'success': False, 'message': 'Access denied to this cafe'}), 403
+        
+        cafe = Cafe.query.get(cafe_id)
+        if not cafe:
+            return jsonify({'success': False, 'message': 'Cafe not found'}), 404
+        
+        # Defaults to the last four weeks
+        try:
+            end_date = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else date.today()
+            start_date = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') \
+                else end_date - timedelta(days=27)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+        
+        if start_date > end_date:
+            return jsonify({'success': False, 'message': 'from must not be after to'}), 400
+        max_days = current_app.config['REPORT_MAX_DAYS']
+        if (end_date - start_date).days >= max_days:
+            return jsonify({'success': False, 'message': f'Range is limited to {max_days} days'}), 400
+        
+        bucket = request.args.get('bucket', 30, type=int)
+        if bucket not in BUCKET_SIZES:
+            return jsonify({'success': False, 'message': f'bucket must be one of {list(BUCKET_SIZES)}'}), 400
+        
+        return jsonify({
+            'success': True,
+            'report': occupancy_report(cafe, start_date, end_date, bucket)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@admin_bp.route('/stats/<cafe_id>/daily', methods=['GET'])
+@admin_required
+@read_only
+def get_daily_stats(cafe_id):
+    try:
+        admin_id = get_jwt_identity()
+        
+        # Check access
+        if not check_cafe_access(admin_id, cafe_id):
+            return jsonify({'success': False, 'message': 'Access denied to this cafe'}), 403
+        
+        # Defaults to the last four weeks
+        try:
+            end_date = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else date.today()
+            start_date = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') \
+                else end_date - timedelta(days=27)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid date format'}), 400
+        
+        if start_date > end_date:
+            return jsonify({'success': False, 'message': 'from must not be after to'}), 400
+        
+        return jsonify({
+            'success': True,
+            'stats': daily_report(cafe_id, start_date, end_date)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @admin_bp.route('/tables/<cafe_id>', methods=['GET'])
 @admin_required
+@read_only
 def get_tables(cafe_id):
     try:
         admin_id = get_jwt_identity()
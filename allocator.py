@@ -0,0 +1,217 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import db, Reservation, Table
+from utils import SERVICE_DAY_START, MINUTES_PER_DAY
+
+# Reservations in these states hold their table
+ACTIVE_STATUSES = ('pending', 'confirmed', 'seated')
+
+# Reservations a re-pack may move to another table
+MOVABLE_STATUSES = ('pending', 'confirmed')
+
+# Plain-data views of rows, so allocation works without a session
+TableInfo = namedtuple('TableInfo', ['id', 'zone_id', 'number', 'seats', 'min_guests', 'max_guests'])
+Booking = namedtuple('Booking', ['id', 'guests', 'start', 'end', 'table_id', 'status', 'zone_id'],
+                     defaults=(None,))
+
+
+def _size(table):
+    return table.max_guests, table.seats
+
+
+class TableAllocator:
+    """Busy intervals per table for one cafe and service day, with best-fit table lookup
+
+    Times are service-day minutes. Each table keeps its intervals as parallel
+    sorted start/end lists that never overlap, so a free check is one bisect.
+    """
+
+    def __init__(self, tables):
+        # Best fit = smallest table that takes the party
+        self.tables = sorted(tables, key=lambda t: (_size(t), t.number))
+        self._by_id = {t.id: t for t in self.tables}
+        self._starts = {t.id: [] for t in self.tables}
+        self._ends = {t.id: [] for t in self.tables}
+        self._candidates = {}
+
+    def candidates(self, guests, zone_id=None):
+        """Tables that seat the party, smallest first"""
+        key = (guests, zone_id)
+        if key not in self._candidates:
+            self._candidates[key] = [
+                t for t in self.tables
+                if (t.min_guests or 1) <= guests <= t.max_guests and (zone_id is None or t.zone_id == zone_id)
+            ]
+        return self._candidates[key]
+
+    def has_table(self, table_id):
+        return table_id in self._by_id
+
+    def zone_of(self, table_id):
+        return self._by_id[table_id].zone_id
+
+    def is_free(self, table_id, start, end):
+        starts = self._starts[table_id]
+        i = bisect_left(starts, end)
+        # Only the last interval starting before `end` can reach past `start`
+        return i == 0 or self._ends[table_id][i - 1] <= start
+
+    def reserve(self, table_id, start, end):
+        """Mark [start, end) busy; overlapping intervals already on the table are merged"""
+        starts, ends = self._starts[table_id], self._ends[table_id]
+        lo = bisect_right(ends, start)
+        hi = bisect_left(starts, end)
+        if lo < hi:
+            start = min(start, starts[lo])
+            end = max(end, ends[hi - 1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
+
+    def best_fit(self, guests, start, end, zone_id=None, prefer=None):
+        """Smallest free table for the party; `prefer` wins among tables of the same size"""
+        for table in self.candidates(guests, zone_id):
+            if self.is_free(table.id, start, end):
+                break
+        else:
+            return None
+        preferred = self._by_id.get(prefer)
+        if preferred and preferred in self.candidates(guests, zone_id) \
+                and _size(preferred) == _size(table) and self.is_free(preferred.id, start, end):
+            return preferred
+        return table
+
+    def free_tables(self, guests, start, end, zone_id=None):
+        return [t for t in self.candidates(guests, zone_id) if self.is_free(t.id, start, end)]
+
+    def busy(self, table_id):
+        """A table's busy [start, end) intervals, in order"""
+        return list(zip(self._starts[table_id], self._ends[table_id]))
+
+
+def build_allocator(tables, bookings):
+    """Allocator with existing bookings placed
+
+    Bookings on a known table hold it. Bookings without a table (made before
+    automatic assignment) are given a best-fit table on paper, so they still
+    use up capacity.
+    """
+    allocator = TableAllocator(tables)
+    unassigned = []
+    for booking in bookings:
+        if allocator.has_table(booking.table_id):
+            allocator.reserve(booking.table_id, booking.start, booking.end)
+        else:
+            unassigned.append(booking)
+
+    for booking in sorted(unassigned, key=lambda b: b.start):
+        table = allocator.best_fit(booking.guests, booking.start, booking.end)
+        if table:
+            allocator.reserve(table.id, booking.start, booking.end)
+    return allocator
+
+
+def repack(tables, bookings):
+    """Re-assign every movable booking from scratch; returns {booking id: table id} or None
+
+    Seated bookings stay where they are. The rest are placed most-constrained
+    first (fewest candidate tables, then earliest start), each on its best-fit
+    table, which keeps large tables free for large parties. A booking without
+    a zone_id stays in the zone of its current table, as the guest may have
+    chosen it. Returns None if some booking would end up without a table, so
+    callers keep the current plan.
+    """
+    allocator = TableAllocator(tables)
+    plan = {}
+    movable = []
+    for booking in bookings:
+        if booking.status in MOVABLE_STATUSES or not allocator.has_table(booking.table_id):
+            if booking.zone_id is None and allocator.has_table(booking.table_id):
+                booking = booking._replace(zone_id=allocator.zone_of(booking.table_id))
+            movable.append(booking)
+        else:
+            allocator.reserve(booking.table_id, booking.start, booking.end)
+            plan[booking.id] = booking.table_id
+
+    movable.sort(key=lambda b: (len(allocator.candidates(b.guests, b.zone_id)), b.start, -(b.end - b.start)))
+    for booking in movable:
+        # Staying put is free when the current table is as good a fit
+        table = allocator.best_fit(booking.guests, booking.start, booking.end, booking.zone_id,
+                                   prefer=booking.table_id)
+        if table is None:
+            return None
+        allocator.reserve(table.id, booking.start, booking.end)
+        plan[booking.id] = table.id
+    return plan
+
+
+def tables_query(cafe_id):
+    """Bookable tables of a cafe, in TableInfo column order"""
+    return select(
+        Table.id, Table.zone_id, Table.number, Table.seats, Table.min_guests, Table.max_guests
+    ).where(Table.cafe_id == cafe_id, Table.is_active == True, Table.status == 'available')
+
+
+def load_tables(cafe_id):
+    """Bookable tables of a cafe as TableInfo tuples"""
+    return [TableInfo(*row) for row in db.session.execute(tables_query(cafe_id))]
+
+
+def bookings_query(cafe_id, service_date):
+    """Active bookings that overlap a service day (see day_bookings)"""
+    return select(
+        Reservation.id, Reservation.guests, Reservation.date, Reservation.start_minute,
+        Reservation.end_minute, Reservation.table_id, Reservation.status
+    ).where(
+        Reservation.overlapping(cafe_id, service_date, SERVICE_DAY_START, SERVICE_DAY_START + MINUTES_PER_DAY),
+        Reservation.status.in_(ACTIVE_STATUSES)
+    )
+
+
+def day_bookings(rows, service_date):
+    """Booking tuples on a service day's minute scale from bookings_query rows"""
+    bookings = []
+    for id, guests, day, start, end, table_id, status in rows:
+        # Spill-over from the neighbouring service days is fixed, like a seated booking
+        offset = (day - service_date).days * MINUTES_PER_DAY
+        if offset:
+            status = 'seated'
+        bookings.append(Booking(id, guests, start + offset, end + offset, table_id, status))
+    return bookings
+
+
+def load_bookings(cafe_id, service_date):
+    """Active bookings that overlap a service day, on that day's minute scale"""
+    return day_bookings(db.session.execute(bookings_query(cafe_id, service_date)), service_date)
+
+
+def load_allocator(cafe_id, service_date):
+    """Allocator for a cafe's service day with its current bookings placed"""
+    return build_allocator(load_tables(cafe_id), load_bookings(cafe_id, service_date))
+
+
+def assign_table(cafe_id, service_date, guests, start, end, zone_id=None):
+    """Pick a table for a new booking, re-packing the day's unseated bookings if needed
+
+    Returns (table_id, moves): moves maps existing reservation ids to their new
+    table ids, for the caller to apply in the same transaction as the booking.
+    table_id is None when the party cannot be seated.
+    """
+    tables = load_tables(cafe_id)
+    bookings = load_bookings(cafe_id, service_date)
+    allocator = build_allocator(tables, bookings)
+
+    table = allocator.best_fit(guests, start, end, zone_id)
+    if table:
+        return table.id, {}
+    if not allocator.candidates(guests, zone_id):
+        return None, {}
+
+    # Moving other parties may free a table that fits
+    plan = repack(tables, bookings + [Booking(None, guests, start, end, None, 'pending', zone_id)])
+    if plan is None:
+        return None, {}
+    moves = {b.id: plan[b.id] for b in bookings if plan[b.id] != b.table_id}
+    return plan[None], moves
@@ -0,0 +1,143 @@
+import heapq
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import delete, insert, inspect, select, text
+from sqlalchemy.engine import make_url
+
+from database import ARCHIVE_BIND
+from models import db, Reservation, ArchivedReservation
+import shards
+
+# Reservations in these states never change again and can leave the hot table
+TERMINAL_STATUSES = ('completed', 'cancelled', 'no_show')
+
+
+def init_app(app):
+    """Partition the archive table by date on Postgres when ARCHIVE_PARTITION_BY_DATE is set"""
+    url = app.config.get('ARCHIVE_DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI']
+    if app.config['ARCHIVE_PARTITION_BY_DATE'] and make_url(url).get_backend_name() == 'postgresql':
+        # Only affects CREATE TABLE, i.e. databases initialized after the flag is set
+        ArchivedReservation.__table__.dialect_options['postgresql']['partition_by'] = 'RANGE (date)'
+
+
+def ensure_archive_table():
+    """Create the archive table if its database does not have it yet"""
+    db.create_all(bind_key=ARCHIVE_BIND)
+
+
+def _partitioned(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name"
+    ), {'name': ArchivedReservation.__tablename__}).first() is not None
+
+
+def ensure_partitions(years):
+    """Create yearly partitions of a partitioned archive table for the given years"""
+    connection = db.session.connection(bind_arguments={'mapper': inspect(ArchivedReservation)})
+    if not years or not _partitioned(connection):
+        return
+    name = ArchivedReservation.__tablename__
+    for year in sorted(years):
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name}_{year} PARTITION OF {name} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        ))
+
+
+def archive_reservations(older_than_days, batch_size=1000, pause=0.0, log=print):
+    """Move terminal reservations dated before the cutoff into the archive
+
+    Each batch is copied (skipping rows already archived) and committed before
+    it is deleted from the hot table, so an interrupted run can be restarted
+    and picks up where it stopped.
+    """
+    if older_than_days < 1:
+        raise ValueError("older_than_days must be at least 1")
+
+    ensure_archive_table()
+    cutoff = date.today() - timedelta(days=older_than_days)
+    moved = 0
+    # The archive is shared; the hot rows are read from each database in turn
+    for _ in shards.homes():
+        moved = _archive_location(cutoff, batch_size, pause, moved, log)
+    return moved
+
+
+def _archive_location(cutoff, batch_size, pause, moved, log):
+    hot = Reservation.__table__
+    while True:
+        # Served by ix_reservations_status_date; archived rows are gone, so no offset is needed
+        rows = db.session.execute(
+            select(hot).where(hot.c.status.in_(TERMINAL_STATUSES), hot.c.date < cutoff).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+
+        ids = [row['id'] for row in rows]
+        # ORM statements on the archive model so they run on the archive bind
+        archived = set(db.session.execute(
+            select(ArchivedReservation.id).where(ArchivedReservation.id.in_(ids))
+        ).scalars())
+        archived_at = datetime.utcnow()
+        fresh = [dict(row, archived_at=archived_at) for row in rows if row['id'] not in archived]
+
+        ensure_partitions({row['date'].year for row in fresh})
+        if fresh:
+            db.session.execute(insert(ArchivedReservation), fresh)
+        db.session.commit()
+
+        db.session.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.session.commit()
+
+        moved += len(ids)
+        log(f"Archived {moved} reservations (before {cutoff.isoformat()})")
+        if pause:
+            time.sleep(pause)
+
+    return moved
+
+
+def may_be_archived(status=None, target_date=None):
+    """Whether a history query with these filters can match archived rows"""
+    if status and status not in TERMINAL_STATUSES:
+        return False
+    return target_date is None or target_date < date.today()
+
+
+def find_archived(reservation_number, options=()):
+    return ArchivedReservation.query.options(*options).filter_by(reservation_number=reservation_number).first()
+
+
+def paginate_history(query, archived_query, offset, limit, count=True, all_shards=False):
+    """Page through live and archived reservations together, newest created_at first
+
+    Returns (total, rows); total is None when count is False. Each side is
+    read up to offset + limit rows and the two sorted lists are merged, so deep
+    pages cost more than shallow ones. With all_shards the live rows come
+    from every database, for queries that are not about one cafe.
+    """
+    live = shards.gather if all_shards else lambda fetch: fetch()
+    total = sum(live(lambda: [query.count()])) if count else None
+    query = query.order_by(Reservation.created_at.desc())
+    window = offset + limit
+    if archived_query is None and not (all_shards and shards.enabled()):
+        return total, query.offset(offset).limit(limit).all()
+
+    live_rows = sorted(live(lambda: query.limit(window).all()), key=lambda r: r.created_at, reverse=True)
+    if archived_query is None:
+        return total, live_rows[offset:window]
+
+    if count:
+        total += archived_query.count()
+    merged = heapq.merge(
+        live_rows,
+        archived_query.order_by(ArchivedReservation.created_at.desc()).limit(window).all(),
+        key=lambda r: r.created_at,
+        reverse=True
+    )
+    return total, list(islice(merged, offset, window))
@@ -0,0 +1,10 @@
+"""ASGI entry point (uvicorn asgi:app); the read-heavy GET endpoints run as async views, the rest on Flask"""
+import time
+
+from app import create_app, verify_startup
+from async_views import AsyncApp
+
+started = time.perf_counter()
+flask_app = create_app()
+verify_startup(flask_app, started)
+app = AsyncApp(flask_app)
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from http.cookies import SimpleCookie
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from database import engine_options, sqlite_connect_listener, sqlite_pragmas
+from metrics import metrics
+from models import db
+from routing import READ_YOUR_WRITES_COOKIE, REPLICA_BIND, SHARD_BIND_PREFIX, monitor
+import shards
+
+# Async drivers for the backends the app runs on
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"The async views support {', '.join(ASYNC_DRIVERS)} databases, not {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def async_engine_options(url, config):
+    """engine_options for the async driver, which takes the Postgres connection settings differently"""
+    options = engine_options(url, config)
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite' and 'pool_size' in options:
+        # aiosqlite defaults to a NullPool for files, which would open a connection (and thread) per session
+        options['poolclass'] = AsyncAdaptedQueuePool
+    if backend == 'postgresql':
+        timeout = config['DB_STATEMENT_TIMEOUT_MS']
+        options['connect_args'] = {
+            'timeout': 10,
+            'server_settings': {
+                'application_name': 'barsan-backend',
+                'statement_timeout': str(timeout),
+                'idle_in_transaction_session_timeout': str(timeout * 6)
+            }
+        }
+    return options
+
+
+class AsyncDatabase:
+    """Async engines for the Flask app's main database, replica and shards, with sessions routed like RoutingSession
+
+    Engines are created on first use, so in each server worker after the fork
+    and inside its event loop.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self._engines = None
+        self._binds = {}
+
+    @property
+    def engines(self):
+        if self._engines is None:
+            urls = {None: self.config['SQLALCHEMY_DATABASE_URI']}
+            for key, bind in self.config['SQLALCHEMY_BINDS'].items():
+                if key == REPLICA_BIND or key.startswith(SHARD_BIND_PREFIX):
+                    urls[key] = bind['url'] if isinstance(bind, dict) else bind
+            pragmas = sqlite_pragmas(self.config)
+            engines = {}
+            for key, url in urls.items():
+                engine = create_async_engine(async_url(url), **async_engine_options(url, self.config))
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine.sync_engine, 'connect', sqlite_connect_listener(pragmas))
+                engines[key] = engine
+            self._engines = engines
+        return self._engines
+
+    def locations(self):
+        """Every database that can hold per-cafe rows, like shards.locations"""
+        return [shards.CONTROL] + self.config['SHARDS']
+
+    def session(self, location=shards.CONTROL, replica=False):
+        """Session with per-cafe tables on a location's database and the rest on the primary or the replica
+
+        Only models on the default bind are mapped; the archive is read by the
+        sync views.
+        """
+        binds = self._binds.get((location, replica))
+        if binds is None:
+            main = self.engines[REPLICA_BIND if replica else None]
+            # The main database also holds the cafes that were never moved to a shard
+            per_cafe = self.engines[SHARD_BIND_PREFIX + location] if location else main
+            binds = self._binds[(location, replica)] = {
+                mapper.class_: per_cafe if mapper.local_table.info.get('sharded') else main
+                for mapper in db.Model.registry.mappers
+                if mapper.local_table.metadata.info.get('bind_key') is None
+            }
+        return AsyncSession(binds=binds, expire_on_commit=False)
+
+    async def cafe_location(self, cafe_id):
+        """Async shards.cafe_location; the shard name, sharing the sync views' cache"""
+        if not self.config['SHARDS']:
+            return shards.CONTROL
+        entry = shards.cached_location(cafe_id)
+        if entry is None:
+            async with self.engines[None].connect() as conn:
+                row = (await conn.execute(shards.location_query(cafe_id))).first()
+            entry = shards.remember_location(cafe_id, row, self.config['SHARD_MAP_CACHE_SECONDS'])
+        return entry[0]
+
+    async def read_from_replica(self, cookie_header):
+        """Whether a read goes to the replica, by the same rules as routing.choose_route"""
+        if REPLICA_BIND not in self.engines:
+            return False
+
+        cookie = SimpleCookie(cookie_header or '').get(READ_YOUR_WRITES_COOKIE)
+        try:
+            primary_until = float(cookie.value) if cookie else None
+        except ValueError:
+            primary_until = None
+        if primary_until and primary_until > time.time():
+            metrics.incr('db.reads.primary_read_your_writes')
+            return False
+
+        if monitor.is_due(self.config):
+            # The lag check uses the sync replica engine, so it runs off the event loop
+            await asyncio.to_thread(self._check_replica)
+        if not monitor.last_verdict(self.config):
+            metrics.incr('db.reads.primary_replica_unavailable')
+            return False
+
+        metrics.incr('db.reads.replica')
+        return True
+
+    def _check_replica(self):
+        with self.app.app_context():
+            monitor.is_usable()
+
+    async def dispose(self):
+        if self._engines is not None:
+            for engine in self._engines.values():
+                await engine.dispose()
+            self._engines = None
+            self._binds.clear()
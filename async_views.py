@@ -0,0 +1,338 @@
+import asyncio
+import re
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from flask_cors.core import get_cors_headers, get_cors_options
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from werkzeug.datastructures import Headers
+
+from app import cors_options
+from allocator import TableInfo, bookings_query, build_allocator, day_bookings, tables_query
+from async_database import AsyncDatabase
+from cafes import (
+    CAFE_DETAIL, SEATING_TABLE, availability, cafe_detail, grid_availability, seating_list, seating_query, without_booked,
+    zone_tables_query, zones_query
+)
+from fieldsets import FieldError, subselection, wants
+import grid
+from metrics import metrics
+from models import Cafe, Reservation, Table, Zone
+from schedule import get_schedule
+import singleflight
+from turn_times import booking_duration, cached_turn_times, remember_turn_times, turn_times_query
+from utils import is_valid_time_slot, service_minutes
+
+# Returned by a view to have the Flask view answer the request instead
+FALL_THROUGH = object()
+
+
+class AsyncRequest:
+    """The parts of an ASGI request the async views use"""
+
+    def __init__(self, scope, database):
+        self.database = database
+        self.headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+        # First value wins, like request.args.get
+        self.args = {}
+        for name, value in parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True):
+            self.args.setdefault(name, value)
+        self.replica = False
+
+    def session(self, location=None):
+        return self.database.session(location, self.replica)
+
+
+async def load_turn_times(request, session, cafe_id):
+    """Async turn_times.get_turn_times, sharing its cache"""
+    model = cached_turn_times(cafe_id)
+    if model is None:
+        rows = await session.execute(turn_times_query(cafe_id))
+        model = remember_turn_times(cafe_id, rows, request.database.config['TURN_TIME_CACHE_SECONDS'])
+    return model
+
+
+async def get_cafes(request):
+    try:
+        try:
+            fields = Cafe.FIELDS.select(request.args.get('fields'))
+        except FieldError as e:
+            return {'success': False, 'message': str(e)}, 400
+
+        async with request.session() as session:
+            cafes = (await session.execute(
+                select(Cafe).options(*Cafe.FIELDS.only(Cafe, fields)).filter_by(is_active=True).order_by(Cafe.name)
+            )).scalars().all()
+
+        return {
+            'success': True,
+            'cafes': [cafe.to_dict(fields) for cafe in cafes]
+        }
+
+    except Exception as e:
+        return {'success': False, 'message': str(e)}, 500
+
+
+async def get_cafe(request, cafe_id):
+    try:
+        try:
+            fields = CAFE_DETAIL.select(request.args.get('fields'))
+        except FieldError as e:
+            return {'success': False, 'message': str(e)}, 400
+
+        location = await request.database.cafe_location(cafe_id)
+        async with request.session(location) as session:
+            cafe = (await session.execute(
+                select(Cafe).options(*Cafe.FIELDS.only(Cafe, fields)).filter_by(id=cafe_id, is_active=True)
+            )).scalars().first()
+
+            if not cafe:
+                return {'success': False, 'message': 'Cafe not found'}, 404
+
+            zones, tables = [], []
+            if wants(fields, 'zones'):
+                zone_fields = subselection(fields, 'zones')
+                zones = (await session.execute(zones_query(cafe_id, zone_fields))).scalars().all()
+                if wants(zone_fields, 'tables'):
+                    table_fields = subselection(zone_fields, 'tables')
+                    tables = (await session.execute(
+                        zone_tables_query([zone.id for zone in zones], table_fields)
+                    )).scalars().all()
+
+        return {
+            'success': True,
+            'cafe': cafe_detail(cafe, zones, tables, fields)
+        }
+
+    except Exception as e:
+        return {'success': False, 'message': str(e)}, 500
+
+
+async def compute_availability(request, location, cafe_id, reservation_date, guests):
+    """Async cafes.compute_availability, in a session of its own so waiting requests can share it"""
+    async with request.session(location) as session:
+        cafe = (await session.execute(select(Cafe).filter_by(id=cafe_id, is_active=True))).scalars().first()
+        if not cafe:
+            return None
+
+        day_schedule = get_schedule(cafe).for_date(reservation_date)
+        turn_times = await load_turn_times(request, session, cafe.id)
+
+        tables = [TableInfo(*row) for row in await session.execute(tables_query(cafe_id))]
+        bookings = day_bookings(await session.execute(bookings_query(cafe_id, reservation_date)), reservation_date)
+        allocator = build_allocator(tables, bookings)
+
+        zones = (await session.execute(select(Zone).filter_by(cafe_id=cafe_id, is_active=True))).scalars().all()
+        return availability(day_schedule, turn_times, allocator, guests, reservation_date.weekday(), zones)
+
+
+async def get_availability(request, cafe_id):
+    try:
+        date_str = request.args.get('date')
+        guests = int(request.args.get('guests', 1))
+
+        if not date_str:
+            return {'success': False, 'message': 'Date is required'}, 400
+
+        try:
+            reservation_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return {'success': False, 'message': 'Invalid date format'}, 400
+
+        location = await request.database.cafe_location(cafe_id)
+        # The shared grid answers from memory when it holds the day (see grid.py)
+        result = None
+        day = grid.read_day(cafe_id, reservation_date, request.database.config)
+        if day:
+            async with request.session(location) as session:
+                turn_times = await load_turn_times(request, session, cafe_id)
+            result = grid_availability(day, reservation_date, guests, turn_times)
+
+        if result is None:
+            # Identical requests in flight share one computation (see singleflight.py)
+            route = 'replica' if request.replica else 'primary'
+            result = await singleflight.availability.do_async(
+                f'{cafe_id}:{reservation_date}:{guests}:{route}',
+                lambda: compute_availability(request, location, cafe_id, reservation_date, guests)
+            )
+            if result is None:
+                return {'success': False, 'message': 'Cafe not found'}, 404
+
+        time_slots, zones_info = result
+        return {
+            'success': True,
+            'date': date_str,
+            'guests': guests,
+            'timeSlots': time_slots,
+            'zones': zones_info
+        }
+
+    except Exception as e:
+        return {'success': False, 'message': str(e)}, 500
+
+
+async def get_zone_tables(request, cafe_id, zone_id):
+    try:
+        date_str = request.args.get('date')
+        time_str = request.args.get('time')
+        guests = int(request.args.get('guests', 1))
+        try:
+            fields = SEATING_TABLE.select(request.args.get('fields'))
+        except FieldError as e:
+            return {'success': False, 'message': str(e)}, 400
+
+        query = seating_query(cafe_id, zone_id, guests, fields)
+
+        location = await request.database.cafe_location(cafe_id)
+        async with request.session(location) as session:
+            if date_str and time_str:
+                try:
+                    reservation_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+                except ValueError:
+                    return {'success': False, 'message': 'Invalid date format'}, 400
+
+                if not is_valid_time_slot(time_str):
+                    return {'success': False, 'message': 'Invalid time format'}, 400
+
+                cafe = await session.get(Cafe, cafe_id)
+                if not cafe:
+                    return {'success': False, 'message': 'Cafe not found'}, 404
+
+                start_minute = service_minutes(time_str)
+                turn_times = await load_turn_times(request, session, cafe.id)
+                duration = booking_duration(cafe, reservation_date, guests, start_minute, turn_times)
+                query = without_booked(query, cafe_id, reservation_date, start_minute, duration)
+
+            tables = (await session.execute(query.order_by(Table.number))).scalars().all()
+
+        return {
+            'success': True,
+            'tables': seating_list(tables, fields)
+        }
+
+    except Exception as e:
+        return {'success': False, 'message': str(e)}, 500
+
+
+async def get_reservation(request, reservation_number):
+    try:
+        try:
+            fields = Reservation.FIELDS.select(request.args.get('fields'))
+        except FieldError as e:
+            return {'success': False, 'message': str(e)}, 400
+
+        if fields is None:
+            options = [selectinload(Reservation.cafe), selectinload(Reservation.table).selectinload(Table.zone)]
+        else:
+            # cafe_id finds the cafe's home database below
+            options = Reservation.FIELDS.options(Reservation, fields, eager='selectinload', extra=('cafe_id',))
+        query = select(Reservation).options(*options).filter_by(reservation_number=reservation_number)
+
+        async def lookup(location):
+            async with request.session(location) as session:
+                return (await session.execute(query)).scalars().first()
+
+        # Every database at once, where the sync view tries them in turn
+        locations = request.database.locations()
+        found = [(location, row) for location, row in zip(locations, await asyncio.gather(*map(lookup, locations)))
+                 if row is not None]
+
+        # A miss may be a reservation that has not reached the replica yet, or one in the
+        # archive; the Flask view handles both
+        if not found:
+            return FALL_THROUGH
+
+        # Rows of a cafe that is being moved can exist in two places
+        location, reservation = found[0]
+        home = await request.database.cafe_location(reservation.cafe_id)
+        if home != location:
+            reservation = await lookup(home)
+            if not reservation:
+                return FALL_THROUGH
+
+        return {
+            'success': True,
+            'reservation': reservation.to_dict(fields)
+        }
+
+    except Exception as e:
+        return {'success': False, 'message': str(e)}, 500
+
+
+# GET routes served on the event loop, with the same paths as their Flask views
+ROUTES = [
+    (re.compile(r'^/cafes/$'), get_cafes),
+    (re.compile(r'^/cafes/(?P<cafe_id>[^/]+)$'), get_cafe),
+    (re.compile(r'^/cafes/(?P<cafe_id>[^/]+)/availability$'), get_availability),
+    (re.compile(r'^/cafes/(?P<cafe_id>[^/]+)/zones/(?P<zone_id>[^/]+)/tables$'), get_zone_tables),
+    (re.compile(r'^/reservations/(?!my$|temp$)(?P<reservation_number>[^/]+)$'), get_reservation),
+]
+
+
+class AsyncApp:
+    """ASGI app that serves the read-heavy ROUTES with async views and passes every other request to Flask
+
+    A request to an async view holds no thread while it waits for the
+    database, so one worker keeps many of them open at once. The Flask app
+    runs on ASGI_FLASK_THREADS threads. Responses are the Flask views'
+    responses, JSON and CORS headers included.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.database = AsyncDatabase(flask_app)
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_FLASK_THREADS'])
+        self.cors = get_cors_options(flask_app, cors_options(flask_app))
+        self.compressor = flask_app.extensions.get('compression')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, view in ROUTES:
+                match = pattern.match(scope['path'])
+                if match:
+                    if await self.dispatch(view, match.groupdict(), scope, send):
+                        return
+                    break
+        await self.wsgi(scope, receive, send)
+
+    async def dispatch(self, view, params, scope, send):
+        """Run an async view and send its response; False when the Flask view should answer instead"""
+        request = AsyncRequest(scope, self.database)
+        # Like @read_only, which runs before the view
+        request.replica = await self.database.read_from_replica(request.headers.get('Cookie'))
+        result = await view(request, **params)
+        if result is FALL_THROUGH:
+            metrics.incr('async.fall_through')
+            return False
+        metrics.incr('async.requests')
+
+        payload, status = result if isinstance(result, tuple) else (result, 200)
+        response = self.flask_app.json.response(payload)
+        response.status_code = status
+        for name, value in get_cors_headers(self.cors, request.headers, 'GET').items():
+            response.headers.add(name, value)
+        if self.compressor is not None:
+            self.compressor.compress(response, request.headers.get('Accept-Encoding'))
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+        return True
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
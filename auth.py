@@ -2,14 +2,16 @@ from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
-import uuid
 
 from models import db, User, Admin, Role, AdminRole
+from ids import new_id
+from routing import plain_reads, start_writes, write_transaction
 from utils import validate_email, validate_phone, sanitize_string
 
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/register', methods=['POST'])
+@write_transaction
 def register():
     try:
         data = request.get_json()
@@ -35,6 +37,9 @@ def register():
         if phone and not validate_phone(phone):
             return jsonify({'success': False, 'message': 'Invalid phone format'}), 400
         
+        # Hashing is slow, and the write lock is held from the first query to the commit
+        password_hash = generate_password_hash(password)
+        
         # Check if user exists
         existing_user = User.query.filter_by(email=email).first()
         if existing_user:
@@ -42,9 +47,9 @@ def register():
         
         # Create user
         user = User(
-            id=str(uuid.uuid4()),
+            id=new_id(),
             email=email,
-            password_hash=generate_password_hash(password),
+            password_hash=password_hash,
             full_name=sanitize_string(full_name) if full_name else None,
             phone=phone.replace('-', '').replace(' ', '') if phone else None,
             is_verified=False
@@ -82,8 +87,11 @@ def register():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@write_transaction
 def login():
     try:
+        # Hashing is slow, so the password is checked before the write lock is taken
+        plain_reads()
         data = request.get_json()
         
         if not data:
@@ -131,6 +139,7 @@ def login():
         if admin and check_password_hash(admin.password_hash, password):
             # Admin login
             # Update last login
+            start_writes()
             admin.last_login_at = datetime.utcnow()
             db.session.commit()
             
@@ -0,0 +1,96 @@
+import io
+from contextlib import contextmanager
+from urllib.parse import unquote_to_bytes, urlsplit
+
+from flask import Blueprint, current_app, g, jsonify, request
+
+from metrics import metrics
+from models import db
+
+batch_bp = Blueprint('batch', __name__)
+
+# Blueprints whose GET routes a batch may call; the admin ones stream events and run reports
+BATCHABLE_BLUEPRINTS = {'auth', 'cafes', 'reservations'}
+# Not passed on to sub-requests: the batch's own body, and compression, as the batch response is compressed whole
+DROPPED_ENVIRON = {'CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_ACCEPT_ENCODING', 'werkzeug.request'}
+
+
+def sub_environ(path):
+    """A WSGI environ for GET `path` with the batch request's headers (cookies and Authorization included)"""
+    parts = urlsplit(path)
+    environ = {key: value for key, value in request.environ.items() if key not in DROPPED_ENVIRON}
+    environ.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': unquote_to_bytes(parts.path).decode('latin-1'),
+        'QUERY_STRING': parts.query,
+        'wsgi.input': io.BytesIO()
+    })
+    return environ
+
+
+@contextmanager
+def own_globals():
+    """Give a sub-request a copy of g, so its database routing and JWT do not carry over to the next one"""
+    state = g._get_current_object().__dict__
+    saved = dict(state)
+    try:
+        yield
+    finally:
+        state.clear()
+        state.update(saved)
+
+
+def dispatch(path):
+    """Run GET `path` through the app's views in this app context, so it shares the session; (status, body)"""
+    parts = urlsplit(path)
+    if not path.startswith('/') or parts.scheme or parts.netloc:
+        return 400, {'success': False, 'message': 'Path must start with /'}
+
+    app = current_app._get_current_object()
+    with own_globals(), app.request_context(sub_environ(path)):
+        if request.routing_exception is None and request.blueprint not in BATCHABLE_BLUEPRINTS:
+            return 400, {'success': False, 'message': 'This endpoint cannot be batched'}
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            current_app.logger.exception("Batched request to %s failed", path)
+            db.session.rollback()
+            return 500, {'success': False, 'message': 'Something went wrong'}
+        body = response.get_json(silent=True) if response.is_json else response.get_data(as_text=True)
+        return response.status_code, body
+
+
+@batch_bp.route('', methods=['POST'])
+def run_batch():
+    """Answer several GET requests in one round trip, e.g. the booking widget's startup calls
+
+    Body: {"requests": [{"id": "cafe", "path": "/cafes/<id>"}, ...]}. The
+    sub-requests run in order against the same views and database session,
+    with this request's cookies and Authorization header.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('requests')
+        limit = current_app.config['BATCH_MAX_REQUESTS']
+
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'message': 'requests must be a non-empty list'}), 400
+        if len(items) > limit:
+            return jsonify({'success': False, 'message': f'At most {limit} requests per batch'}), 400
+        if not all(isinstance(item, dict) and isinstance(item.get('path'), str) for item in items):
+            return jsonify({'success': False, 'message': 'Each request needs a path'}), 400
+
+        metrics.incr('batch.requests')
+        metrics.incr('batch.subrequests', len(items))
+        responses = []
+        for item in items:
+            status, body = dispatch(item['path'])
+            responses.append({'id': item.get('id'), 'status': status, 'body': body})
+
+        return jsonify({
+            'success': True,
+            'responses': responses
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
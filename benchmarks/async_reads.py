@@ -0,0 +1,194 @@
+"""Concurrent connections on the read endpoints: gunicorn gthread (wsgi.py) vs uvicorn (asgi.py)
+
+Starts one server worker at a time on a scratch copy of the seeded database:
+a gunicorn gthread worker with --threads threads, then a uvicorn worker
+running the async views. For each --connections count it opens that many
+keep-alive connections, each asking for a cafe's availability and details in
+a loop for --duration seconds, and prints requests per second, p50/p99
+latency and failed requests (errors, timeouts, non-200 answers).
+--db-latency-ms adds a wait to every SQL statement, on the thread that runs
+it, to stand in for a database over the network; that wait is what holds a
+gthread worker's threads, while the async views hold none.
+
+Usage (run from the repository root):
+    python benchmarks/async_reads.py --connections 10 100 500 1000 --duration 10 --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def prepare(path):
+    from app import create_app
+    from migrations import init_db
+    from models import Cafe
+    from seed import seed_data
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_data()
+        return Cafe.query.filter_by(name='BarSan').first().id
+
+
+def add_db_latency(ms):
+    """Sleep ms before every statement, in the thread that runs it (aiosqlite's own thread for the async engines)"""
+    def trace(statement):
+        time.sleep(ms / 1000)
+
+    @event.listens_for(Engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        if hasattr(dbapi_connection, 'run_async'):
+            dbapi_connection.run_async(lambda conn: conn._execute(conn._conn.set_trace_callback, trace))
+        else:
+            dbapi_connection.set_trace_callback(trace)
+
+
+def serve(mode, port, threads, db_latency_ms):
+    from app import create_app
+
+    if db_latency_ms:
+        add_db_latency(db_latency_ms)
+    app = create_app({'ASGI_FLASK_THREADS': threads})
+
+    if mode == 'async':
+        import uvicorn
+        from async_views import AsyncApp
+
+        uvicorn.run(AsyncApp(app), host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+        return
+
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for name, value in {'bind': f'127.0.0.1:{port}', 'workers': 1, 'worker_class': 'gthread',
+                                'threads': threads, 'worker_connections': 10000, 'backlog': 4096,
+                                'keepalive': 60, 'timeout': 120, 'loglevel': 'warning'}.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+async def request(reader, writer, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: keep-alive\r\n\r\n'.encode())
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def load(port, connections, duration, paths):
+    latencies, failures = [], Counter()
+
+    async def client(n):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 30)
+        except Exception as e:
+            failures[type(e).__name__] += 1
+            return
+        i = n
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status = await asyncio.wait_for(request(reader, writer, paths[i % len(paths)]), 30)
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    failures[status] += 1
+                i += 1
+        except Exception as e:
+            failures[type(e).__name__] += 1
+        finally:
+            writer.close()
+
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(n) for n in range(connections)))
+    return latencies, failures
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), 1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def run(mode, args, path, cafe_id):
+    port = args.port
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}')
+    server = subprocess.Popen([sys.executable, __file__, '--serve', mode, '--port', str(port),
+                               '--threads', str(args.threads), '--db-latency-ms', str(args.db_latency_ms)], env=env)
+    try:
+        wait_for(port)
+        day = (date.today() + timedelta(days=7)).isoformat()
+        paths = [f'/cafes/{cafe_id}/availability?date={day}&guests=2', f'/cafes/{cafe_id}']
+        for connections in args.connections:
+            started = time.perf_counter()
+            latencies, failures = asyncio.run(load(port, connections, args.duration, paths))
+            # Requests in flight at the deadline still finish, so divide by the time they took
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            ok = len(latencies) - sum(count for key, count in failures.items() if isinstance(key, int))
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+            detail = ', '.join(f"{key} x{count}" for key, count in failures.most_common(3))
+            print(f"{mode:>5} | {connections:>11} | {ok / elapsed:>5.0f} | {p50:>8.0f} ms | {p99:>8.0f} ms"
+                  f" | {sum(failures.values()):>6} {detail}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, nargs='+', default=[10, 100, 500, 1000])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--threads', type=int, default=4, help='gthread threads, and Flask threads for uvicorn')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='Added to every SQL statement')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.threads, args.db_latency_ms)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(prefix='async-reads-'), 'reads.db')
+    with multiprocessing.Pool(1) as pool:
+        cafe_id = pool.apply(prepare, (path,))
+
+    print(f"{'mode':>5} | {'connections':>11} | {'req/s':>5} | {'p50':>11} | {'p99':>11} | failed")
+    for mode in ('sync', 'async'):
+        run(mode, args, path, cafe_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Availability from the database vs the shared availability grid
+
+Generates --cafes cafes with a month of history and --future-days of upcoming
+bookings (--per-day per cafe and day) in a scratch SQLite database, builds
+the grid files with the writer (flask availability-grid --once), and then
+asks GET /cafes/<id>/availability for random cafes, days and party sizes
+through the app's test client: --requests times reading the database, and
+the same requests again reading the grid. Prints requests per second, p50/p95
+latency, SQL statements per request and the size of the grid files, which
+every worker maps and shares through the page cache.
+
+Usage (run from the repository root):
+    python benchmarks/availability_grid.py --cafes 10 --per-day 80 --requests 3000
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import create_app
+from datagen import DataGenerator
+from grid import GridWriter
+from migrations import init_db
+from models import Cafe
+
+
+def prepare(path, directory, cafes, per_day, future_days):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'AVAILABILITY_GRID_DIR': directory})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Anchored on the real today, as the requests ask about the coming days
+            DataGenerator(log=lambda message: None, anchor_date=date.today()).generate(
+                cafes=cafes, users=200, months=1, reservations_per_day=per_day, future_days=future_days
+            )
+        started = time.perf_counter()
+        GridWriter(app.config, log=lambda message: None).run(threading.Event(), once=True)
+        built = time.perf_counter() - started
+        return [cafe.id for cafe in Cafe.query.filter_by(is_active=True)], built
+
+
+def measure(config, urls):
+    app = create_app(config)
+    client = app.test_client()
+    statements = [0]
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count(*args):
+        statements[0] += 1
+
+    for url in urls[:50]:
+        client.get(url)
+    statements[0] = 0
+    latencies = []
+    started = time.perf_counter()
+    for url in urls:
+        request_started = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - request_started)
+        assert response.status_code == 200, response.get_json()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return len(urls) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)], \
+        statements[0] / len(urls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cafes', type=int, default=10)
+    parser.add_argument('--per-day', type=int, default=80, help='Reservations per cafe and day')
+    parser.add_argument('--future-days', type=int, default=30)
+    parser.add_argument('--requests', type=int, default=3000)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='grid-')
+    path, directory = os.path.join(scratch, 'grid.db'), os.path.join(scratch, 'grid')
+    # In a child process, so the measurements start without the generator's memory or caches
+    with multiprocessing.Pool(1) as pool:
+        cafe_ids, built = pool.apply(prepare, (path, directory, args.cafes, args.per_day, args.future_days))
+
+    rng = random.Random(7)
+    urls = [
+        f"/cafes/{rng.choice(cafe_ids)}/availability"
+        f"?date={(date.today() + timedelta(days=rng.randint(0, args.future_days))).isoformat()}"
+        f"&guests={rng.choice([1, 2, 2, 2, 3, 4, 4, 6, 8])}"
+        for _ in range(args.requests)
+    ]
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print(f"{len(cafe_ids)} cafes, grid files {size / 2 ** 20:.1f} MiB, built in {built:.1f}s")
+    print(f"{'source':>8} | {'req/s':>6} | {'p50':>8} | {'p95':>8} | SQL/request")
+    for name, grid_dir in (('database', None), ('grid', directory)):
+        config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'AVAILABILITY_GRID_DIR': grid_dir}
+        with multiprocessing.Pool(1) as pool:
+            rate, p50, p95, sql = pool.apply(measure, (config, urls))
+        print(f"{name:>8} | {rate:>6.0f} | {p50 * 1000:>5.2f} ms | {p95 * 1000:>5.2f} ms | {sql:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Bursts of identical availability requests, with and without single-flight
+
+Seeds a scratch SQLite database, then sends --bursts bursts of --concurrency
+simultaneous GET /cafes/<id>/availability requests through the app's test
+client, one thread per request. All requests of a burst ask for the same
+cafe, day and party size, and each burst asks for a new day, so every burst
+starts on a cold computation, like a link shared on social media. Prints
+requests per second, p50/p99 latency, SQL statements per burst and the
+single-flight counters, with SINGLE_FLIGHT off and on. --db-latency-ms adds a
+wait to every SQL statement to stand in for a database over the network.
+
+Usage (run from the repository root):
+    python benchmarks/availability_stampede.py --concurrency 200 --bursts 20 --db-latency-ms 2
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import create_app
+from metrics import metrics
+from migrations import init_db
+from models import Cafe
+from seed import seed_data
+
+
+def prepare(path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_data()
+        return Cafe.query.filter_by(name='BarSan').first().id
+
+
+def burst(app, url, concurrency):
+    barrier = threading.Barrier(concurrency)
+    latencies = []
+
+    def client():
+        test_client = app.test_client()
+        barrier.wait()
+        started = time.perf_counter()
+        response = test_client.get(url)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def measure(path, enabled, warm_url, urls, concurrency, db_latency_ms):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'SINGLE_FLIGHT': enabled})
+    statements = [0]
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count(*args):
+        statements[0] += 1
+        if db_latency_ms:
+            time.sleep(db_latency_ms / 1000)
+
+    # Warm the turn-time and schedule caches on a day no burst asks for
+    app.test_client().get(warm_url)
+    statements[0] = 0
+    latencies = []
+    started = time.perf_counter()
+    for url in urls:
+        latencies.extend(burst(app, url, concurrency))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    with app.app_context():
+        counters = {name.rsplit('.', 1)[1]: value for name, value in metrics.snapshot()['counters'].items()
+                    if name.startswith('singleflight.availability.')}
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], \
+        statements[0] / len(urls), counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=200, help='Identical requests per burst')
+    parser.add_argument('--bursts', type=int, default=20)
+    parser.add_argument('--db-latency-ms', type=float, default=2.0, help='Added to every SQL statement')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='stampede-'), 'stampede.db')
+    # In a child process, so the measurements start without the seeding's caches
+    with multiprocessing.Pool(1) as pool:
+        cafe_id = pool.apply(prepare, (path,))
+
+    urls = [f"/cafes/{cafe_id}/availability?date={(date.today() + timedelta(days=n)).isoformat()}&guests=2"
+            for n in range(args.bursts + 1)]
+    print(f"{'single-flight':>13} | {'req/s':>6} | {'p50':>9} | {'p99':>9} | SQL/burst | counters")
+    for enabled in (False, True):
+        with multiprocessing.Pool(1) as pool:
+            rate, p50, p99, sql, counters = pool.apply(
+                measure, (path, enabled, urls[0], urls[1:], args.concurrency, args.db_latency_ms)
+            )
+        detail = ', '.join(f"{name} {value}" for name, value in sorted(counters.items()))
+        print(f"{'on' if enabled else 'off':>13} | {rate:>6.0f} | {p50 * 1000:>6.1f} ms | {p99 * 1000:>6.1f} ms"
+              f" | {sql:>9.1f} | {detail}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""The booking widget's four startup requests, one after another vs in one POST /batch
+
+Seeds a scratch SQLite database and runs the widget's startup sequence
+--requests times through the app's test client: GET /cafes/, /cafes/<id>,
+/cafes/<id>/availability and /cafes/<id>/zones/<zone_id>/tables as four
+requests, then the same four as one batch. Both ask for gzip. Prints the
+server time (p50), SQL statements and bytes per sequence, and the time a
+client waits with --rtt-ms per round trip added (e.g. 150 ms on a slow
+mobile network). Only the round trips are modelled, not the bandwidth.
+
+Usage (run from the repository root):
+    python benchmarks/batch_startup.py --requests 300 --rtt-ms 150
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import create_app
+from migrations import init_db
+from models import Cafe, Zone
+from seed import seed_data
+
+
+def prepare(path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_data()
+        cafe = Cafe.query.filter_by(name='BarSan').first()
+        return cafe.id, Zone.query.filter_by(cafe_id=cafe.id).first().id
+
+
+def measure(path, paths, batched, requests):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    client = app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+    statements = [0]
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count(*args):
+        statements[0] += 1
+
+    def sequence():
+        if batched:
+            response = client.post('/batch', json={'requests': [{'path': path} for path in paths]}, headers=headers)
+            body = json.loads(gzip.decompress(response.data))
+            assert response.status_code == 200 and all(sub['status'] == 200 for sub in body['responses']), body
+            return len(response.data)
+        size = 0
+        for path in paths:
+            response = client.get(path, headers=headers)
+            assert response.status_code == 200, response.status_code
+            size += len(response.data)
+        return size
+
+    for _ in range(20):
+        sequence()
+    statements[0] = 0
+    latencies, size = [], 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        size = sequence()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2], statements[0] / requests, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300, help='Startup sequences per mode')
+    parser.add_argument('--rtt-ms', type=float, default=150.0, help='Network round trip added per request')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='batch-'), 'batch.db')
+    # In a child process, so the measurements start without the seeding's caches
+    with multiprocessing.Pool(1) as pool:
+        cafe_id, zone_id = pool.apply(prepare, (path,))
+
+    day = (date.today() + timedelta(days=3)).isoformat()
+    paths = [
+        '/cafes/',
+        f'/cafes/{cafe_id}',
+        f'/cafes/{cafe_id}/availability?date={day}&guests=2',
+        f'/cafes/{cafe_id}/zones/{zone_id}/tables?guests=2&date={day}&time=19:00',
+    ]
+    print(f"{'mode':>8} | {'round trips':>11} | {'server p50':>10} | {'SQL':>5} | {'bytes':>6} | client at {args.rtt_ms:.0f} ms RTT")
+    for name, batched in (('separate', False), ('batch', True)):
+        with multiprocessing.Pool(1) as pool:
+            p50, sql, size = pool.apply(measure, (path, paths, batched, args.requests))
+        trips = 1 if batched else len(paths)
+        print(f"{name:>8} | {trips:>11} | {p50 * 1000:>7.2f} ms | {sql:>5.1f} | {size:>6}"
+              f" | {p50 * 1000 + trips * args.rtt_ms:>7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
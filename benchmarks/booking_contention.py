@@ -0,0 +1,134 @@
+"""Parallel booking stress test against one SQLite database
+
+Starts --workers processes that each book through the app's test client for
+--duration seconds: a temporary hold, the reservation, and a cancellation of
+every fourth booking. All of them write to the same SQLite file, so they
+contend for its write lock the way gunicorn workers do. Prints the status
+codes per endpoint, throughput and the write retry metrics, for the write
+transaction helper (BEGIN IMMEDIATE plus retries) and, with --compare, for
+plain deferred transactions without retries, where each lock conflict is a
+failed request. A short --busy-timeout-ms stands in for more workers or
+slower transactions than this machine can produce.
+
+Usage (run from the repository root):
+    python benchmarks/booking_contention.py --workers 8 --duration 10 --busy-timeout-ms 50 --compare
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from metrics import metrics
+from migrations import init_db
+from models import Cafe
+from seed import seed_data
+
+
+def prepare(path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        seed_data()
+        return Cafe.query.filter_by(name='BarSan').first().id
+
+
+def worker(config, cafe_id, duration, seed, start, results):
+    app = create_app(config)
+    client = app.test_client()
+    rng = random.Random(seed)
+    statuses, errors = Counter(), Counter()
+
+    def call(step, method, path, body):
+        response = client.open(path, method=method, json=body)
+        statuses[(step, response.status_code)] += 1
+        if response.status_code >= 500:
+            errors[response.get_json().get('message', '')[:60]] += 1
+        return response
+
+    start.wait()
+    deadline = time.perf_counter() + duration
+    booked = 0
+    while time.perf_counter() < deadline:
+        day = date.today() + timedelta(days=rng.randint(30, 3000))
+        hold = call('temp', 'POST', '/reservations/temp', {
+            'cafeId': cafe_id, 'date': day.isoformat(), 'time': rng.choice(['18:00', '19:00', '20:00']),
+            'guests': rng.randint(1, 4), 'sessionId': f'stress-{seed}-{rng.random()}'
+        })
+        if hold.status_code != 200:
+            continue
+        created = call('create', 'POST', '/reservations/', {
+            'tempReservationId': hold.get_json()['tempReservation']['id'],
+            'guestName': 'Stress Test', 'guestEmail': 'stress@example.com', 'guestPhone': '0812345678'
+        })
+        if created.status_code != 200:
+            continue
+        booked += 1
+        if booked % 4 == 0:
+            number = created.get_json()['reservation']['reservationNumber']
+            call('cancel', 'DELETE', f'/reservations/{number}', {'email': 'stress@example.com'})
+
+    with app.app_context():
+        counters = {name: value for name, value in metrics.snapshot().get('counters', {}).items()
+                    if name.startswith('db.write')}
+    results.put((statuses, errors, booked, counters))
+
+
+def run(workers, duration, busy_timeout, immediate):
+    path = os.path.join(tempfile.mkdtemp(prefix='contention-'), 'stress.db')
+    # In a child process, so this one creates no app before the workers fork
+    with multiprocessing.Pool(1) as pool:
+        cafe_id = pool.apply(prepare, (path,))
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'SQLITE_BUSY_TIMEOUT_MS': busy_timeout,
+              'SQLITE_IMMEDIATE_WRITES': immediate}
+    if not immediate:
+        # No retries: the first lock conflict answers 503 (a 500 before write_transaction existed)
+        config['DB_WRITE_DEADLINE_SECONDS'] = 0
+    results = multiprocessing.Queue()
+    start = multiprocessing.Barrier(workers)
+    processes = [multiprocessing.Process(target=worker, args=(config, cafe_id, duration, i, start, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    statuses, errors, booked, counters = Counter(), Counter(), 0, Counter()
+    for _ in processes:
+        s, e, b, c = results.get()
+        statuses.update(s)
+        errors.update(e)
+        booked += b
+        counters.update(c)
+    for process in processes:
+        process.join()
+
+    print(f"{'immediate + retry' if immediate else 'deferred, no retry'}: {booked / duration:.0f} bookings/s")
+    for step in ('temp', 'create', 'cancel'):
+        codes = ', '.join(f"{code} x{count}" for (name, code), count in sorted(statuses.items()) if name == step)
+        print(f"  {step:<6} {codes}")
+    for message, count in errors.most_common(3):
+        print(f"  5xx x{count}: {message}")
+    if counters:
+        print('  ' + ', '.join(f"{name} {value}" for name, value in sorted(counters.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--busy-timeout-ms', type=int, default=5000, help='SQLITE_BUSY_TIMEOUT_MS for the run')
+    parser.add_argument('--compare', action='store_true', help='Also run with plain deferred transactions')
+    args = parser.parse_args()
+
+    run(args.workers, args.duration, args.busy_timeout_ms, immediate=True)
+    if args.compare:
+        run(args.workers, args.duration, args.busy_timeout_ms, immediate=False)
+
+
+if __name__ == '__main__':
+    main()
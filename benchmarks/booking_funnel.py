@@ -0,0 +1,142 @@
+"""Booking funnel load generator
+
+Each virtual user walks the booking widget's funnel against a running server:
+
+    GET /cafes/ -> GET /cafes/<id> -> GET /cafes/<id>/availability
+    -> POST /reservations/temp -> POST /reservations/
+
+Usage:
+    python benchmarks/booking_funnel.py --url http://127.0.0.1:5000 --users 32 --duration 30
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+
+class Recorder:
+    """Thread-safe latency and status collector"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, step, status, elapsed):
+        with self.lock:
+            self.latencies[step].append(elapsed)
+            self.statuses[step][status] += 1
+
+
+def call(base_url, method, path, recorder, step, body=None):
+    """Issue one request and record its latency; returns (status, json or None)"""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method)
+    if data is not None:
+        req.add_header('Content-Type', 'application/json')
+
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            status, payload = resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        status, payload = e.code, e.read()
+    except Exception:
+        status, payload = 'error', b''
+    recorder.record(step, status, time.perf_counter() - started)
+
+    try:
+        return status, json.loads(payload)
+    except ValueError:
+        return status, None
+
+
+def run_funnel(base_url, recorder, rng, days_ahead):
+    """Walk the funnel once"""
+    status, body = call(base_url, 'GET', '/cafes/', recorder, 'list_cafes')
+    if status != 200 or not body or not body.get('cafes'):
+        return
+    cafe = rng.choice(body['cafes'])
+
+    call(base_url, 'GET', f"/cafes/{cafe['id']}", recorder, 'get_cafe')
+
+    booking_date = (date.today() + timedelta(days=rng.randint(1, days_ahead))).isoformat()
+    guests = rng.choice([1, 2, 2, 2, 3, 4, 4, 6])
+    status, body = call(base_url, 'GET',
+                        f"/cafes/{cafe['id']}/availability?date={booking_date}&guests={guests}",
+                        recorder, 'availability')
+    if status != 200 or not body:
+        return
+    slots = [slot['time'] for slot in body.get('timeSlots', []) if slot.get('available')]
+    if not slots:
+        return
+
+    status, body = call(base_url, 'POST', '/reservations/temp', recorder, 'temp_hold', {
+        'cafeId': cafe['id'],
+        'date': booking_date,
+        'time': rng.choice(slots),
+        'guests': guests,
+        'sessionId': str(uuid.uuid4())
+    })
+    if status != 200 or not body:
+        return
+
+    call(base_url, 'POST', '/reservations/', recorder, 'create_reservation', {
+        'tempReservationId': body['tempReservation']['id'],
+        'guestName': 'Load Test',
+        'guestEmail': f"load{rng.randint(1, 10**9)}@example.com",
+        'guestPhone': '0812345678'
+    })
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=16, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--days-ahead', type=int, default=60, help='Spread bookings over this many days')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    funnels = Counter()
+
+    def user_loop(index):
+        rng = random.Random(args.seed * 1000 + index)
+        while time.monotonic() < deadline:
+            run_funnel(base_url, recorder, rng, args.days_ahead)
+            funnels[index] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(user_loop, range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    total_requests = sum(len(v) for v in recorder.latencies.values())
+    print(f"{args.users} users, {elapsed:.1f}s, {sum(funnels.values())} funnels, "
+          f"{total_requests} requests, {total_requests / elapsed:.1f} req/s")
+    print(f"{'step':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for step, values in recorder.latencies.items():
+        statuses = ', '.join(f"{k}={v}" for k, v in sorted(recorder.statuses[step].items(), key=str))
+        print(f"{step:<20}{len(values):>8}{statistics.median(values) * 1000:>10.1f}"
+              f"{percentile(values, 95) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}  {statuses}")
+
+
+if __name__ == '__main__':
+    main()
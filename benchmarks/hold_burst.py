@@ -0,0 +1,169 @@
+"""Burst of temporary holds, written one by one vs coalesced
+
+Starts --processes worker processes with --threads threads each, like
+gunicorn gthread workers, all posting holds (POST /reservations/temp) for
+the same cafe and evening through the app's test client for --duration
+seconds. It runs once with each request committing its own hold and once
+with HOLD_COALESCING, where each process's HoldWriter commits the holds
+queued by its threads together. Prints holds per second, failed requests,
+request latency and the average batch size. --writes-only skips the HTTP
+layer and times just the database writes from --threads threads in one
+process, which shows what the commits themselves cost.
+
+Usage (run from the repository root):
+    python benchmarks/hold_burst.py --processes 2 --threads 16 --duration 10
+    python benchmarks/hold_burst.py --writes-only --threads 32 --duration 5
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, insert
+
+from app import create_app
+from holds import writer_for
+from metrics import metrics
+from migrations import init_db
+from models import db, Cafe, TemporaryReservation
+from seed import seed_data
+
+
+def prepare(path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_data()
+        return Cafe.query.filter_by(name='BarSan').first().id
+
+
+def worker(config, cafe_id, threads, duration, start, results):
+    app = create_app(config)
+    day = (date.today() + timedelta(days=30)).isoformat()
+    statuses, latencies = Counter(), []
+
+    def post_holds():
+        client = app.test_client()
+        # A guest picking a slot replaces their hold a few times
+        sessions = [uuid.uuid4().hex for _ in range(4)]
+        n = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = client.post('/reservations/temp', json={
+                'cafeId': cafe_id, 'date': day, 'time': '19:00', 'guests': 2, 'sessionId': sessions[n % 4]
+            })
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+            n += 1
+
+    start.wait()
+    deadline = time.perf_counter() + duration
+    pool = [threading.Thread(target=post_holds) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    with app.app_context():
+        counters = metrics.snapshot()['counters']
+    results.put((statuses, latencies, counters.get('holds.batches', 0), counters.get('holds.written', 0)))
+
+
+def scratch_database():
+    path = os.path.join(tempfile.mkdtemp(prefix='holds-'), 'holds.db')
+    # In a child process, so this one creates no app before the workers fork
+    with multiprocessing.Pool(1) as pool:
+        return path, pool.apply(prepare, (path,))
+
+
+def write_holds(path, cafe_id, threads, duration, coalescing):
+    """Holds per second written straight to the database, each in its own transaction or through a HoldWriter"""
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    table = TemporaryReservation.__table__
+    with app.app_context():
+        engine = db.engine
+        writer = writer_for(engine)
+    written = Counter()
+
+    def write():
+        session_id = uuid.uuid4().hex
+        while time.perf_counter() < deadline:
+            values = {'id': str(uuid.uuid4()), 'cafe_id': cafe_id, 'date': date.today(), 'time': '19:00',
+                      'guests': 2, 'zone_id': None, 'session_id': session_id, 'expires_at': datetime.utcnow()}
+            if coalescing:
+                writer.submit(values).result()
+            else:
+                with engine.begin() as conn:
+                    conn.execute(delete(table).where(table.c.session_id == session_id))
+                    conn.execute(insert(table), [values])
+            written[threading.get_ident()] += 1
+
+    deadline = time.perf_counter() + duration
+    pool = [threading.Thread(target=write) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(written.values()) / duration
+
+
+def run(processes, threads, duration, coalescing):
+    path, cafe_id = scratch_database()
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'HOLD_COALESCING': coalescing}
+    results = multiprocessing.Queue()
+    start = multiprocessing.Barrier(processes)
+    workers = [multiprocessing.Process(target=worker, args=(config, cafe_id, threads, duration, start, results))
+               for _ in range(processes)]
+    for process in workers:
+        process.start()
+    statuses, latencies, batches, written = Counter(), [], 0, 0
+    for _ in workers:
+        s, l, b, w = results.get()
+        statuses.update(s)
+        latencies.extend(l)
+        batches += b
+        written += w
+    for process in workers:
+        process.join()
+
+    latencies.sort()
+    failed = sum(count for code, count in statuses.items() if code != 200)
+    batch = f"{written / batches:.1f}" if batches else '1'
+    print(f"{'coalesced' if coalescing else 'one by one':>10} | {statuses[200] / duration:>7.0f} | {failed:>6} | "
+          f"{latencies[len(latencies) // 2] * 1000:>6.1f} ms | {latencies[int(len(latencies) * 0.95)] * 1000:>6.1f} ms"
+          f" | {batch:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent requests per process')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--writes-only', action='store_true', help='Time the database writes without HTTP')
+    args = parser.parse_args()
+
+    if args.writes_only:
+        for coalescing in (False, True):
+            path, cafe_id = scratch_database()
+            with multiprocessing.Pool(1) as pool:
+                rate = pool.apply(write_holds, (path, cafe_id, args.threads, args.duration, coalescing))
+            print(f"{'coalesced' if coalescing else 'one by one':>10}: {rate:.0f} holds/s")
+        return
+
+    print(f"{'holds':>10} | {'holds/s':>7} | {'failed':>6} | {'p50':>9} | {'p95':>9} | {'hold/batch':>10}")
+    run(args.processes, args.threads, args.duration, coalescing=False)
+    run(args.processes, args.threads, args.duration, coalescing=True)
+
+
+if __name__ == '__main__':
+    main()
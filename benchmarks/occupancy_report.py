@@ -0,0 +1,94 @@
+"""Occupancy report benchmark on generated reservations (no database needed)
+
+Generates --days of bookings for a cafe with --tables tables and computes the
+table x weekday x bucket occupied-minutes grid behind /admin/reports/.../occupancy
+two ways: the vectorized path in reports.py, and a plain Python loop over the
+rows, which is what walking ORM objects comes down to once they are loaded.
+Both results are checked to be equal.
+
+Usage (run from the repository root):
+    python benchmarks/occupancy_report.py --tables 200 --days 365 --per-day 400
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reports import busy_minutes, trim_overlaps
+
+# Offsets from the start of the service day (06:00): 17:00 to 02:00
+OPEN, CLOSE, BUCKET = 11 * 60, 20 * 60, 30
+DURATIONS = (90, 120, 120, 150)
+
+
+def make_rows(rng, tables, days, per_day):
+    rows = []
+    for day in range(days):
+        for _ in range(per_day):
+            start = rng.randrange(OPEN, CLOSE - 60, 15)
+            end = min(CLOSE, start + rng.choice(DURATIONS))
+            rows.append((rng.randrange(tables), 738000 + day, start, end))
+    return rows
+
+
+def vectorized(rows, tables):
+    # Same per-column conversion as reports.load_intervals
+    table_idx, days, starts, ends = (np.fromiter((row[i] for row in rows), dtype=np.int64, count=len(rows))
+                                     for i in range(4))
+    table_idx, days, starts, ends = trim_overlaps(table_idx, days, starts, ends)
+    busy = busy_minutes(table_idx * 7 + (days - 1) % 7, tables * 7, starts, ends)
+    buckets = (CLOSE - OPEN) // BUCKET
+    return busy[:, OPEN:CLOSE].reshape(tables, 7, buckets, BUCKET).sum(axis=3)
+
+
+def row_by_row(rows, tables):
+    buckets = (CLOSE - OPEN) // BUCKET
+    used = [[[0] * buckets for _ in range(7)] for _ in range(tables)]
+    last_end = {}
+    for table, day, start, end in sorted(rows):
+        start = max(start, last_end.get((table, day), 0))
+        if start >= end:
+            continue
+        last_end[(table, day)] = end
+        row = used[table][(day - 1) % 7]
+        minute = start
+        while minute < end:
+            bucket_end = min(end, (minute // BUCKET + 1) * BUCKET)
+            row[(minute - OPEN) // BUCKET] += bucket_end - minute
+            minute = bucket_end
+    return np.array(used)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', type=int, default=200)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--per-day', type=int, default=400, help='Bookings per service day')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rows = make_rows(random.Random(args.seed), args.tables, args.days, args.per_day)
+    timings = {'vectorized': [], 'row-by-row': []}
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        fast = vectorized(rows, args.tables)
+        timings['vectorized'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        slow = row_by_row(rows, args.tables)
+        timings['row-by-row'].append(time.perf_counter() - started)
+        assert (fast == slow).all()
+
+    print(f"{args.tables} tables, {args.days} days, {len(rows)} reservations\n")
+    for name, values in timings.items():
+        print(f"{name:<12}{statistics.median(values) * 1000:>10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
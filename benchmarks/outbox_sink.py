@@ -0,0 +1,145 @@
+"""Local SMTP and HTTP stand-ins for the outbox worker
+
+Accepts mail on --smtp-port and webhook POSTs on --http-port, counts what
+arrives, and can add latency (--delay) and fail a share of deliveries
+(--fail-rate) with temporary errors (SMTP 451, HTTP 503) to exercise retries.
+Prints the counts every few seconds. Point the app at it with:
+
+    SMTP_HOST=127.0.0.1 SMTP_PORT=1025 SMTP_USE_TLS=false POS_WEBHOOK_URL=http://127.0.0.1:8099/pos
+
+Usage (run from the repository root):
+    python benchmarks/outbox_sink.py --delay 0.05 --fail-rate 0.1
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Sink:
+    """Delivery counters shared by both servers"""
+
+    def __init__(self, delay=0.0, fail_rate=0.0, seed=None):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'emails': 0, 'webhooks': 0, 'failed': 0}
+        self.deliveries = set()
+        self.duplicates = 0
+
+    def accept(self, kind, delivery_id=None):
+        """Wait out the delay and decide whether the delivery fails; counts it either way"""
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            if self.rng.random() < self.fail_rate:
+                self.counts['failed'] += 1
+                return False
+            self.counts[kind] += 1
+            if delivery_id is not None:
+                if delivery_id in self.deliveries:
+                    self.duplicates += 1
+                self.deliveries.add(delivery_id)
+            return True
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts, duplicates=self.duplicates)
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 outbox-sink ESMTP')
+        in_data = False
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if in_data:
+                if line == '.':
+                    in_data = False
+                    accepted = self.server.sink.accept('emails')
+                    self.reply('250 OK queued' if accepted else '451 Try again later')
+                continue
+            command = line[:4].upper()
+            if command == 'EHLO':
+                self.reply('250-outbox-sink')
+                self.reply('250 8BITMIME')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                in_data = True
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, sink):
+        self.sink = sink
+        super().__init__(address, SMTPHandler)
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        accepted = self.server.sink.accept('webhooks', self.headers.get('X-BarSan-Delivery'))
+        self.send_response(204 if accepted else 503)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, sink):
+        self.sink = sink
+        super().__init__(address, HTTPHandler)
+
+
+def start(sink, host='127.0.0.1', smtp_port=1025, http_port=8099):
+    """Serve both stand-ins from background threads; returns the servers (call shutdown() on them)"""
+    servers = [SMTPServer((host, smtp_port), sink), HTTPServer((host, http_port), sink)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--smtp-port', type=int, default=1025)
+    parser.add_argument('--http-port', type=int, default=8099)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to hold each delivery')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of deliveries to fail temporarily')
+    args = parser.parse_args()
+
+    sink = Sink(args.delay, args.fail_rate)
+    start(sink, args.host, args.smtp_port, args.http_port)
+    print(f"SMTP on {args.host}:{args.smtp_port}, HTTP on {args.host}:{args.http_port}")
+    last = None
+    try:
+        while True:
+            time.sleep(5)
+            counts = sink.snapshot()
+            if counts != last:
+                print(', '.join(f"{name} {value}" for name, value in counts.items()))
+                last = counts
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
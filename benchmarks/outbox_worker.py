@@ -0,0 +1,118 @@
+"""Outbox worker benchmark against the local SMTP/HTTP stand-ins
+
+Queues --messages outbox rows (half emails, half webhooks) in a scratch
+SQLite database, then drains them with `OutboxWorker` at each --concurrency
+level. The stand-ins from outbox_sink.py hold every delivery for --delay
+seconds and fail --fail-rate of them, which the worker retries. Reports
+throughput, send lag and the retry/dead counts per level, and compares what a
+booking request pays to queue its messages with sending them inline.
+
+Usage (run from the repository root):
+    python benchmarks/outbox_worker.py --messages 2000 --delay 0.05 --concurrency 1 8 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from migrations import init_db
+from models import db, OutboxMessage
+from outbox import OutboxWorker, add, send_email, send_webhook
+from outbox_sink import Sink, start
+
+SMTP_PORT, HTTP_PORT = 11025, 18099
+
+
+def payloads(count):
+    for i in range(count):
+        if i % 2:
+            yield 'email', {'to': f'guest{i}@example.com', 'subject': f'Reservation R{i}', 'body': 'Hello\n'}
+        else:
+            yield 'webhook', {'url': f'http://127.0.0.1:{HTTP_PORT}/pos', 'event': 'reservation.created',
+                              'cafeId': 'cafe', 'reservation': {'id': str(i), 'guests': 2}}
+
+
+def enqueue(count):
+    for kind, payload in payloads(count):
+        add(kind, payload, 'cafe', None)
+    db.session.commit()
+
+
+def drain(app, concurrency, batch_size):
+    worker = OutboxWorker(app.config, concurrency=concurrency, batch_size=batch_size, log=lambda line: None)
+    started = time.perf_counter()
+    # Retries come due after the (shortened) backoff, so poll until nothing is pending
+    while OutboxMessage.query.filter(OutboxMessage.status == 'pending').count():
+        if not worker.run_once():
+            time.sleep(0.01)
+    worker.pool.shutdown()
+    elapsed = time.perf_counter() - started
+    lags = sorted((m.sent_at - m.created_at).total_seconds() for m in OutboxMessage.query.filter_by(status='sent'))
+    return elapsed, lags, worker.totals
+
+
+def booking_cost(app, sink, rounds=50):
+    """Per-booking time to queue one email and one webhook vs sending both inline"""
+    (_, email), (_, webhook) = list(payloads(2))[::-1]
+    fail_rate, sink.fail_rate = sink.fail_rate, 0.0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        add('email', email)
+        add('webhook', webhook)
+        db.session.commit()
+    queued = (time.perf_counter() - started) / rounds
+    started = time.perf_counter()
+    for i in range(rounds):
+        send_email(f'inline-{i}', email, app.config)
+        send_webhook(f'inline-{i}', webhook, app.config)
+    inline = (time.perf_counter() - started) / rounds
+    sink.fail_rate = fail_rate
+    OutboxMessage.query.delete()
+    db.session.commit()
+    return queued, inline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--delay', type=float, default=0.05, help='Seconds the stand-ins hold each delivery')
+    parser.add_argument('--fail-rate', type=float, default=0.05, help='Share of deliveries failed temporarily')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    sink = Sink(args.delay, args.fail_rate, seed=42)
+    servers = start(sink, smtp_port=SMTP_PORT, http_port=HTTP_PORT)
+    path = os.path.join(tempfile.mkdtemp(), 'outbox.db')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SMTP_HOST': '127.0.0.1', 'SMTP_PORT': SMTP_PORT, 'SMTP_USE_TLS': False, 'SMTP_USER': None,
+        # Retry quickly so a run does not wait out production backoff
+        'OUTBOX_BACKOFF_SECONDS': 0.05, 'OUTBOX_MAX_BACKOFF_SECONDS': 0.2
+    })
+
+    with app.app_context():
+        init_db(log=lambda message: None)
+        queued, inline = booking_cost(app, sink)
+        print(f"per booking: queue 2 messages {queued * 1000:.2f} ms, send them inline {inline * 1000:.1f} ms")
+        print(f"{'concurrency':>11} | {'msg/s':>7} | {'lag p50':>8} | {'lag p95':>8} | {'retried':>7} | {'dead':>4}")
+        for concurrency in args.concurrency:
+            OutboxMessage.query.delete()
+            db.session.commit()
+            enqueue(args.messages)
+            elapsed, lags, totals = drain(app, concurrency, args.batch_size)
+            print(f"{concurrency:>11} | {args.messages / elapsed:>7.0f} | {lags[len(lags) // 2]:>7.2f}s | "
+                  f"{lags[int(len(lags) * 0.95)]:>7.2f}s | {totals['retried']:>7} | {totals['dead']:>4}")
+        print(f"sink: {sink.snapshot()}")
+
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
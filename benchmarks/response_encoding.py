@@ -0,0 +1,123 @@
+"""Admin reservation list bytes and encoding time: standard JSON vs orjson, uncompressed vs gzip and brotli
+
+Generates --cafes cafes with --months of history in a scratch SQLite
+database and asks GET /admin/reservations/<cafe_id>?limit=500 --requests
+times through the app's test client in four setups: Flask's standard JSON
+encoder without compression (the old behaviour), orjson without compression,
+and orjson with gzip and with brotli. Prints the bytes sent, the time spent
+encoding the payload to JSON and compressing it, and p50 latency.
+
+Needs orjson and brotli (pip install orjson brotli).
+
+Usage (run from the repository root):
+    python benchmarks/response_encoding.py --cafes 3 --months 3 --requests 100
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func
+
+from app import create_app
+from datagen import DataGenerator
+from migrations import init_db
+from models import db, Admin, AdminRole, Reservation, Role
+
+SETUPS = [
+    ('json', False, None),
+    ('orjson', True, None),
+    ('orjson+gzip', True, 'gzip'),
+    ('orjson+br', True, 'br'),
+]
+
+
+def prepare(path, cafes, months):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            DataGenerator(log=lambda message: None).generate(
+                cafes=cafes, users=100, months=months, reservations_per_day=40, future_days=30
+            )
+        cafe_id = db.session.query(Reservation.cafe_id).group_by(Reservation.cafe_id) \
+            .order_by(func.count().desc()).first()[0]
+        role = Role(name='bench_manager', display_name='Manager', permissions=json.dumps({'all': True}))
+        admin = Admin(username='bench', email='bench@example.com', password_hash='-', full_name='Bench Admin')
+        db.session.add_all([role, admin])
+        db.session.flush()
+        db.session.add(AdminRole(admin_id=admin.id, role_id=role.id, cafe_id=cafe_id))
+        db.session.commit()
+        return admin.id, cafe_id
+
+
+def measure(path, admin_id, cafe_id, fast, encoding, requests):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'JSON_FAST_ENCODER': fast,
+                      'COMPRESSION': encoding is not None})
+    with app.app_context():
+        token = create_access_token(identity=admin_id, additional_claims={'type': 'admin', 'username': 'bench'})
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': encoding or 'identity'}
+    url = f'/admin/reservations/{cafe_id}?limit=500'
+
+    payload = app.test_client().get(url, headers=headers | {'Accept-Encoding': 'identity'}).get_json()
+    assert len(payload['reservations']) == 500, len(payload['reservations'])
+    compressor = app.extensions.get('compression')
+
+    # Encoding and compression alone, on the view's payload
+    encode, compress = [], []
+    with app.app_context():
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = app.json.response(payload)
+            encode.append(time.perf_counter() - started)
+            if compressor is not None:
+                started = time.perf_counter()
+                compressor.compress(response, encoding)
+                compress.append(time.perf_counter() - started)
+
+    latencies, size = [], 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200 and response.headers.get('Content-Encoding') == encoding
+        size = len(response.data)
+    for timings in (encode, compress, latencies):
+        timings.sort()
+    median = lambda timings: timings[len(timings) // 2] if timings else 0
+    return size, median(encode), median(compress), median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cafes', type=int, default=3)
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='encoding-'), 'encoding.db')
+    # In a child process, so the measurements start without the generator's memory or caches
+    with multiprocessing.Pool(1) as pool:
+        admin_id, cafe_id = pool.apply(prepare, (path, args.cafes, args.months))
+
+    print(f"{'setup':>11} | {'bytes':>7} | {'encode':>8} | {'compress':>8} | {'p50':>8}")
+    for name, fast, encoding in SETUPS:
+        with multiprocessing.Pool(1) as pool:
+            size, encode, compress, p50 = pool.apply(
+                measure, (path, admin_id, cafe_id, fast, encoding, args.requests)
+            )
+        print(f"{name:>11} | {size:>7} | {encode * 1000:>5.2f} ms | {compress * 1000:>5.2f} ms"
+              f" | {p50 * 1000:>5.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
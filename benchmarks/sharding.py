@@ -0,0 +1,177 @@
+"""Write throughput with one database vs one shard per cafe
+
+For each --cafes count, creates that many cafes in a scratch SQLite database
+and runs --writers-per-cafe writer processes per cafe for --duration seconds.
+Each writer commits booking-shaped transactions for its cafe: an overlap
+check, the reservation insert, the daily counter upsert and the change log
+row. --hold-ms keeps each transaction open that much longer after its first
+write, standing in for allocator work and network round trips to a database
+server. The run is repeated with every cafe moved onto its own shard database
+(SHARD_DATABASE_URLS), and the script prints committed transactions per
+second and how many failed with "database is locked" for both layouts.
+
+Usage (run from the repository root):
+    python benchmarks/sharding.py --cafes 1 2 4 8 --writers-per-cafe 2 --duration 10 --hold-ms 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import exc
+
+from app import create_app
+from migrations import init_db
+from models import db, Cafe, Reservation, Table, Zone
+from seed import BOOKING_SETTINGS, OPENING_HOURS
+import changes
+import shards
+from stats import record_change
+
+TABLES_PER_CAFE = 8
+
+
+def app_config(directory, cafes, sharded):
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/main.db', 'SHARD_MAP_CACHE_SECONDS': 60}
+    if sharded:
+        config['SHARD_DATABASE_URLS'] = ','.join(f'c{i}=sqlite:///{directory}/c{i}.db' for i in range(cafes))
+    return config
+
+
+def prepare(directory, cafes, sharded):
+    """Create the cafes and their tables, then move each to its own shard; returns {cafe id: [table ids]}"""
+    app = create_app(app_config(directory, cafes, sharded))
+    with app.app_context():
+        init_db(log=lambda message: None)
+        shards.use_location(shards.CONTROL)
+        layout = {}
+        for i in range(cafes):
+            cafe = Cafe(name=f'Cafe {i}', display_name=f'Cafe {i}', opening_hours=json.dumps(OPENING_HOURS),
+                        settings=json.dumps(BOOKING_SETTINGS), is_active=True)
+            db.session.add(cafe)
+            db.session.flush()
+            zone = Zone(cafe_id=cafe.id, name='Main', capacity=TABLES_PER_CAFE * 4, is_active=True)
+            db.session.add(zone)
+            db.session.flush()
+            tables = [Table(cafe_id=cafe.id, zone_id=zone.id, number=n + 1, seats=4, min_guests=1, max_guests=4,
+                            status='available', is_active=True) for n in range(TABLES_PER_CAFE)]
+            db.session.add_all(tables)
+            db.session.flush()
+            layout[cafe.id] = [table.id for table in tables]
+        db.session.commit()
+        if sharded:
+            shards.move_cafes([(cafe_id, f'c{i}') for i, cafe_id in enumerate(layout)], wait=0,
+                              log=lambda message: None)
+        for engine in db.engines.values():
+            engine.dispose()
+    return layout
+
+
+def book(cafe_id, table_ids, rng, hold):
+    """One booking-shaped write transaction; returns True when it committed"""
+    day = date.today() + timedelta(days=rng.randint(1, 365))
+    start = rng.choice(range(17 * 60, 23 * 60, 30))
+    table_id = rng.choice(table_ids)
+    try:
+        shards.use_cafe(cafe_id, write=True)
+        Reservation.query.filter(
+            Reservation.overlapping(cafe_id, day, start, start + 120),
+            Reservation.table_id == table_id
+        ).count()
+        reservation = Reservation(
+            reservation_number=uuid.uuid4().hex[:20],
+            cafe_id=cafe_id,
+            table_id=table_id,
+            guest_name='Bench Guest',
+            guest_email='bench@example.com',
+            guest_phone='0812345678',
+            date=day,
+            time=f'{start // 60:02d}:{start % 60:02d}',
+            start_minute=start,
+            end_minute=start + 120,
+            guests=2,
+            duration=120,
+            status='pending'
+        )
+        db.session.add(reservation)
+        db.session.flush()
+        if hold:
+            time.sleep(hold)
+        record_change(None, reservation)
+        changes.record('created', reservation)
+        db.session.commit()
+        return True
+    except exc.OperationalError as e:
+        db.session.rollback()
+        if 'locked' not in str(e):
+            raise
+        return False
+
+
+def writer(config, cafe_id, table_ids, duration, hold, seed, start, results):
+    app = create_app(config)
+    rng = random.Random(seed)
+    committed = locked = 0
+    with app.app_context():
+        # Every writer is up before the clock starts
+        start.wait()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            if book(cafe_id, table_ids, rng, hold):
+                committed += 1
+            else:
+                locked += 1
+            # Each transaction gets a fresh session, like a request would
+            db.session.remove()
+    results.put((committed, locked))
+
+
+def run(cafes, sharded, writers_per_cafe, duration, hold):
+    directory = tempfile.mkdtemp(prefix='shards-')
+    # In a child process: apps created in this one would share the extension's per-bind metadata
+    with multiprocessing.Pool(1) as pool:
+        layout = pool.apply(prepare, (directory, cafes, sharded))
+    config = app_config(directory, cafes, sharded)
+    results = multiprocessing.Queue()
+    start = multiprocessing.Barrier(cafes * writers_per_cafe)
+    processes = [
+        multiprocessing.Process(target=writer, args=(config, cafe_id, table_ids, duration, hold, n * 1000 + i,
+                                                     start, results))
+        for i, (cafe_id, table_ids) in enumerate(layout.items())
+        for n in range(writers_per_cafe)
+    ]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return sum(c for c, _ in totals) / duration, sum(l for _, l in totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cafes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--writers-per-cafe', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--hold-ms', type=float, default=0.0, help='Extra time each transaction stays open')
+    args = parser.parse_args()
+    hold = args.hold_ms / 1000
+
+    print(f"{'cafes':>5} | {'writers':>7} | {'one db tx/s':>11} | {'locked':>6} | {'sharded tx/s':>12} | {'locked':>6}")
+    for cafes in args.cafes:
+        single, single_locked = run(cafes, False, args.writers_per_cafe, args.duration, hold)
+        sharded, sharded_locked = run(cafes, True, args.writers_per_cafe, args.duration, hold)
+        print(f"{cafes:>5} | {cafes * args.writers_per_cafe:>7} | {single:>11.0f} | {single_locked:>6} | "
+              f"{sharded:>12.0f} | {sharded_locked:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Full responses vs sparse fieldsets (fields=) on the reservation, cafe and table endpoints
+
+Generates --cafes cafes with --months of history in a scratch SQLite
+database, then asks each endpoint --requests times through the app's test
+client, once for the full payload and once with the fields a mobile list
+screen shows. Prints response bytes, requests per second, p50 latency and
+SQL statements per request for both.
+
+Usage (run from the repository root):
+    python benchmarks/sparse_fields.py --cafes 5 --months 3 --requests 500
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from app import create_app
+from datagen import DataGenerator
+from migrations import init_db
+from models import db, Cafe, Reservation, Zone
+
+
+def prepare(path, cafes, months):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db(log=lambda message: None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Anchored on the real today, as the requests ask about the coming days
+            DataGenerator(log=lambda message: None, anchor_date=date.today()).generate(
+                cafes=cafes, users=100, months=months, reservations_per_day=40, future_days=30
+            )
+        # The guest with the longest history, so /reservations/my returns full pages
+        user_id = db.session.query(Reservation.user_id).filter(Reservation.user_id.isnot(None)) \
+            .group_by(Reservation.user_id).order_by(func.count().desc()).first()[0]
+        cafe = Cafe.query.filter_by(is_active=True).first()
+        zone = Zone.query.filter_by(cafe_id=cafe.id).first()
+        numbers = [number for number, in db.session.query(Reservation.reservation_number)
+                   .filter(Reservation.table_id.isnot(None)).limit(200)]
+        return user_id, cafe.id, zone.id, numbers
+
+
+def measure(path, user_id, cafe_id, zone_id, numbers, requests):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        token = create_access_token(identity=user_id)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    statements = [0]
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count(*args):
+        statements[0] += 1
+
+    day = (date.today() + timedelta(days=3)).isoformat()
+    rng = random.Random(7)
+    endpoints = [
+        ('my (50)', lambda: '/reservations/my?limit=50',
+         'reservation_number,date,time,status,cafe.display_name'),
+        ('reservation', lambda: f'/reservations/{rng.choice(numbers)}',
+         'reservation_number,date,time,guests,status'),
+        ('cafes', lambda: '/cafes/', 'id,display_name,image'),
+        ('cafe', lambda: f'/cafes/{cafe_id}', 'display_name,zones.name,zones.tables.number'),
+        ('tables', lambda: f'/cafes/{cafe_id}/zones/{zone_id}/tables?guests=2&date={day}&time=19:00',
+         'number,seats,zone'),
+    ]
+    results = []
+    for name, url, fields in endpoints:
+        for label, suffix in (('full', ''), ('fields', fields)):
+            def get():
+                target = url()
+                if suffix:
+                    target += ('&' if '?' in target else '?') + 'fields=' + suffix
+                response = client.get(target, headers=headers)
+                assert response.status_code == 200, response.get_json()
+                return len(response.data)
+
+            for _ in range(20):
+                get()
+            statements[0] = 0
+            latencies, size = [], 0
+            started = time.perf_counter()
+            for _ in range(requests):
+                request_started = time.perf_counter()
+                size += get()
+                latencies.append(time.perf_counter() - request_started)
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            results.append((name, label, size / requests, requests / elapsed, latencies[len(latencies) // 2],
+                            statements[0] / requests))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cafes', type=int, default=5)
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='fields-'), 'fields.db')
+    # In a child process, so the measurements start without the generator's memory or caches
+    with multiprocessing.Pool(1) as pool:
+        user_id, cafe_id, zone_id, numbers = pool.apply(prepare, (path, args.cafes, args.months))
+    with multiprocessing.Pool(1) as pool:
+        results = pool.apply(measure, (path, user_id, cafe_id, zone_id, numbers, args.requests))
+
+    print(f"{'endpoint':>11} | {'payload':>7} | {'bytes':>7} | {'req/s':>6} | {'p50':>8} | SQL/request")
+    for name, label, size, rate, p50, sql in results:
+        print(f"{name:>11} | {label:>7} | {size:>7.0f} | {rate:>6.0f} | {p50 * 1000:>5.2f} ms | {sql:.1f}")
+
+
+if __name__ == '__main__':
+    main()
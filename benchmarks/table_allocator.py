@@ -0,0 +1,131 @@
+"""Table allocator benchmark on generated workloads (no database needed)
+
+Builds a cafe with --tables tables and books --reservations parties into one
+evening, one at a time as they would arrive. Reports per-booking allocation
+latency, how many parties were turned away, and the time for a full re-pack of
+the day. Best fit, with and without re-packing when no table is free, is
+compared with picking any free table that fits, which is roughly what manual
+assignment does.
+
+Usage (run from the repository root):
+    python benchmarks/table_allocator.py --tables 200 --reservations 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allocator import Booking, TableAllocator, TableInfo, build_allocator, repack
+
+# seats -> share of tables, and party size -> share of bookings
+TABLE_MIX = {2: 0.35, 4: 0.4, 6: 0.15, 8: 0.1}
+PARTY_MIX = {1: 0.05, 2: 0.4, 3: 0.15, 4: 0.2, 5: 0.08, 6: 0.07, 7: 0.03, 8: 0.02}
+OPEN, LAST_SEATING, DURATION = 17 * 60, 24 * 60, 120
+
+
+def make_tables(rng, count):
+    sizes = rng.choices(list(TABLE_MIX), weights=list(TABLE_MIX.values()), k=count)
+    return [TableInfo(f"t{i}", f"z{i % 4}", i, seats, max(1, seats - 3), seats)
+            for i, seats in enumerate(sorted(sizes), start=1)]
+
+
+def make_requests(rng, count):
+    requests = []
+    for i in range(count):
+        start = rng.randrange(OPEN, LAST_SEATING + 1, 30)
+        guests = rng.choices(list(PARTY_MIX), weights=list(PARTY_MIX.values()))[0]
+        requests.append(Booking(f"r{i}", guests, start, start + DURATION, None, 'confirmed'))
+    return requests
+
+
+def any_fit(rng):
+    """Any free table that seats the party, picked at random"""
+    def choose(allocator, guests, start, end):
+        free = allocator.free_tables(guests, start, end)
+        return rng.choice(free).id if free else None
+    return choose
+
+
+def best_fit(allocator, guests, start, end):
+    table = allocator.best_fit(guests, start, end)
+    return table.id if table else None
+
+
+def run(tables, requests, choose, with_repack=False):
+    """Book requests in arrival order; returns (placed bookings, rejected count, latencies in ms)"""
+    allocator = TableAllocator(tables)
+    placed, rejected, latencies = [], 0, []
+    for request in requests:
+        started = time.perf_counter()
+        table_id = choose(allocator, request.guests, request.start, request.end)
+        if table_id:
+            allocator.reserve(table_id, request.start, request.end)
+        elif with_repack:
+            # What allocator.assign_table does when no table is free
+            plan = repack(tables, placed + [request])
+            if plan:
+                placed = [booking._replace(table_id=plan[booking.id]) for booking in placed]
+                table_id = plan[request.id]
+                allocator = build_allocator(tables, placed + [request._replace(table_id=table_id)])
+        latencies.append((time.perf_counter() - started) * 1000)
+        if table_id:
+            placed.append(request._replace(table_id=table_id))
+        else:
+            rejected += 1
+    return placed, rejected, latencies
+
+
+def percentile(values, p):
+    return sorted(values)[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', type=int, default=200)
+    parser.add_argument('--reservations', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5, help='Workloads to generate (different seeds)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    strategies = ['any-fit', 'best-fit', 'best-fit+repack']
+    results = {name: {'rejected': [], 'latencies': []} for name in strategies}
+    build_ms, repack_ms = [], []
+
+    for round_number in range(args.rounds):
+        rng = random.Random(args.seed + round_number)
+        tables = make_tables(rng, args.tables)
+        requests = make_requests(rng, args.reservations)
+
+        runs = {
+            'any-fit': run(tables, requests, any_fit(rng)),
+            'best-fit': run(tables, requests, best_fit),
+            'best-fit+repack': run(tables, requests, best_fit, with_repack=True),
+        }
+        for name, (placed, rejected, latencies) in runs.items():
+            results[name]['rejected'].append(rejected)
+            results[name]['latencies'].extend(latencies)
+        best_fit_placed = runs['best-fit'][0]
+
+        started = time.perf_counter()
+        build_allocator(tables, best_fit_placed)
+        build_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        repack(tables, best_fit_placed)
+        repack_ms.append((time.perf_counter() - started) * 1000)
+
+    print(f"{args.tables} tables, {args.reservations} booking requests, {args.rounds} workloads\n")
+    print(f"{'strategy':<16}{'rejected':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<16}{statistics.mean(result['rejected']):>10.1f}"
+              f"{percentile(result['latencies'], 0.5):>10.3f}{percentile(result['latencies'], 0.99):>10.3f}")
+    print(f"\nload day (build_allocator): {statistics.mean(build_ms):.2f} ms")
+    print(f"full re-pack of the day:    {statistics.mean(repack_ms):.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+
+class TTLCache:
+    """Thread-safe in-process cache with per-entry expiry and LRU eviction (per worker)"""
+
+    def __init__(self, name, max_entries=256):
+        self.name = name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                metrics.incr(f'cache.{self.name}.miss')
+                return None
+            self._entries.move_to_end(key)
+        metrics.incr(f'cache.{self.name}.hit')
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
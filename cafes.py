@@ -1,61 +1,167 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime, time
-import json
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 
 from models import db, Cafe, Zone, Table, Reservation
-from utils import is_time_slot_available
+from fieldsets import Field, FieldError, Shape, column, subselection, wants
+from utils import is_valid_time_slot, service_minutes
+from routing import read_only, reading_from_replica
+from schedule import get_schedule
+from allocator import load_allocator
+import grid
+import singleflight
+from turn_times import booking_duration, get_turn_times
 
 cafes_bp = Blueprint('cafes', __name__)
 
+# Queries and payloads shared with the async views (see async_views.py)
+
+# Tables as listed under a cafe's zones, and as offered for a party (fields= on those endpoints)
+DETAIL_TABLE = Shape({name: Table.FIELDS.fields[name] for name in (
+    'id', 'number', 'seats', 'min_guests', 'max_guests', 'features', 'status'
+)})
+SEATING_TABLE = Shape({
+    **{name: Table.FIELDS.fields[name] for name in (
+        'id', 'number', 'seats', 'min_guests', 'max_guests', 'location', 'features'
+    )},
+    'zone': Field(lambda table: table.zone.name, ('zone_id',), 'zone', Shape({'name': column('name')}), joined=True),
+    'available': Field(lambda table: table.status == 'available', ('status',))
+})
+# GET /cafes/<id>; cafe_detail fills in the zones and their tables
+CAFE_DETAIL = Cafe.FIELDS.extend({
+    'zones': Field(shape=Zone.FIELDS.extend({'tables': Field(shape=DETAIL_TABLE)}))
+})
+
+def zones_query(cafe_id, fields=None):
+    return select(Zone).filter_by(cafe_id=cafe_id, is_active=True).order_by(Zone.sort_order).options(
+        *Zone.FIELDS.only(Zone, fields)
+    )
+
+def zone_tables_query(zone_ids, fields=None):
+    return select(Table).where(Table.zone_id.in_(zone_ids), Table.is_active == True).order_by(Table.number).options(
+        *DETAIL_TABLE.only(Table, fields, extra=('zone_id',))
+    )
+
+def cafe_detail(cafe, zones, tables, fields=None):
+    """A cafe with its zones, each listing its active tables; `fields` is a CAFE_DETAIL selection"""
+    cafe_dict = cafe.to_dict(fields)
+    if not wants(fields, 'zones'):
+        return cafe_dict
+    zone_fields = subselection(fields, 'zones')
+    cafe_dict['zones'] = []
+    
+    for zone in zones:
+        zone_dict = zone.to_dict(zone_fields)
+        if wants(zone_fields, 'tables'):
+            table_fields = subselection(zone_fields, 'tables')
+            zone_dict['tables'] = [
+                DETAIL_TABLE.dump(table, table_fields) for table in tables if table.zone_id == zone.id
+            ]
+        
+        cafe_dict['zones'].append(zone_dict)
+    return cafe_dict
+
+def availability(day_schedule, turn_times, allocator, guests, weekday, zones):
+    """Time slots with their free table counts, and the zones with tables that seat the party"""
+    suitable_tables = allocator.candidates(guests)
+    
+    time_slots = []
+    slots = zip(day_schedule.slots, day_schedule.labels) if day_schedule else []
+    for slot_start, label in slots:
+        duration = turn_times.duration(guests, weekday, slot_start, day_schedule.duration)
+        free_tables = allocator.free_tables(guests, slot_start, slot_start + duration)
+        
+        time_slots.append({
+            'time': label,
+            'available': len(free_tables) > 0,
+            'availableTables': len(free_tables)
+        })
+    
+    zones_info = []
+    for zone in zones:
+        zone_tables = [t for t in suitable_tables if t.zone_id == zone.id]
+        zones_info.append({
+            'id': zone.id,
+            'name': zone.name,
+            'availableTables': len(zone_tables)
+        })
+    return time_slots, zones_info
+
+def grid_availability(day, reservation_date, guests, turn_times):
+    """availability() from a day of the shared grid; None when the grid cannot answer"""
+    day_schedule = get_schedule(day.cafe).for_date(reservation_date)
+    try:
+        return availability(day_schedule, turn_times, day, guests, reservation_date.weekday(), day.zones)
+    except grid.GridMiss:
+        return None
+
+def seating_query(cafe_id, zone_id, guests, fields=None):
+    """Active tables of a zone that seat the party, with their zone loaded; `fields` is a SEATING_TABLE selection"""
+    options = SEATING_TABLE.options(Table, fields) if fields is not None else [joinedload(Table.zone)]
+    return select(Table).options(*options).where(
+        Table.cafe_id == cafe_id,
+        Table.zone_id == zone_id,
+        Table.is_active == True,
+        Table.min_guests <= guests,
+        Table.max_guests >= guests
+    )
+
+def without_booked(query, cafe_id, reservation_date, start_minute, duration):
+    """Exclude tables with any booking that overlaps the requested booking length"""
+    booked_table_ids = select(Reservation.table_id).where(
+        Reservation.overlapping(cafe_id, reservation_date, start_minute, start_minute + duration),
+        Reservation.status.in_(['pending', 'confirmed', 'seated']),
+        Reservation.table_id.isnot(None)
+    )
+    return query.where(~Table.id.in_(booked_table_ids.scalar_subquery()))
+
+def seating_list(tables, fields=None):
+    return [SEATING_TABLE.dump(table, fields) for table in tables]
+
 @cafes_bp.route('/', methods=['GET'])
+@read_only
 def get_cafes():
     try:
-        cafes = Cafe.query.filter_by(is_active=True).order_by(Cafe.name).all()
+        # Sparse fieldsets: only the columns the chosen fields use are read
+        try:
+            fields = Cafe.FIELDS.select(request.args.get('fields'))
+        except FieldError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        cafes = Cafe.query.options(*Cafe.FIELDS.only(Cafe, fields)).filter_by(is_active=True).order_by(Cafe.name).all()
         
         return jsonify({
             'success': True,
-            'cafes': [cafe.to_dict() for cafe in cafes]
+            'cafes': [cafe.to_dict(fields) for cafe in cafes]
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @cafes_bp.route('/<cafe_id>', methods=['GET'])
+@read_only
 def get_cafe(cafe_id):
     try:
-        cafe = Cafe.query.filter_by(id=cafe_id, is_active=True).first()
+        try:
+            fields = CAFE_DETAIL.select(request.args.get('fields'))
+        except FieldError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        cafe = Cafe.query.options(*Cafe.FIELDS.only(Cafe, fields)).filter_by(id=cafe_id, is_active=True).first()
         
         if not cafe:
             return jsonify({'success': False, 'message': 'Cafe not found'}), 404
         
-        # Get zones with tables
-        zones = Zone.query.filter_by(cafe_id=cafe_id, is_active=True).order_by(Zone.sort_order).all()
-        
-        cafe_dict = cafe.to_dict()
-        cafe_dict['zones'] = []
-        
-        for zone in zones:
-            tables = Table.query.filter_by(
-                zone_id=zone.id, 
-                is_active=True
-            ).order_by(Table.number).all()
-            
-            zone_dict = zone.to_dict()
-            zone_dict['tables'] = []
-            
-            for table in tables:
-                table_dict = {
-                    'id': table.id,
-                    'number': table.number,
-                    'seats': table.seats,
-                    'min_guests': table.min_guests,
-                    'max_guests': table.max_guests,
-                    'features': json.loads(table.features) if table.features else [],
-                    'status': table.status
-                }
-                zone_dict['tables'].append(table_dict)
-            
-            cafe_dict['zones'].append(zone_dict)
+        # Get zones with tables, unless the fields leave them out
+        zones, tables = [], []
+        if wants(fields, 'zones'):
+            zone_fields = subselection(fields, 'zones')
+            zones = db.session.execute(zones_query(cafe_id, zone_fields)).scalars().all()
+            if wants(zone_fields, 'tables'):
+                table_fields = subselection(zone_fields, 'tables')
+                tables = db.session.execute(zone_tables_query([zone.id for zone in zones], table_fields)).scalars().all()
+        cafe_dict = cafe_detail(cafe, zones, tables, fields)
         
         return jsonify({
             'success': True,
@@ -65,7 +171,28 @@ def get_cafe(cafe_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def compute_availability(cafe_id, reservation_date, guests):
+    """(time slots, zones) from the database, or None when the cafe does not exist"""
+    # Check if cafe exists
+    cafe = Cafe.query.filter_by(id=cafe_id, is_active=True).first()
+    if not cafe:
+        return None
+    
+    # Precompiled slot grid for this weekday; None when the cafe is closed
+    day_schedule = get_schedule(cafe).for_date(reservation_date)
+    # Booking length for this party size, which can differ by hour
+    turn_times = get_turn_times(cafe.id)
+    weekday = reservation_date.weekday()
+    
+    # Tables with the day's bookings placed on them
+    allocator = load_allocator(cafe_id, reservation_date)
+    
+    # Get zones info
+    zones = Zone.query.filter_by(cafe_id=cafe_id, is_active=True).all()
+    return availability(day_schedule, turn_times, allocator, guests, weekday, zones)
+
 @cafes_bp.route('/<cafe_id>/availability', methods=['GET'])
+@read_only
 def get_availability(cafe_id):
     try:
         # Get query parameters
@@ -81,56 +208,20 @@ def get_availability(cafe_id):
         except ValueError:
             return jsonify({'success': False, 'message': 'Invalid date format'}), 400
         
-        # Check if cafe exists
-        cafe = Cafe.query.filter_by(id=cafe_id, is_active=True).first()
-        if not cafe:
-            return jsonify({'success': False, 'message': 'Cafe not found'}), 404
+        # The shared grid answers from memory when it holds the day (see grid.py)
+        day = grid.read_day(cafe_id, reservation_date)
+        result = grid_availability(day, reservation_date, guests, get_turn_times(cafe_id)) if day else None
         
-        # Get existing reservations for the date
-        existing_reservations = Reservation.query.filter(
-            Reservation.cafe_id == cafe_id,
-            Reservation.date == reservation_date,
-            Reservation.status.in_(['pending', 'confirmed', 'seated'])
-        ).all()
-        
-        existing_times = [{'time': r.time, 'duration': r.duration} for r in existing_reservations]
-        
-        # Get suitable tables
-        suitable_tables = Table.query.filter(
-            Table.cafe_id == cafe_id,
-            Table.is_active == True,
-            Table.status == 'available',
-            Table.min_guests <= guests,
-            Table.max_guests >= guests
-        ).all()
-        
-        # Generate time slots (17:00 - 23:00, 30-minute intervals)
-        time_slots = []
-        for hour in range(17, 24):  # 17:00 to 23:30
-            for minute in [0, 30]:
-                if hour == 23 and minute > 0:  # Stop at 23:00
-                    break
-                
-                time_str = f"{hour:02d}:{minute:02d}"
-                is_available = is_time_slot_available(time_str, 120, existing_times)
-                
-                time_slots.append({
-                    'time': time_str,
-                    'available': is_available and len(suitable_tables) > 0,
-                    'availableTables': len(suitable_tables) if is_available else 0
-                })
-        
-        # Get zones info
-        zones = Zone.query.filter_by(cafe_id=cafe_id, is_active=True).all()
-        zones_info = []
-        
-        for zone in zones:
-            zone_tables = [t for t in suitable_tables if t.zone_id == zone.id]
-            zones_info.append({
-                'id': zone.id,
-                'name': zone.name,
-                'availableTables': len(zone_tables)
-            })
+        if result is None:
+            # Identical requests in flight share one computation (see singleflight.py)
+            route = 'replica' if reading_from_replica() else 'primary'
+            result = singleflight.availability.do(
+                f'{cafe_id}:{reservation_date}:{guests}:{route}',
+                lambda: compute_availability(cafe_id, reservation_date, guests)
+            )
+            if result is None:
+                return jsonify({'success': False, 'message': 'Cafe not found'}), 404
+        time_slots, zones_info = result
         
         return jsonify({
             'success': True,
@@ -144,21 +235,20 @@ def get_availability(cafe_id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @cafes_bp.route('/<cafe_id>/zones/<zone_id>/tables', methods=['GET'])
+@read_only
 def get_zone_tables(cafe_id, zone_id):
     try:
         # Get query parameters
         date_str = request.args.get('date')
         time_str = request.args.get('time')
         guests = int(request.args.get('guests', 1))
+        try:
+            fields = SEATING_TABLE.select(request.args.get('fields'))
+        except FieldError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         # Build base query
-        query = Table.query.filter(
-            Table.cafe_id == cafe_id,
-            Table.zone_id == zone_id,
-            Table.is_active == True,
-            Table.min_guests <= guests,
-            Table.max_guests >= guests
-        )
+        query = seating_query(cafe_id, zone_id, guests, fields)
         
         # If date and time provided, check availability
         if date_str and time_str:
@@ -167,36 +257,19 @@ def get_zone_tables(cafe_id, zone_id):
             except ValueError:
                 return jsonify({'success': False, 'message': 'Invalid date format'}), 400
             
-            # Get booked tables for this time slot
-            existing_reservations = Reservation.query.filter(
-                Reservation.cafe_id == cafe_id,
-                Reservation.date == reservation_date,
-                Reservation.time == time_str,
-                Reservation.status.in_(['pending', 'confirmed', 'seated']),
-                Reservation.table_id.isnot(None)
-            ).all()
+            if not is_valid_time_slot(time_str):
+                return jsonify({'success': False, 'message': 'Invalid time format'}), 400
             
-            booked_table_ids = [r.table_id for r in existing_reservations]
+            cafe = Cafe.query.get(cafe_id)
+            if not cafe:
+                return jsonify({'success': False, 'message': 'Cafe not found'}), 404
             
-            if booked_table_ids:
-                query = query.filter(~Table.id.in_(booked_table_ids))
-        
-        tables = query.order_by(Table.number).all()
-        
-        tables_data = []
-        for table in tables:
-            table_dict = {
-                'id': table.id,
-                'number': table.number,
-                'seats': table.seats,
-                'min_guests': table.min_guests,
-                'max_guests': table.max_guests,
-                'location': table.location,
-                'features': json.loads(table.features) if table.features else [],
-                'zone': table.zone.name,
-                'available': table.status == 'available'
-            }
-            tables_data.append(table_dict)
+            start_minute = service_minutes(time_str)
+            duration = booking_duration(cafe, reservation_date, guests, start_minute)
+            query = without_booked(query, cafe_id, reservation_date, start_minute, duration)
+        
+        tables = db.session.execute(query.order_by(Table.number)).scalars().all()
+        tables_data = seating_list(tables, fields)
         
         return jsonify({
             'success': True,
@@ -0,0 +1,97 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func
+
+from dashboard import admin_reservation
+from models import db, Reservation, ReservationChange
+import shards
+
+
+def record(op, reservation):
+    """Log a reservation write in the current transaction and return the change row
+
+    Flushes so the change's id (the cursor) is known before the commit.
+    """
+    change = ReservationChange(
+        cafe_id=reservation.cafe_id,
+        reservation_id=reservation.id,
+        op=op,
+        data=json.dumps(admin_reservation(reservation))
+    )
+    db.session.add(change)
+    db.session.flush()
+    return change
+
+
+def apply_table_moves(moves):
+    """Reassign reservations to tables ({reservation id: table id}) and log each move"""
+    if not moves:
+        return
+    for reservation in Reservation.query.filter(Reservation.id.in_(list(moves))):
+        reservation.table_id = moves[reservation.id]
+        record('updated', reservation)
+
+
+def head_cursor():
+    """Cursor of the newest change, to start syncing from"""
+    return db.session.query(func.max(ReservationChange.id)).scalar() or 0
+
+
+def oldest_cursor():
+    return db.session.query(func.min(ReservationChange.id)).scalar()
+
+
+def changes_since(cafe_id, since, limit=500, settle_seconds=1):
+    """Changes of a cafe after the cursor, oldest first; returns (changes, has_more, retry_after)
+
+    Changes younger than settle_seconds are held back: on databases with
+    concurrent writers a lower id can commit after a higher one, and a client
+    that had already moved past it would never see it. retry_after is how
+    many seconds until the first held-back change is served, or None if none
+    are held back (or there are more changes to fetch straight away).
+    """
+    query = ReservationChange.query.filter(
+        ReservationChange.cafe_id == cafe_id,
+        ReservationChange.id > since
+    )
+    served = query
+    if settle_seconds:
+        settled = datetime.utcnow() - timedelta(seconds=settle_seconds)
+        served = query.filter(ReservationChange.created_at <= settled)
+    rows = served.order_by(ReservationChange.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+
+    retry_after = None
+    if settle_seconds and not has_more:
+        first_held = query.filter(ReservationChange.created_at > settled).with_entities(
+            func.min(ReservationChange.created_at)
+        ).scalar()
+        if first_held is not None:
+            retry_after = round(max((first_held - settled).total_seconds(), 0), 1)
+    return rows[:limit], has_more, retry_after
+
+
+def is_expired(since):
+    """Whether changes after the cursor may already have been pruned"""
+    oldest = oldest_cursor()
+    return oldest is not None and since < oldest - 1
+
+
+def prune_changes(older_than_days):
+    """Delete changes older than the given number of days; returns the number deleted"""
+    if older_than_days < 1:
+        raise ValueError("older_than_days must be at least 1")
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = 0
+    # Cursors are per database, so is each one's head
+    for location in shards.locations():
+        with shards.using(location):
+            # The newest change always stays, so is_expired can tell that older ones were pruned
+            result = db.session.execute(delete(ReservationChange).where(
+                ReservationChange.created_at < cutoff,
+                ReservationChange.id < head_cursor()
+            ))
+            db.session.commit()
+        deleted += result.rowcount
+    return deleted
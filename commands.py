@@ -0,0 +1,263 @@
+import signal
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from archive import archive_reservations
+from changes import prune_changes
+from datagen import DEFAULT_ANCHOR_DATE, DataGenerator
+from grid import GridWriter, WriterRunning
+from migrations import init_db, convert_ids, SchemaVersionError
+from outbox import OutboxWorker, prune_sent, requeue_dead
+from seed import seed_data
+import shards
+from stats import rebuild_daily_stats
+from turn_times import compute_turn_times
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create tables and apply schema upgrades (idempotent)"""
+    try:
+        init_db(log=click.echo)
+    except SchemaVersionError as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('seed')
+@with_appcontext
+def seed_command():
+    """Seed the default cafes, zones, tables, roles and admin account"""
+    seed_data()
+
+
+@click.command('convert-ids')
+@click.option('--source-url', required=True, help='Database to copy from (e.g. sqlite:////data/barsan.db)')
+@click.option('--rekey', is_flag=True, help='Assign new time-ordered UUIDv7 ids and rewrite foreign keys')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per insert batch')
+@with_appcontext
+def convert_ids_command(source_url, rekey, batch_size):
+    """Copy data into the configured database, converting ids to ID_FORMAT"""
+    try:
+        convert_ids(source_url, rekey=rekey, batch_size=batch_size, log=click.echo)
+    except SchemaVersionError as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('archive-reservations')
+@click.option('--older-than-days', type=int, help='Archive reservations dated more than this many days ago '
+                                                  '[default: ARCHIVE_AFTER_DAYS]')
+@click.option('--batch-size', type=int, help='Rows moved per transaction [default: ARCHIVE_BATCH_SIZE]')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches')
+@with_appcontext
+def archive_reservations_command(older_than_days, batch_size, pause):
+    """Move old completed/cancelled/no-show reservations into the archive (resumable)"""
+    config = current_app.config
+    try:
+        moved = archive_reservations(
+            older_than_days or config['ARCHIVE_AFTER_DAYS'],
+            batch_size=batch_size or config['ARCHIVE_BATCH_SIZE'],
+            pause=pause,
+            log=click.echo
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Done: {moved} reservations archived")
+
+
+@click.command('rebuild-daily-stats')
+@click.option('--cafe-id', help='Only this cafe [default: all cafes]')
+@click.option('--from', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']), help='First service date')
+@click.option('--to', 'end_date', type=click.DateTime(formats=['%Y-%m-%d']), help='Last service date')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per read/insert batch')
+@with_appcontext
+def rebuild_daily_stats_command(cafe_id, start_date, end_date, batch_size):
+    """Recompute the per-cafe daily counters from live and archived reservations"""
+    rebuild_daily_stats(
+        cafe_id=cafe_id,
+        start_date=start_date.date() if start_date else None,
+        end_date=end_date.date() if end_date else None,
+        batch_size=batch_size,
+        log=click.echo
+    )
+
+
+@click.command('compute-turn-times')
+@click.option('--cafe-id', help='Only this cafe [default: all cafes]')
+@with_appcontext
+def compute_turn_times_command(cafe_id):
+    """Recompute booking durations from seated/completed history (run periodically, e.g. nightly)"""
+    compute_turn_times(cafe_id=cafe_id, log=click.echo)
+
+
+@click.command('prune-changes')
+@click.option('--older-than-days', type=int, help='Delete changes older than this [default: CHANGES_RETENTION_DAYS]')
+@with_appcontext
+def prune_changes_command(older_than_days):
+    """Delete old entries from the reservation change log"""
+    try:
+        deleted = prune_changes(older_than_days or current_app.config['CHANGES_RETENTION_DAYS'])
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Deleted {deleted} changes")
+
+
+@click.command('outbox-worker')
+@click.option('--concurrency', type=int, help='Messages sent at once [default: OUTBOX_CONCURRENCY]')
+@click.option('--batch-size', type=int, help='Messages claimed per batch [default: OUTBOX_BATCH_SIZE]')
+@click.option('--drain', is_flag=True, help='Exit once no message is due instead of polling')
+@with_appcontext
+def outbox_worker_command(concurrency, batch_size, drain):
+    """Send queued booking emails and POS webhooks (run one or more alongside the web workers)"""
+    config = current_app.config
+    worker = OutboxWorker(
+        config,
+        concurrency=concurrency or config['OUTBOX_CONCURRENCY'],
+        batch_size=batch_size or config['OUTBOX_BATCH_SIZE'],
+        log=click.echo
+    )
+    stop = threading.Event()
+    # Finish the batch in hand on SIGTERM/SIGINT; its lease would delay those messages otherwise
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    worker.run(stop, poll_interval=config['OUTBOX_POLL_SECONDS'], drain=drain)
+
+
+@click.command('requeue-outbox')
+@click.argument('ids', nargs=-1, type=int)
+@click.option('--shard', help='Shard the given ids are on [default: the main database]')
+@with_appcontext
+def requeue_outbox_command(ids, shard):
+    """Retry dead-lettered outbox messages (all of them, or the given ids)"""
+    click.echo(f"Requeued {requeue_dead(ids, location=shard)} messages")
+
+
+@click.command('prune-outbox')
+@click.option('--older-than-days', type=int, help='Delete sent messages older than this '
+                                                  '[default: OUTBOX_RETENTION_DAYS]')
+@with_appcontext
+def prune_outbox_command(older_than_days):
+    """Delete sent messages from the outbox"""
+    try:
+        deleted = prune_sent(older_than_days or current_app.config['OUTBOX_RETENTION_DAYS'])
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Deleted {deleted} messages")
+
+
+@click.command('availability-grid')
+@click.option('--once', is_flag=True, help='Build the grid files and exit instead of following changes')
+@with_appcontext
+def availability_grid_command(once):
+    """Keep the shared availability grid up to date (run exactly one, on the web workers' host)"""
+    config = current_app.config
+    if not config['AVAILABILITY_GRID_DIR']:
+        raise click.ClickException("Set AVAILABILITY_GRID_DIR to use the availability grid")
+    writer = GridWriter(config, log=click.echo)
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    try:
+        writer.run(stop, poll_interval=config['AVAILABILITY_GRID_POLL_SECONDS'],
+                   refresh_interval=config['AVAILABILITY_GRID_REFRESH_SECONDS'], once=once)
+    except WriterRunning as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('generate-data')
+@click.option('--cafes', default=10, show_default=True, help='Number of cafes')
+@click.option('--zones', default=3, show_default=True, help='Zones per cafe')
+@click.option('--tables', default=12, show_default=True, help='Tables per zone')
+@click.option('--users', default=10000, show_default=True, help='Number of users')
+@click.option('--months', default=12, show_default=True, help='Months of reservation history')
+@click.option('--per-day', default=80, show_default=True, help='Average reservations per cafe per day')
+@click.option('--future-days', default=30, show_default=True, help='Days of upcoming reservations')
+@click.option('--seed', default=42, show_default=True, help='Random seed for reproducible data')
+@click.option('--anchor-date', type=click.DateTime(formats=['%Y-%m-%d']),
+              default=DEFAULT_ANCHOR_DATE.isoformat(), show_default=True,
+              help='"Today" of the dataset: history ends and upcoming bookings start here')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per executemany batch')
+@with_appcontext
+def generate_data_command(cafes, zones, tables, users, months, per_day, future_days, seed, anchor_date,
+                          batch_size):
+    """Bulk-load a synthetic benchmark dataset"""
+    generator = DataGenerator(seed=seed, batch_size=batch_size, log=click.echo, anchor_date=anchor_date.date())
+    # New cafes start in the main database; `flask rebalance-shards` spreads them out
+    shards.use_location(shards.CONTROL)
+    try:
+        counts = generator.generate(
+            cafes=cafes,
+            zones_per_cafe=zones,
+            tables_per_zone=tables,
+            users=users,
+            months=months,
+            reservations_per_day=per_day,
+            future_days=future_days
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for table_name, count in counts.items():
+        click.echo(f"  {table_name}: {count}")
+    click.echo("Run `flask rebuild-daily-stats` to update the daily counters")
+
+
+def _location_name(location):
+    return 'main' if location is shards.CONTROL else location
+
+
+@click.command('rebalance-shards')
+@click.option('--even', is_flag=True, help='Also move cafes between shards to even out their load')
+@click.option('--dry-run', is_flag=True, help='Print the plan without moving anything')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per insert batch')
+@with_appcontext
+def rebalance_shards_command(even, dry_run, batch_size):
+    """Move cafes from the main database onto the shards in SHARD_DATABASE_URLS, busiest first"""
+    if not shards.enabled():
+        raise click.ClickException("Set SHARD_DATABASE_URLS to use sharding")
+    moves, shard_loads, loads = shards.plan_rebalance(even=even)
+    for cafe, target in moves:
+        click.echo(f"{cafe.name}: {_location_name(cafe.shard)} -> {target} ({loads.get(cafe.id, 0)} reservations)")
+    click.echo("Reservations per shard after the moves: "
+               + ', '.join(f"{name} {load}" for name, load in shard_loads.items()))
+    if dry_run or not moves:
+        return
+    copied = shards.move_cafes([(cafe.id, target) for cafe, target in moves], batch_size=batch_size, log=click.echo)
+    click.echo(f"Copied {copied} rows")
+    shards.remove_stray_rows(log=click.echo)
+
+
+@click.command('move-cafe')
+@click.argument('cafe_id')
+@click.argument('target')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per insert batch')
+@with_appcontext
+def move_cafe_command(cafe_id, target, batch_size):
+    """Move one cafe to a shard, or back to the main database with TARGET main"""
+    try:
+        copied = shards.move_cafes([(cafe_id, None if target == 'main' else target)],
+                                   batch_size=batch_size, log=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Copied {copied} rows")
+
+
+def register_commands(app):
+    """Register CLI commands on the Flask app"""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(convert_ids_command)
+    app.cli.add_command(archive_reservations_command)
+    app.cli.add_command(rebuild_daily_stats_command)
+    app.cli.add_command(compute_turn_times_command)
+    app.cli.add_command(prune_changes_command)
+    app.cli.add_command(outbox_worker_command)
+    app.cli.add_command(requeue_outbox_command)
+    app.cli.add_command(prune_outbox_command)
+    app.cli.add_command(availability_grid_command)
+    app.cli.add_command(generate_data_command)
+    app.cli.add_command(rebalance_shards_command)
+    app.cli.add_command(move_cafe_command)
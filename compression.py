@@ -0,0 +1,81 @@
+import gzip
+
+from flask import request
+from werkzeug.http import parse_accept_header
+
+from metrics import metrics
+
+try:
+    import brotli  # optional dependency: pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'text/css', 'text/csv', 'text/html', 'text/plain'
+}
+
+
+class Compressor:
+    """Compresses buffered responses with brotli (if installed) or gzip, whichever the client prefers
+
+    Only responses of COMPRESSIBLE_TYPES of at least `min_size` bytes are
+    compressed; smaller ones gain less than the work costs. Streamed responses
+    (the dashboard's event stream) and ones that already have a
+    Content-Encoding are left alone. Accept-Encoding is negotiated with its
+    q-values; on a tie brotli wins, as it is the smaller of the two.
+    """
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def compressible(self, response):
+        return (
+            not response.direct_passthrough and not response.is_streamed
+            and 200 <= response.status_code and response.status_code not in (204, 206, 304)
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in COMPRESSIBLE_TYPES
+            and (response.content_length or 0) >= self.min_size
+        )
+
+    def compress(self, response, accept_encoding):
+        """Compress `response` in place for a client that sent `accept_encoding`"""
+        if not self.compressible(response):
+            return response
+        # The body depends on the header now, so caches must keep one copy per value
+        response.vary.add('Accept-Encoding')
+        encoding = parse_accept_header(accept_encoding or '').best_match(self.encodings)
+        if encoding is None:
+            metrics.incr('compression.identity')
+            return response
+
+        data = response.get_data()
+        if encoding == 'br':
+            body = brotli.compress(data, quality=self.brotli_quality)
+        else:
+            body = gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        metrics.incr(f'compression.{encoding}')
+        metrics.incr('compression.bytes_in', len(data))
+        metrics.incr('compression.bytes_out', len(body))
+        return response
+
+
+def init_app(app):
+    """Compress the app's responses according to the COMPRESSION_* settings"""
+    if not app.config['COMPRESSION']:
+        return
+    compressor = Compressor(
+        app.config['COMPRESSION_MIN_BYTES'],
+        app.config['COMPRESSION_GZIP_LEVEL'],
+        app.config['COMPRESSION_BROTLI_QUALITY']
+    )
+    # The async views (asgi.py) compress their responses with it too
+    app.extensions['compression'] = compressor
+
+    @app.after_request
+    def compress_response(response):
+        return compressor.compress(response, request.headers.get('Accept-Encoding'))
@@ -0,0 +1,142 @@
+import os
+from datetime import timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Config:
+    """Default configuration, read from the environment"""
+    SECRET_KEY = os.getenv('SECRET_KEY', 'barsan-secret-key-2024')
+    JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key-2024')
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=7)
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///barsan.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    FRONTEND_URL = os.getenv('FRONTEND_URL', '*')
+
+    # Connection pool (see database.engine_options)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 5000))
+
+    # Read replica (see routing.py); unset means every query goes to the primary
+    REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+    REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 2))
+    REPLICA_LAG_SQL = os.getenv('REPLICA_LAG_SQL')
+    READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 10))
+
+    # Archive for old completed/cancelled/no-show reservations (see archive.py);
+    # unset ARCHIVE_DATABASE_URL keeps the archive table in the main database
+    ARCHIVE_DATABASE_URL = os.getenv('ARCHIVE_DATABASE_URL')
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+    ARCHIVE_PARTITION_BY_DATE = os.getenv('ARCHIVE_PARTITION_BY_DATE', 'false').lower() == 'true'
+
+    # Occupancy reports (see reports.py), cached per cafe and date range
+    REPORT_CACHE_SECONDS = int(os.getenv('REPORT_CACHE_SECONDS', 300))
+    REPORT_MAX_DAYS = int(os.getenv('REPORT_MAX_DAYS', 366))
+
+    # Booking durations from seated/completed history (see turn_times.py)
+    TURN_TIME_HISTORY_DAYS = int(os.getenv('TURN_TIME_HISTORY_DAYS', 180))
+    TURN_TIME_MIN_SAMPLES = int(os.getenv('TURN_TIME_MIN_SAMPLES', 30))
+    TURN_TIME_PERCENTILE = int(os.getenv('TURN_TIME_PERCENTILE', 80))
+    TURN_TIME_MIN_MINUTES = int(os.getenv('TURN_TIME_MIN_MINUTES', 60))
+    TURN_TIME_MAX_MINUTES = int(os.getenv('TURN_TIME_MAX_MINUTES', 240))
+    TURN_TIME_CACHE_SECONDS = int(os.getenv('TURN_TIME_CACHE_SECONDS', 600))
+
+    # Live dashboard events (see events.py); set EVENTS_REDIS_URL to fan out across workers
+    EVENTS_REDIS_URL = os.getenv('EVENTS_REDIS_URL')
+    EVENTS_BUFFER_SIZE = int(os.getenv('EVENTS_BUFFER_SIZE', 500))
+    EVENTS_HEARTBEAT_SECONDS = int(os.getenv('EVENTS_HEARTBEAT_SECONDS', 15))
+    EVENTS_MAX_STREAM_SECONDS = int(os.getenv('EVENTS_MAX_STREAM_SECONDS', 300))
+    # Lifetime of the stream-only tokens EventSource URLs carry (POST /admin/events/<cafe_id>/token)
+    EVENTS_TOKEN_SECONDS = int(os.getenv('EVENTS_TOKEN_SECONDS', 60))
+    # Open streams per worker, each holding a thread (0: no limit); gunicorn.conf.py sets it per worker class
+    EVENTS_MAX_STREAMS = int(os.getenv('EVENTS_MAX_STREAMS', 0))
+
+    # Reservation change log behind /admin/changes (see changes.py)
+    CHANGES_RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS', 30))
+    CHANGES_SETTLE_SECONDS = float(os.getenv('CHANGES_SETTLE_SECONDS', 1))
+
+    # Guest emails and POS webhooks, queued in outbox_messages and sent by
+    # `flask outbox-worker` (see outbox.py); emails need SMTP_HOST
+    SMTP_HOST = os.getenv('SMTP_HOST')
+    SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+    SMTP_USER = os.getenv('SMTP_USER')
+    SMTP_PASS = os.getenv('SMTP_PASS')
+    SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+    EMAIL_FROM = os.getenv('EMAIL_FROM', 'noreply@barsan.cafe')
+    POS_WEBHOOK_URL = os.getenv('POS_WEBHOOK_URL')
+    POS_WEBHOOK_SECRET = os.getenv('POS_WEBHOOK_SECRET')
+    OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', 8))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+    OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 1))
+    OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 300))
+    OUTBOX_SEND_TIMEOUT = float(os.getenv('OUTBOX_SEND_TIMEOUT', 10))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_BACKOFF_SECONDS', 10))
+    OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', 3600))
+    OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 14))
+    OUTBOX_BACKLOG_CACHE_SECONDS = float(os.getenv('OUTBOX_BACKLOG_CACHE_SECONDS', 5))
+
+    # Per-cafe shards (see shards.py): "name=url,name=url". Zones, tables and
+    # reservations of a cafe move to its shard with `flask rebalance-shards`
+    SHARD_DATABASE_URLS = os.getenv('SHARD_DATABASE_URLS')
+    SHARD_MAP_CACHE_SECONDS = float(os.getenv('SHARD_MAP_CACHE_SECONDS', 5))
+
+    # SQLite connection PRAGMAs (see database.sqlite_pragmas)
+    SQLITE_WAL_MODE = os.getenv('SQLITE_WAL_MODE', 'true').lower() == 'true'
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', 10000))
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 268435456))  # 256MB
+
+    # Write views (see routing.write_transaction): BEGIN IMMEDIATE on SQLite, then
+    # retries with jittered backoff on lock conflicts until the deadline, then 503
+    SQLITE_IMMEDIATE_WRITES = os.getenv('SQLITE_IMMEDIATE_WRITES', 'true').lower() == 'true'
+    DB_WRITE_DEADLINE_SECONDS = float(os.getenv('DB_WRITE_DEADLINE_SECONDS', 10))
+    DB_WRITE_BACKOFF_SECONDS = float(os.getenv('DB_WRITE_BACKOFF_SECONDS', 0.02))
+    DB_WRITE_MAX_BACKOFF_SECONDS = float(os.getenv('DB_WRITE_MAX_BACKOFF_SECONDS', 0.5))
+
+    # Holds (POST /reservations/temp) from concurrent requests written in shared
+    # transactions by one thread per worker and database (see holds.py); a batch is
+    # what queued up while the previous one was written, plus WINDOW_MS of waiting
+    HOLD_COALESCING = os.getenv('HOLD_COALESCING', 'false').lower() == 'true'
+    HOLD_COALESCE_WINDOW_MS = float(os.getenv('HOLD_COALESCE_WINDOW_MS', 0))
+    HOLD_COALESCE_MAX_BATCH = int(os.getenv('HOLD_COALESCE_MAX_BATCH', 100))
+
+    # Shared availability grid (see grid.py): per-cafe occupancy bits in memory-mapped
+    # files that `flask availability-grid` keeps up to date for every worker to read.
+    # Bookings and cafe, zone or table edits reach it within one poll; the refresh
+    # fills the days that roll into the horizon
+    AVAILABILITY_GRID_DIR = os.getenv('AVAILABILITY_GRID_DIR')
+    AVAILABILITY_GRID_DAYS = int(os.getenv('AVAILABILITY_GRID_DAYS', 90))
+    AVAILABILITY_GRID_POLL_SECONDS = float(os.getenv('AVAILABILITY_GRID_POLL_SECONDS', 0.5))
+    AVAILABILITY_GRID_REFRESH_SECONDS = float(os.getenv('AVAILABILITY_GRID_REFRESH_SECONDS', 60))
+
+    # Identical availability computations in flight share one result (see singleflight.py);
+    # with a Redis URL the workers coordinate too, so one of them computes for all
+    SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', 'true').lower() == 'true'
+    SINGLE_FLIGHT_REDIS_URL = os.getenv('SINGLE_FLIGHT_REDIS_URL', os.getenv('EVENTS_REDIS_URL'))
+    SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv('SINGLE_FLIGHT_TIMEOUT_SECONDS', 10))
+    SINGLE_FLIGHT_POLL_MS = float(os.getenv('SINGLE_FLIGHT_POLL_MS', 5))
+
+    # ASGI server (asgi.py): the read-heavy GET endpoints run as async views, every
+    # other request goes to the Flask app on this many threads per worker
+    ASGI_FLASK_THREADS = int(os.getenv('ASGI_FLASK_THREADS', 8))
+
+    # Responses: dates and datetimes as ISO 8601, encoded by orjson when installed
+    # (see json_provider.py), then compressed with brotli or gzip (see compression.py)
+    JSON_FAST_ENCODER = os.getenv('JSON_FAST_ENCODER', 'true').lower() == 'true'
+    COMPRESSION = os.getenv('COMPRESSION', 'true').lower() == 'true'
+    COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', 1024))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+
+    # POST /batch (see batch.py): GET sub-requests answered in one round trip
+    BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 10))
+
+    # /metrics answers admins, and scrapers sending this as a bearer token
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
@@ -0,0 +1,106 @@
+from datetime import date
+
+from sqlalchemy import case, func
+
+import events
+from models import db, Reservation, Table, Zone
+
+
+def counters(cafe_id):
+    """The dashboard stat tiles for a cafe"""
+    today = date.today()
+    # Separate counts, so each can use its own index
+    today_reservations = Reservation.query.filter(
+        Reservation.cafe_id == cafe_id,
+        Reservation.date == today
+    ).count()
+    pending_reservations = Reservation.query.filter(
+        Reservation.cafe_id == cafe_id,
+        Reservation.status == 'pending'
+    ).count()
+
+    available_tables, total_tables = db.session.query(
+        func.count(case((Table.status == 'available', 1))),
+        func.count(Table.id)
+    ).filter(Table.cafe_id == cafe_id, Table.is_active == True).one()
+
+    return {
+        'todayReservations': today_reservations,
+        'pendingReservations': pending_reservations,
+        'availableTables': available_tables,
+        'totalTables': total_tables
+    }
+
+
+def recent_reservations(cafe_id, limit=10):
+    """Latest bookings with their table and zone, loaded in one query"""
+    rows = db.session.query(Reservation, Table.number, Zone.name).outerjoin(
+        Table, Table.id == Reservation.table_id
+    ).outerjoin(
+        Zone, Zone.id == Table.zone_id
+    ).filter(
+        Reservation.cafe_id == cafe_id
+    ).order_by(Reservation.created_at.desc()).limit(limit).all()
+    return [reservation_summary(r, table_number, zone_name) for r, table_number, zone_name in rows]
+
+
+def reservation_summary(r, table_number=None, zone_name=None):
+    return {
+        'id': r.id,
+        'reservation_number': r.reservation_number,
+        'guest_name': r.guest_name,
+        'date': r.date.isoformat(),
+        'time': r.time,
+        'guests': r.guests,
+        'status': r.status,
+        'table': {'number': table_number, 'zone': zone_name} if table_number is not None else None,
+        'created_at': r.created_at.isoformat()
+    }
+
+
+def admin_reservation(r):
+    """A live or archived reservation as listed to admins"""
+    # Looked up by id, so a table_id changed earlier in the transaction is honoured
+    table = db.session.get(Table, r.table_id) if r.table_id else None
+    return {
+        'id': r.id,
+        'reservation_number': r.reservation_number,
+        'guest_name': r.guest_name,
+        'guest_email': r.guest_email,
+        'guest_phone': r.guest_phone,
+        'date': r.date.isoformat(),
+        'time': r.time,
+        'guests': r.guests,
+        'status': r.status,
+        'special_requests': r.special_requests,
+        'table': {
+            'id': table.id,
+            'number': table.number,
+            'zone': table.zone.name
+        } if table else None,
+        'created_at': r.created_at.isoformat()
+    }
+
+
+def publish_reservation(event_type, reservation, change=None):
+    """Push a committed reservation change and the refreshed counters to the cafe's dashboards
+
+    `change` is the change log row written with it; its cursor lets clients
+    fetch anything they missed from /admin/changes.
+    """
+    def build():
+        table = reservation.table
+        data = {
+            'reservation': reservation_summary(
+                reservation,
+                table.number if table else None,
+                table.zone.name if table else None
+            ),
+            'counters': counters(reservation.cafe_id)
+        }
+        if change is not None:
+            data['cursor'] = change.id
+        return data
+
+    # Built only while a dashboard of the cafe is open: the counters cost three COUNTs
+    events.publish(reservation.cafe_id, event_type, build)
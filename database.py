@@ -0,0 +1,147 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+from metrics import metrics
+from routing import REPLICA_BIND, SHARD_BIND_PREFIX, note_db_error, writes_to
+
+ARCHIVE_BIND = 'archive'
+
+
+def engine_options(url, config):
+    """Build SQLALCHEMY_ENGINE_OPTIONS for a database URL from the pool/timeout config"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+
+    if backend == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # In-memory databases use a StaticPool, which takes no pool sizing
+            return {}
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+        }
+
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+    if backend == 'postgresql':
+        options['connect_args'] = {
+            'connect_timeout': 10,
+            'application_name': 'barsan-backend',
+            'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"
+                       f" -c idle_in_transaction_session_timeout={config['DB_STATEMENT_TIMEOUT_MS'] * 6}",
+        }
+
+    return options
+
+
+def shard_urls(value):
+    """Parse SHARD_DATABASE_URLS ("name=url,name=url") into {name: url}"""
+    shards = {}
+    for entry in (value or '').split(','):
+        if not entry.strip():
+            continue
+        name, sep, url = entry.partition('=')
+        name = name.strip()
+        if not sep or not name or not url.strip():
+            raise ValueError(f"Invalid SHARD_DATABASE_URLS entry {entry!r}; expected name=url")
+        shards[name] = url.strip()
+    return shards
+
+
+def sqlite_pragmas(config):
+    """PRAGMAs applied to every new SQLite connection"""
+    return [
+        ('journal_mode', 'WAL' if config['SQLITE_WAL_MODE'] else 'DELETE'),
+        ('foreign_keys', 'ON'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT_MS']),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+        ('temp_store', 'MEMORY'),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+    ]
+
+
+def apply_engine_profile(app):
+    """Fill in engine options for the configured URLs unless they were set explicitly"""
+    if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+            app.config['SQLALCHEMY_DATABASE_URI'], app.config
+        )
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    replica_url = app.config.get('REPLICA_DATABASE_URL')
+    if replica_url and REPLICA_BIND not in binds:
+        binds[REPLICA_BIND] = {'url': replica_url, **engine_options(replica_url, app.config)}
+
+    # The archive bind always exists; by default it points at the main database
+    if ARCHIVE_BIND not in binds:
+        archive_url = app.config.get('ARCHIVE_DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI']
+        binds[ARCHIVE_BIND] = {'url': archive_url, **engine_options(archive_url, app.config)}
+
+    # One bind per shard; SHARDS lists their names and turns on routing by cafe
+    shards = shard_urls(app.config.get('SHARD_DATABASE_URLS'))
+    for name, url in shards.items():
+        binds.setdefault(SHARD_BIND_PREFIX + name, {'url': url, **engine_options(url, app.config)})
+    app.config['SHARDS'] = list(shards)
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_engines(app):
+    """Attach per-backend connection setup to the engines created by db.init_app"""
+    pragmas = sqlite_pragmas(app.config)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', sqlite_connect_listener(pragmas))
+                if app.config['SQLITE_IMMEDIATE_WRITES']:
+                    _sqlite_immediate_writes(engine)
+            event.listen(engine, 'handle_error', lambda context: note_db_error(context.original_exception))
+
+    metrics.register_collector('db_pool', pool_status)
+
+
+def sqlite_connect_listener(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return on_connect
+
+
+def _sqlite_immediate_writes(engine):
+    """Start the transactions of write_transaction views with BEGIN IMMEDIATE
+
+    Other transactions keep pysqlite's behaviour: no BEGIN before reads, and a
+    deferred BEGIN before the first write.
+    """
+    @event.listens_for(engine, 'begin')
+    def begin_immediate(connection):
+        if writes_to(connection.engine):
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def pool_status():
+    """Connection pool usage per bind (requires an app context)"""
+    stats = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        entry = {'pool': type(pool).__name__}
+        if hasattr(pool, 'checkedout'):
+            entry.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow()
+            })
+        stats[key or 'default'] = entry
+    return stats
@@ -0,0 +1,299 @@
+import random
+import string
+import time
+import uuid
+import json
+from datetime import datetime, date, timedelta, timezone
+from itertools import accumulate
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Cafe, Zone, Table, Reservation
+from ids import ID_GENERATOR, uuid7
+from utils import service_minutes
+
+# Day the generated history ends and the upcoming bookings start, so runs on different days match
+DEFAULT_ANCHOR_DATE = date(2025, 1, 1)
+
+# Party size weights (guests -> relative frequency), skewed towards couples and fours
+PARTY_SIZE_WEIGHTS = {1: 5, 2: 38, 3: 12, 4: 22, 5: 6, 6: 8, 7: 2, 8: 4, 10: 2, 12: 1}
+
+# Start time weights across an evening that runs 17:00 - 01:30
+TIME_OF_DAY_WEIGHTS = {
+    '17:00': 3, '17:30': 4, '18:00': 7, '18:30': 10, '19:00': 15, '19:30': 16,
+    '20:00': 15, '20:30': 12, '21:00': 9, '21:30': 6, '22:00': 5, '22:30': 4,
+    '23:00': 3, '23:30': 2, '00:00': 2, '00:30': 1, '01:00': 1, '01:30': 1
+}
+
+# Monday .. Sunday demand multipliers
+WEEKDAY_FACTORS = [0.6, 0.7, 0.8, 1.0, 1.4, 1.6, 1.1]
+
+SOURCE_WEIGHTS = {'website': 70, 'phone': 15, 'walk_in': 10, 'partner': 5}
+
+# Table sizes as (max_guests, min_guests, relative frequency)
+TABLE_SIZES = [(2, 1, 35), (4, 2, 40), (6, 3, 15), (8, 5, 7), (12, 7, 3)]
+
+OPENING_HOURS = {
+    day: {'open': '17:00', 'close': '02:00'}
+    for day in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+}
+
+FIRST_NAMES = ['Somchai', 'Nok', 'Ploy', 'Anan', 'Mali', 'Krit', 'Dao', 'Ton', 'Fah', 'Beam',
+               'Alex', 'Sam', 'Jamie', 'Chris', 'Taylor', 'Jordan', 'Robin', 'Casey']
+LAST_NAMES = ['Srisuk', 'Wong', 'Chai', 'Boonmee', 'Rattana', 'Smith', 'Lee', 'Tan', 'Kim', 'Garcia']
+
+
+class DataGenerator:
+    """Deterministic bulk loader for benchmark-scale databases"""
+
+    def __init__(self, seed=42, batch_size=5000, log=print, anchor_date=DEFAULT_ANCHOR_DATE):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.log = log
+        self.prefix = f"BENCH{seed}"
+        self.anchor_date = anchor_date
+        # Timestamps are relative to the anchor, not the clock
+        self.now = datetime.combine(anchor_date, datetime.min.time())
+        self.counts = {}
+
+        self._party_sizes, self._party_weights = _split_weights(PARTY_SIZE_WEIGHTS)
+        self._times, self._time_weights = _split_weights(TIME_OF_DAY_WEIGHTS)
+        self._sources, self._source_weights = _split_weights(SOURCE_WEIGHTS)
+
+    def new_id(self, created_at=None):
+        """Generate a reproducible UUID string from the seeded RNG"""
+        if ID_GENERATOR == 'uuid7':
+            timestamp_ms = int((created_at or self.now).replace(tzinfo=timezone.utc).timestamp() * 1000)
+            return str(uuid7(timestamp_ms=timestamp_ms, rng=self.rng))
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def generate(self, cafes=10, zones_per_cafe=3, tables_per_zone=12, users=10000,
+                 months=12, reservations_per_day=80, future_days=30):
+        """Generate the full dataset and return row counts per table"""
+        if Cafe.query.filter(Cafe.name.like(f"{self.prefix}-%")).first():
+            raise ValueError(f"Benchmark data for seed {self.seed} already exists")
+
+        started = time.perf_counter()
+
+        cafe_rows = self._generate_cafes(cafes)
+        table_rows = self._generate_zones_and_tables(cafe_rows, zones_per_cafe, tables_per_zone)
+        user_ids = self._generate_users(users)
+        self._generate_reservations(cafe_rows, table_rows, user_ids, months,
+                                    reservations_per_day, future_days)
+
+        elapsed = time.perf_counter() - started
+        total = sum(self.counts.values())
+        self.log(f"Generated {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+        return dict(self.counts)
+
+    def _bulk_insert(self, model, rows):
+        """Insert rows with a single executemany per batch"""
+        table = model.__table__
+        for start in range(0, len(rows), self.batch_size):
+            db.session.execute(insert(table), rows[start:start + self.batch_size])
+        db.session.commit()
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+
+    def _generate_cafes(self, count):
+        rows = []
+        for i in range(1, count + 1):
+            rows.append({
+                'id': self.new_id(),
+                'name': f"{self.prefix}-{i:03d}",
+                'display_name': f"Bench Cafe {i}",
+                'description': 'Generated benchmark cafe',
+                'address': f"{i} Benchmark Road",
+                'phone': f"02-{self.rng.randint(100, 999)}-{self.rng.randint(1000, 9999)}",
+                'opening_hours': json.dumps(OPENING_HOURS),
+                'is_active': True,
+                'created_at': self.now,
+                'updated_at': self.now
+            })
+        self._bulk_insert(Cafe, rows)
+        self.log(f"Created {len(rows)} cafes")
+        return rows
+
+    def _generate_zones_and_tables(self, cafe_rows, zones_per_cafe, tables_per_zone):
+        zone_rows = []
+        table_rows = []
+        sizes = [size[:2] for size in TABLE_SIZES]
+        size_weights = [size[2] for size in TABLE_SIZES]
+
+        for cafe in cafe_rows:
+            number = 0
+            for z in range(zones_per_cafe):
+                zone_id = self.new_id()
+                zone_tables = []
+                for _ in range(tables_per_zone):
+                    number += 1
+                    max_guests, min_guests = self.rng.choices(sizes, size_weights)[0]
+                    zone_tables.append({
+                        'id': self.new_id(),
+                        'cafe_id': cafe['id'],
+                        'zone_id': zone_id,
+                        'number': number,
+                        'seats': max_guests,
+                        'min_guests': min_guests,
+                        'max_guests': max_guests,
+                        'location': f"Zone {string.ascii_uppercase[z % 26]}",
+                        'features': json.dumps(['standard']),
+                        'status': 'available',
+                        'is_active': True,
+                        'sort_order': number,
+                        'created_at': self.now,
+                        'updated_at': self.now
+                    })
+                zone_rows.append({
+                    'id': zone_id,
+                    'cafe_id': cafe['id'],
+                    'name': f"Zone {string.ascii_uppercase[z % 26]}",
+                    'description': 'Generated zone',
+                    'capacity': sum(t['max_guests'] for t in zone_tables),
+                    'is_active': True,
+                    'sort_order': z,
+                    'created_at': self.now,
+                    'updated_at': self.now
+                })
+                table_rows.extend(zone_tables)
+
+        self._bulk_insert(Zone, zone_rows)
+        self._bulk_insert(Table, table_rows)
+        self.log(f"Created {len(zone_rows)} zones and {len(table_rows)} tables")
+        return table_rows
+
+    def _generate_users(self, count):
+        # Hashing is deliberately slow, so every generated user shares one hash
+        password_hash = generate_password_hash('password123')
+        user_ids = []
+        rows = []
+        for i in range(1, count + 1):
+            user_id = self.new_id()
+            user_ids.append(user_id)
+            rows.append({
+                'id': user_id,
+                'email': f"{self.prefix.lower()}-user{i:07d}@example.com",
+                'full_name': self._random_name(),
+                'phone': self._random_phone(),
+                'password_hash': password_hash,
+                'is_verified': True,
+                'created_at': self.now,
+                'updated_at': self.now
+            })
+            if len(rows) >= self.batch_size:
+                self._bulk_insert(User, rows)
+                rows = []
+        self._bulk_insert(User, rows)
+        self.log(f"Created {count} users")
+        return user_ids
+
+    def _generate_reservations(self, cafe_rows, table_rows, user_ids, months,
+                               reservations_per_day, future_days):
+        # Pre-compute the tables that fit each party size, per cafe
+        tables_by_cafe = {}
+        for table in table_rows:
+            tables_by_cafe.setdefault(table['cafe_id'], []).append(table)
+        fitting_by_cafe = {
+            cafe_id: {
+                guests: [t['id'] for t in tables if t['min_guests'] <= guests <= t['max_guests']]
+                for guests in self._party_sizes
+            }
+            for cafe_id, tables in tables_by_cafe.items()
+        }
+
+        today = self.anchor_date
+        first_day = today - timedelta(days=months * 30)
+        last_day = today + timedelta(days=future_days)
+        sequence = 0
+        rows = []
+
+        for cafe in cafe_rows:
+            cafe_tables = fitting_by_cafe.get(cafe['id'], {})
+            day = first_day
+            while day <= last_day:
+                expected = reservations_per_day * WEEKDAY_FACTORS[day.weekday()]
+                count = max(0, int(self.rng.gauss(expected, expected * 0.15)))
+                for _ in range(count):
+                    sequence += 1
+                    rows.append(self._reservation_row(sequence, cafe['id'], cafe_tables,
+                                                      user_ids, day, today))
+                    if len(rows) >= self.batch_size:
+                        self._bulk_insert(Reservation, rows)
+                        rows = []
+                day += timedelta(days=1)
+
+        self._bulk_insert(Reservation, rows)
+        self.log(f"Created {sequence} reservations")
+
+    def _reservation_row(self, sequence, cafe_id, cafe_tables, user_ids, day, today):
+        rng = self.rng
+        guests = rng.choices(self._party_sizes, cum_weights=self._party_weights)[0]
+        time_str = rng.choices(self._times, cum_weights=self._time_weights)[0]
+        # Bookings after midnight belong to the previous evening's service
+        start_minute = service_minutes(time_str)
+        starts_at = datetime.combine(day, datetime.min.time()) + timedelta(minutes=start_minute)
+
+        created_at = starts_at - timedelta(hours=rng.randint(1, 24 * 21))
+        fitting = cafe_tables.get(guests)
+        table_id = rng.choice(fitting) if fitting else None
+
+        confirmed_at = seated_at = completed_at = cancelled_at = None
+        if day < today:
+            roll = rng.random()
+            if roll < 0.08:
+                status = 'cancelled'
+                cancelled_at = created_at + (starts_at - created_at) * rng.random()
+            elif roll < 0.12:
+                status = 'no_show'
+                confirmed_at = created_at + timedelta(minutes=rng.randint(1, 120))
+            else:
+                status = 'completed'
+                confirmed_at = created_at + timedelta(minutes=rng.randint(1, 120))
+                seated_at = starts_at + timedelta(minutes=rng.randint(-5, 20))
+                # Larger parties stay longer
+                turn_minutes = max(30, int(rng.gauss(55 + guests * 12, 15)))
+                completed_at = seated_at + timedelta(minutes=turn_minutes)
+        else:
+            status = 'confirmed' if rng.random() < 0.7 else 'pending'
+            if status == 'confirmed':
+                confirmed_at = min(self.now, created_at + timedelta(minutes=rng.randint(1, 120)))
+
+        guest_name = self._random_name()
+        return {
+            'id': self.new_id(created_at),
+            'reservation_number': f"RSB{self.seed % 10000:04d}{sequence:09d}",
+            'user_id': rng.choice(user_ids) if user_ids and rng.random() < 0.6 else None,
+            'cafe_id': cafe_id,
+            'table_id': table_id,
+            'guest_name': guest_name,
+            'guest_email': f"{guest_name.split()[0].lower()}{sequence}@example.com",
+            'guest_phone': self._random_phone(),
+            'date': day,
+            'time': time_str,
+            'guests': guests,
+            'duration': 120,
+            'start_minute': start_minute,
+            'end_minute': start_minute + 120,
+            'status': status,
+            'special_requests': None,
+            'notes': None,
+            'source': rng.choices(self._sources, cum_weights=self._source_weights)[0],
+            'confirmed_at': confirmed_at,
+            'seated_at': seated_at,
+            'completed_at': completed_at,
+            'cancelled_at': cancelled_at,
+            'created_at': created_at,
+            'updated_at': completed_at or cancelled_at or confirmed_at or created_at
+        }
+
+    def _random_name(self):
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def _random_phone(self):
+        return f"0{self.rng.randrange(100000000, 1000000000)}"
+
+
+def _split_weights(weights):
+    """Split a {value: weight} mapping into values and cumulative weights for random.choices"""
+    return list(weights.keys()), list(accumulate(weights.values()))
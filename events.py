@@ -0,0 +1,278 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import jsonify
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+REDIS_CHANNEL_PREFIX = 'barsan:events:'
+REDIS_SEQUENCE_PREFIX = 'barsan:events:seq:'
+
+
+class StreamsFull(RuntimeError):
+    """This worker already holds EVENTS_MAX_STREAMS streams; answered with 503"""
+
+
+class EventBus:
+    """Per-cafe fan-out to the SSE streams of this process, with a replay buffer per cafe
+
+    Event ids increase by one per cafe, so a client's Last-Event-ID tells
+    whether everything after it is still in the buffer.
+    """
+
+    def __init__(self, buffer_size=500):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._buffers = defaultdict(lambda: deque(maxlen=self.buffer_size))
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, cafe_id, limit=None):
+        """A queue that receives the cafe's events; raises StreamsFull when `limit` streams are open"""
+        subscriber = queue.Queue()
+        with self._lock:
+            if limit and sum(len(subscribers) for subscribers in self._subscribers.values()) >= limit:
+                raise StreamsFull("Too many dashboards are connected, please try again shortly")
+            self._subscribers[cafe_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, cafe_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(cafe_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[cafe_id]
+
+    def deliver(self, cafe_id, event):
+        with self._lock:
+            self._buffers[cafe_id].append(event)
+            subscribers = list(self._subscribers.get(cafe_id, ()))
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def replay(self, cafe_id, last_id):
+        """Buffered events after last_id, or None if some of them are no longer buffered"""
+        with self._lock:
+            events = [event for event in self._buffers.get(cafe_id, ()) if event['id'] > last_id]
+        if events and events[0]['id'] != last_id + 1:
+            return None
+        return events
+
+    def has_subscribers(self, cafe_id):
+        with self._lock:
+            return bool(self._subscribers.get(cafe_id))
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class LocalBackend:
+    """Events stay in this process; enough for a single worker"""
+
+    def __init__(self, bus):
+        self.bus = bus
+        # Start above any id handed out before a restart
+        self._sequences = defaultdict(lambda: itertools.count(time.time_ns() // 1000))
+        self._last_ids = {}
+        self._lock = threading.Lock()
+
+    def publish(self, cafe_id, event_type, data):
+        with self._lock:
+            event_id = self._last_ids[cafe_id] = next(self._sequences[cafe_id])
+        self.bus.deliver(cafe_id, {'id': event_id, 'type': event_type, 'data': data})
+
+    def listening(self, cafe_id):
+        return self.bus.has_subscribers(cafe_id)
+
+    def skip(self, cafe_id):
+        """Use up an event id without sending an event, so a stream resuming from before it resets"""
+        with self._lock:
+            self._last_ids[cafe_id] = next(self._sequences[cafe_id])
+
+    def last_id(self, cafe_id):
+        """Latest id published for the cafe by this process, None if there was none"""
+        with self._lock:
+            return self._last_ids.get(cafe_id)
+
+
+class RedisBackend:
+    """Events go through Redis pub/sub so every worker's streams see every write
+
+    Ids come from a per-cafe INCR counter. Each process runs one listener
+    thread that feeds its bus, including with its own events, so all workers
+    buffer the same sequence.
+    """
+
+    def __init__(self, bus, url):
+        import redis  # optional dependency, only needed with EVENTS_REDIS_URL
+        self.bus = bus
+        self.redis = redis.Redis.from_url(url)
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Started lazily so it runs in each forked worker, not in the preloading master
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='events-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(REDIS_CHANNEL_PREFIX + '*')
+                for message in pubsub.listen():
+                    cafe_id = message['channel'].decode()[len(REDIS_CHANNEL_PREFIX):]
+                    self.bus.deliver(cafe_id, json.loads(message['data']))
+            except Exception:
+                logger.exception("Event listener lost its Redis connection; reconnecting")
+                time.sleep(1)
+
+    def publish(self, cafe_id, event_type, data):
+        self._ensure_listener()
+        event_id = self.redis.incr(REDIS_SEQUENCE_PREFIX + cafe_id)
+        event = {'id': event_id, 'type': event_type, 'data': data}
+        self.redis.publish(REDIS_CHANNEL_PREFIX + cafe_id, json.dumps(event, default=str))
+
+    def listening(self, cafe_id):
+        # Streams in other workers are not visible from here
+        return True
+
+    def last_id(self, cafe_id):
+        self._ensure_listener()
+        value = self.redis.get(REDIS_SEQUENCE_PREFIX + cafe_id)
+        return int(value) if value is not None else 0
+
+
+bus = EventBus()
+_backend = LocalBackend(bus)
+
+
+def init_app(app):
+    """Pick the event backend from EVENTS_REDIS_URL"""
+    global _backend
+
+    @app.errorhandler(StreamsFull)
+    def streams_full(error):
+        response = jsonify({'success': False, 'message': str(error)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    bus.buffer_size = app.config['EVENTS_BUFFER_SIZE']
+    if app.config.get('EVENTS_REDIS_URL'):
+        _backend = RedisBackend(bus, app.config['EVENTS_REDIS_URL'])
+    else:
+        _backend = LocalBackend(bus)
+    metrics.register_collector('events', lambda: {'subscribers': bus.subscriber_count()})
+
+
+def publish(cafe_id, event_type, data):
+    """Send an event to every dashboard stream of a cafe; call after the change is committed
+
+    `data` may be a function returning the data. It is only called when a
+    stream can receive the event, so writes pay for building it only while
+    a dashboard is open.
+    """
+    cafe_id = str(cafe_id)
+    try:
+        if callable(data):
+            if not _backend.listening(cafe_id):
+                _backend.skip(cafe_id)
+                metrics.incr('events.skipped')
+                return
+            data = data()
+        _backend.publish(cafe_id, event_type, data)
+        metrics.incr('events.published')
+    except Exception:
+        # The change itself is committed; streams catch up on the next event
+        logger.exception("Could not publish %s event for cafe %s", event_type, cafe_id)
+
+
+def _format(event_type, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class Stream:
+    """The text chunks of one cafe's event stream; closing it ends the subscription, even if it never started"""
+
+    def __init__(self, cafe_id, subscriber, chunks):
+        self.cafe_id = cafe_id
+        self.subscriber = subscriber
+        self.chunks = chunks
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        self.chunks.close()
+        bus.unsubscribe(self.cafe_id, self.subscriber)
+
+
+def stream(cafe_id, last_id=None, snapshot=None, heartbeat=15, max_seconds=300, retry_ms=3000, max_streams=None):
+    """Server-sent events for a cafe, as a Stream of text chunks
+
+    Replays missed events after last_id when they are still buffered, and
+    otherwise sends a `reset` event so the client reloads. `snapshot` is
+    sent first as a `counters` event. The stream ends after max_seconds; the
+    browser reconnects with Last-Event-ID. Raises StreamsFull when this
+    process already holds max_streams streams.
+    """
+    cafe_id = str(cafe_id)
+    # Subscribe before replaying so nothing published in between is lost, and before the response starts
+    subscriber = bus.subscribe(cafe_id, limit=max_streams)
+    return Stream(cafe_id, subscriber, _chunks(cafe_id, subscriber, last_id, snapshot, heartbeat, max_seconds, retry_ms))
+
+
+def _chunks(cafe_id, subscriber, last_id, snapshot, heartbeat, max_seconds, retry_ms):
+    sent_id = last_id
+
+    def emit(event):
+        nonlocal sent_id
+        if sent_id is not None and event['id'] <= sent_id:
+            return None
+        sent_id = event['id']
+        return _format(event['type'], event['data'], event['id'])
+
+    try:
+        yield f"retry: {retry_ms}\n\n"
+        if last_id is not None:
+            missed = bus.replay(cafe_id, last_id)
+            # Nothing buffered is only fine if nothing was published since last_id
+            if missed is None or (not missed and _backend.last_id(cafe_id) != last_id):
+                yield _format('reset', {'reason': 'missed events'})
+                sent_id = None
+            else:
+                for event in missed:
+                    chunk = emit(event)
+                    if chunk:
+                        yield chunk
+        if snapshot is not None:
+            yield _format('counters', snapshot)
+
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            try:
+                event = subscriber.get(timeout=min(heartbeat, max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            chunk = emit(event)
+            if chunk:
+                yield chunk
+    finally:
+        bus.unsubscribe(cafe_id, subscriber)
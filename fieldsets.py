@@ -0,0 +1,147 @@
+from functools import lru_cache
+from operator import attrgetter
+
+from sqlalchemy import inspect, orm
+
+
+class FieldError(ValueError):
+    """A fields= parameter names a field the response does not have; answered with 400"""
+
+
+class Field:
+    """One key of a serialized object: the columns its value reads, and for a related object its relationship and shape
+
+    `joined` relationships are in the same database as the row and can be
+    loaded with a JOIN; others (e.g. a cafe, which may live in the control
+    database when shards are on) are loaded on access.
+    """
+
+    def __init__(self, value=None, columns=(), relationship=None, shape=None, joined=False):
+        self.value = value
+        self.columns = columns
+        self.relationship = relationship
+        self.shape = shape
+        self.joined = joined
+
+    def dump(self, obj, selection):
+        if self.shape is None or self.value is not None:
+            return self.value(obj)
+        related = getattr(obj, self.relationship)
+        return self.shape.dump(related, selection) if related is not None else None
+
+
+def column(name, convert=None):
+    """A field holding a column's value, optionally converted"""
+    getter = attrgetter(name)
+    return Field((lambda obj: convert(getter(obj))) if convert else getter, (name,))
+
+
+def nested(relationship, key, shape, joined=False):
+    """A field holding the object a foreign key column refers to, serialized with its own shape"""
+    return Field(columns=(key,), relationship=relationship, shape=shape, joined=joined)
+
+
+class Shape:
+    """The fields of one kind of serialized object, in output order
+
+    A selection is what `select` makes of a fields= parameter: None for every
+    field, or a dict of the chosen names, each mapping to the selection of
+    its subfields (None again for all of them). `a,b.c` selects a and the c
+    of b. `dump` writes only the selected fields, and `options` gives the
+    loader options that read only the columns and relationships they use.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def extend(self, fields):
+        return Shape({**self.fields, **fields})
+
+    def select(self, value):
+        if not value:
+            return None
+        selection = {}
+        for path in value.split(','):
+            names = [name.strip() for name in path.split('.')]
+            if not all(names):
+                continue
+            self._add(selection, names, path.strip())
+        return selection or None
+
+    def _add(self, selection, names, path):
+        field = self.fields.get(names[0])
+        if field is None or (len(names) > 1 and (field.shape is None or field.value is not None)):
+            raise FieldError(f"Unknown field: {path}")
+        if len(names) == 1:
+            selection[names[0]] = None
+        elif names[0] not in selection or selection[names[0]] is not None:
+            field.shape._add(selection.setdefault(names[0], {}), names[1:], path)
+
+    def dump(self, obj, selection=None):
+        if selection is None:
+            return {name: field.dump(obj, None) for name, field in self.fields.items()}
+        return {name: field.dump(obj, selection[name]) for name, field in self.fields.items() if name in selection}
+
+    def options(self, model, selection=None, eager=None, extra=()):
+        """Loader options for `model` rows that dump(selection) reads and nothing else
+
+        Related objects are joined or loaded on access as their field says, or
+        all with `eager` (e.g. 'selectinload', which async sessions need).
+        `extra` names more columns the caller reads itself.
+        """
+        return list(self._cached_options(model, freeze(selection), eager, tuple(extra)))
+
+    # Options are immutable, so each selection's are built once; selections come from clients, hence the bound
+    @lru_cache(maxsize=512)
+    def _cached_options(self, model, frozen, eager, extra):
+        # Backrefs such as Reservation.table exist once the mappers are configured
+        orm.configure_mappers()
+        return tuple(self._options(model, thaw(frozen), eager, extra, None))
+
+    def _options(self, model, selection, eager, extra, loader):
+        columns, related = set(extra), []
+        for name, field in self.fields.items():
+            if selection is not None and name not in selection:
+                continue
+            columns.update(field.columns)
+            if field.relationship is not None:
+                related.append((field, None if selection is None else selection[name]))
+
+        mapper = inspect(model)
+        relationships = mapper.relationships
+        columns.update(mapper.get_property_by_column(key).key for key in mapper.primary_key)
+        attributes = [getattr(model, name) for name in sorted(columns)]
+        options = [loader.load_only(*attributes) if loader is not None else orm.load_only(*attributes)]
+
+        for field, subselection in related:
+            # Archived rows reach their cafe and table through properties, not relationships
+            if field.relationship not in relationships:
+                continue
+            attribute = getattr(model, field.relationship)
+            strategy = eager or ('joinedload' if field.joined else 'defaultload')
+            child = getattr(loader, strategy)(attribute) if loader is not None else getattr(orm, strategy)(attribute)
+            options.append(child)
+            if field.shape is not None:
+                target = relationships[field.relationship].mapper.class_
+                options.extend(field.shape._options(target, subselection, eager, (), child))
+        return options
+
+    def only(self, model, selection, **kwargs):
+        """options() when fields were chosen; none otherwise, so queries without fields= are unchanged"""
+        return [] if selection is None else self.options(model, selection, **kwargs)
+
+
+def freeze(selection):
+    return None if selection is None else tuple(sorted((name, freeze(sub)) for name, sub in selection.items()))
+
+
+def thaw(frozen):
+    return None if frozen is None else {name: thaw(sub) for name, sub in frozen}
+
+
+def wants(selection, name):
+    return selection is None or name in selection
+
+
+def subselection(selection, name):
+    return None if selection is None else selection[name]
@@ -0,0 +1,466 @@
+import fcntl
+import json
+import mmap
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from allocator import ACTIVE_STATUSES, TableInfo, build_allocator, day_bookings, load_tables
+from changes import head_cursor
+from metrics import metrics
+from models import db, Cafe, Reservation, ReservationChange, Table, Zone
+from utils import SERVICE_DAY_START, MINUTES_PER_DAY
+import shards
+
+MAGIC = b'BSGRID01'
+
+# One bit per minute from the start of the service day, plus 12 hours for bookings that run past its end
+FIRST_MINUTE = SERVICE_DAY_START
+MINUTES = MINUTES_PER_DAY + 12 * 60
+WORDS = (MINUTES + 63) // 64
+
+HEADER = np.dtype([('magic', 'S8'), ('minutes', '<u4'), ('days', '<u4'), ('tables', '<u4'),
+                   ('meta_length', '<u4'), ('retired', '<u4'), ('reserved', '<u4')])
+# Per day slot: seqlock counter (odd while the writer is in it), the date it holds and a CRC of its rows
+DAY = np.dtype([('seq', '<u8'), ('ordinal', '<i8'), ('crc', '<u4'), ('reserved', '<u4')])
+
+# Reads retried while the writer is mid-update before giving up on the grid
+READ_ATTEMPTS = 8
+
+GridCafe = namedtuple('GridCafe', ['id', 'updated_at', 'opening_hours_dict', 'settings_dict'])
+GridZone = namedtuple('GridZone', ['id', 'name'])
+
+_files = {}
+_lock = threading.Lock()
+
+
+class GridMiss(Exception):
+    """The grid cannot answer a lookup, e.g. a booking that runs past its range; ask the database"""
+
+
+class GridCorrupt(Exception):
+    """A grid file or day failed its checks; the writer rebuilds it"""
+
+
+class WriterRunning(RuntimeError):
+    """Another GridWriter holds the lock on the grid directory"""
+
+
+def grid_path(directory, cafe_id):
+    return os.path.join(directory, f'{cafe_id}.grid')
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def _bits(start, end):
+    """uint64 words with the bits of service-day minutes [start, end) set"""
+    a, b = max(start - FIRST_MINUTE, 0), min(end - FIRST_MINUTE, MINUTES)
+    value = ((1 << (b - a)) - 1) << a if a < b else 0
+    return np.frombuffer(value.to_bytes(WORDS * 8, 'little'), dtype='<u8')
+
+
+class GridFile:
+    """A cafe's occupancy grid in a memory-mapped file: tables x minutes bits for each day in a ring of day slots
+
+    The file holds a header, the cafe's metadata (schedule settings, zones and
+    tables) as JSON, one DAY entry per slot and then the bits. Workers map it
+    read-only and share the page cache, so a worker's copy costs nothing. The
+    single writer updates a day under its seqlock: seq goes odd, the rows and
+    CRC are written, seq goes even. A reader copies the rows and keeps them
+    only if seq was even and unchanged around the copy and the CRC matches.
+    Layout changes (tables or settings) get a new file that replaces this one,
+    which is then marked retired so readers reopen.
+    """
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        with open(path, 'r+b' if writable else 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        try:
+            self._load()
+        except (ValueError, KeyError, TypeError) as e:
+            raise GridCorrupt(f"{path}: {e}")
+        self._masks = {}
+        self._candidates = {}
+
+    def _load(self):
+        if len(self._map) < HEADER.itemsize:
+            raise ValueError("truncated header")
+        self.header = np.ndarray((), dtype=HEADER, buffer=self._map)
+        if bytes(self.header['magic']) != MAGIC or int(self.header['minutes']) != MINUTES:
+            raise ValueError("not a grid file of this version")
+        n_days, n_tables = int(self.header['days']), int(self.header['tables'])
+        meta_end = HEADER.itemsize + int(self.header['meta_length'])
+        days_at = _align(meta_end)
+        data_at = days_at + n_days * DAY.itemsize
+        if len(self._map) != data_at + n_days * n_tables * WORDS * 8:
+            raise ValueError("size does not match the header")
+
+        self.meta_json = self._map[HEADER.itemsize:meta_end]
+        meta = json.loads(self.meta_json)
+        cafe = meta['cafe']
+        self.cafe = GridCafe(
+            cafe['id'],
+            datetime.fromisoformat(cafe['updated_at']) if cafe['updated_at'] else None,
+            cafe['opening_hours'],
+            cafe['settings']
+        )
+        self.zones = [GridZone(*zone) for zone in meta['zones']]
+        self.tables = [TableInfo(*table) for table in meta['tables']]
+        if len(self.tables) != n_tables:
+            raise ValueError("table count does not match the header")
+        self.days = np.ndarray((n_days,), dtype=DAY, buffer=self._map, offset=days_at)
+        self.data = np.ndarray((n_days, n_tables, WORDS), dtype='<u8', buffer=self._map, offset=data_at)
+
+    @property
+    def retired(self):
+        return bool(self.header['retired'])
+
+    def slot(self, service_date):
+        return service_date.toordinal() % len(self.days)
+
+    def holds(self, service_date):
+        return int(self.days['ordinal'][self.slot(service_date)]) == service_date.toordinal()
+
+    def read(self, service_date):
+        """The day's rows as a GridDay, None if the grid does not hold that day (yet)"""
+        slot, ordinal = self.slot(service_date), service_date.toordinal()
+        bad_crc = 0
+        for _ in range(READ_ATTEMPTS):
+            seq = int(self.days['seq'][slot])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            held, crc = int(self.days['ordinal'][slot]), int(self.days['crc'][slot])
+            rows = self.data[slot].copy()
+            if int(self.days['seq'][slot]) != seq:
+                continue
+            if held != ordinal:
+                return None
+            if zlib.crc32(rows) != crc:
+                bad_crc += 1
+                continue
+            return GridDay(self, rows)
+        if bad_crc > 1:
+            raise GridCorrupt(f"{self.path}: day {service_date.isoformat()} fails its CRC")
+        return None
+
+    def write(self, service_date, rows):
+        """Replace a day's rows (writer only)"""
+        slot = self.slot(service_date)
+        seq = int(self.days['seq'][slot])
+        self.days['seq'][slot] = seq + 1
+        self.data[slot] = rows
+        self.days['ordinal'][slot] = service_date.toordinal()
+        self.days['crc'][slot] = zlib.crc32(rows)
+        self.days['seq'][slot] = seq + 2
+
+    def retire(self):
+        self.header['retired'] = 1
+
+    def candidates(self, guests, zone_id=None):
+        """Row indexes of the tables that seat the party, in allocator (best fit) order"""
+        key = (guests, zone_id)
+        if key not in self._candidates:
+            order = sorted(range(len(self.tables)), key=lambda i: (
+                self.tables[i].max_guests, self.tables[i].seats, self.tables[i].number
+            ))
+            self._candidates[key] = np.array([
+                i for i in order
+                if (self.tables[i].min_guests or 1) <= guests <= self.tables[i].max_guests
+                and (zone_id is None or self.tables[i].zone_id == zone_id)
+            ], dtype=np.intp)
+        return self._candidates[key]
+
+    def mask(self, start, end):
+        key = (start, end)
+        if key not in self._masks:
+            if start < FIRST_MINUTE or end > FIRST_MINUTE + MINUTES:
+                raise GridMiss(f"[{start}, {end}) is outside the grid")
+            if len(self._masks) > 4096:
+                self._masks.clear()
+            self._masks[key] = _bits(start, end)
+        return self._masks[key]
+
+
+class GridDay:
+    """One day's rows read from a GridFile, with the lookups of allocator.TableAllocator that availability() uses"""
+
+    def __init__(self, grid, rows):
+        self.grid = grid
+        self.rows = rows
+        self.cafe = grid.cafe
+        self.zones = grid.zones
+
+    def candidates(self, guests, zone_id=None):
+        return [self.grid.tables[i] for i in self.grid.candidates(guests, zone_id)]
+
+    def free_tables(self, guests, start, end, zone_id=None):
+        indexes = self.grid.candidates(guests, zone_id)
+        busy = (self.rows[indexes] & self.grid.mask(start, end)).any(axis=1)
+        return [self.grid.tables[i] for i in indexes[~busy]]
+
+
+def _open(cafe_id, path):
+    with _lock:
+        grid = _files.get(cafe_id)
+        if grid is not None and grid.retired:
+            # Not closed: other threads may still be reading it; the mapping goes with its last reference
+            del _files[cafe_id]
+            grid = None
+        if grid is None and os.path.exists(path):
+            grid = _files[cafe_id] = GridFile(path)
+        return grid
+
+
+def read_day(cafe_id, service_date, config=None):
+    """A cafe's day from the shared grid, or None when the database has to answer"""
+    directory = (config or current_app.config)['AVAILABILITY_GRID_DIR']
+    if not directory:
+        return None
+    path = grid_path(directory, cafe_id)
+    try:
+        grid = _open(cafe_id, path)
+        day = grid.read(service_date) if grid else None
+    except GridCorrupt:
+        metrics.incr('grid.corrupt')
+        with _lock:
+            _files.pop(cafe_id, None)
+        request_rebuild(path)
+        return None
+    metrics.incr('grid.hits' if day else 'grid.misses')
+    return day
+
+
+def request_rebuild(path):
+    """Leave a marker for the writer to rebuild a file"""
+    try:
+        open(path + '.corrupt', 'a').close()
+    except OSError:
+        pass
+
+
+class GridWriter:
+    """Keeps the grid files of all active cafes in step with the database; run exactly one (flask availability-grid)
+
+    On start it rebuilds every file from the database. It then follows the
+    reservation change log of each database and rewrites the days a change
+    touches (the booking's day and the next, which its spill-over reaches).
+    When a cafe, zone or table is added, removed or edited, e.g. a table
+    switched off, it picks that up at the next poll too. Every refresh
+    interval it fills the days that roll into the horizon, and files that
+    readers marked as corrupt are rebuilt at the next poll.
+    """
+
+    def __init__(self, config, log=print):
+        self.directory = config['AVAILABILITY_GRID_DIR']
+        self.horizon = config['AVAILABILITY_GRID_DAYS']
+        self.settle = config['CHANGES_SETTLE_SECONDS']
+        self.log = log
+        self.files = {}
+        self.cursors = {}
+        self.layout = None
+        self.days_written = 0
+
+    def lock(self):
+        """Take the writer lock, so a second writer fails instead of racing this one"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, 'writer.lock'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise WriterRunning(f"Another availability grid writer holds {self._lock_file.name}")
+
+    def window(self):
+        today = date.today()
+        return [today + timedelta(days=n) for n in range(-1, self.horizon + 1)]
+
+    def metadata(self, cafe):
+        """The part of a grid file that only changes with the cafe's settings, zones or tables"""
+        zones = Zone.query.filter_by(cafe_id=cafe.id, is_active=True).all()
+        return json.dumps({
+            'cafe': {
+                'id': cafe.id,
+                'updated_at': cafe.updated_at.isoformat() if cafe.updated_at else None,
+                'opening_hours': cafe.opening_hours_dict,
+                'settings': cafe.settings_dict
+            },
+            'zones': [[zone.id, zone.name] for zone in zones],
+            'tables': [list(table) for table in load_tables(cafe.id)]
+        }).encode()
+
+    def create(self, cafe_id, meta_json):
+        """Write a new, empty file for the cafe and swap it in for the old one"""
+        n_tables = len(json.loads(meta_json)['tables'])
+        n_days = self.horizon + 2
+        days_at = _align(HEADER.itemsize + len(meta_json))
+        size = days_at + n_days * DAY.itemsize + n_days * n_tables * WORDS * 8
+        path = grid_path(self.directory, cafe_id)
+        with open(path + '.tmp', 'wb') as f:
+            header = np.zeros((), dtype=HEADER)
+            header['magic'], header['minutes'], header['days'] = MAGIC, MINUTES, n_days
+            header['tables'], header['meta_length'] = n_tables, len(meta_json)
+            f.write(header.tobytes())
+            f.write(meta_json)
+            f.truncate(size)
+        os.replace(path + '.tmp', path)
+        old = self.files.pop(cafe_id, None)
+        if old is not None:
+            old.retire()
+        grid = self.files[cafe_id] = GridFile(path, writable=True)
+        return grid
+
+    def write_days(self, cafe_id, dates):
+        """Recompute days of a cafe from its bookings, with one query for all of them"""
+        grid = self.files[cafe_id]
+        dates = sorted(dates)
+        rows = db.session.execute(select(
+            Reservation.id, Reservation.guests, Reservation.date, Reservation.start_minute,
+            Reservation.end_minute, Reservation.table_id, Reservation.status
+        ).where(
+            Reservation.cafe_id == cafe_id,
+            Reservation.date.between(dates[0] - timedelta(days=1), dates[-1]),
+            Reservation.status.in_(ACTIVE_STATUSES)
+        ))
+        by_date = defaultdict(list)
+        for row in rows:
+            by_date[row.date].append(row)
+
+        end_of_day = SERVICE_DAY_START + MINUTES_PER_DAY
+        for day in dates:
+            # Same bookings as allocator.bookings_query
+            overlapping = [row for row in by_date[day] if row.start_minute < end_of_day
+                           and row.end_minute > SERVICE_DAY_START]
+            overlapping += [row for row in by_date[day - timedelta(days=1)] if row.end_minute > end_of_day]
+            allocator = build_allocator(grid.tables, day_bookings(overlapping, day))
+            bits = np.zeros((len(grid.tables), WORDS), dtype='<u8')
+            for i, table in enumerate(grid.tables):
+                for start, end in allocator.busy(table.id):
+                    bits[i] |= _bits(start, end)
+            grid.write(day, bits)
+        self.days_written += len(dates)
+        metrics.incr('grid.days_written', len(dates))
+
+    def sync_cafe(self, cafe, rebuild=False):
+        """Rebuild a cafe's file if it is new, changed or marked corrupt, and fill the days missing from it"""
+        marker = grid_path(self.directory, cafe.id) + '.corrupt'
+        corrupt = os.path.exists(marker)
+        with shards.using(shards.cafe_location(cafe.id)[0]):
+            meta_json = self.metadata(cafe)
+            grid = self.files.get(cafe.id)
+            if rebuild or corrupt or grid is None or grid.meta_json != meta_json:
+                grid = self.create(cafe.id, meta_json)
+            missing = [day for day in self.window() if not grid.holds(day)]
+            if missing:
+                self.write_days(cafe.id, missing)
+        if corrupt:
+            os.remove(marker)
+            self.log(f"availability grid: rebuilt {cafe.id} after a failed check")
+
+    def refresh(self, rebuild=False):
+        """Sync the set of files with the active cafes"""
+        active = set()
+        for cafe in Cafe.query.filter_by(is_active=True).all():
+            active.add(cafe.id)
+            self.sync_cafe(cafe, rebuild)
+
+        for cafe_id in set(self.files) - active:
+            self.files.pop(cafe_id).retire()
+            os.remove(grid_path(self.directory, cafe_id))
+        db.session.rollback()
+
+    def repair(self):
+        """Rebuild the files readers marked as corrupt"""
+        for cafe_id in list(self.files):
+            if os.path.exists(grid_path(self.directory, cafe_id) + '.corrupt'):
+                self.sync_cafe(db.session.get(Cafe, cafe_id), rebuild=True)
+        db.session.rollback()
+
+    def start_cursors(self):
+        for location in shards.locations():
+            with shards.using(location):
+                self.cursors[location] = head_cursor()
+
+    def layout_version(self):
+        """Count and latest updated_at of the cafes, and of the zones and tables in every database"""
+        version = [tuple(db.session.execute(select(func.count(Cafe.id), func.max(Cafe.updated_at))).one())]
+        for location in shards.locations():
+            with shards.using(location):
+                for model in (Zone, Table):
+                    version.append(tuple(db.session.execute(
+                        select(func.count(model.id), func.max(model.updated_at))
+                    ).one()))
+        db.session.rollback()
+        return version
+
+    def poll(self):
+        """Rewrite the days touched by changes since the last poll; returns how many days were rewritten"""
+        first, last = date.today() - timedelta(days=1), date.today() + timedelta(days=self.horizon)
+        dirty = defaultdict(set)
+        # A lower id can commit after a higher one, so recent changes are read again until they settle
+        recent = datetime.utcnow() - timedelta(seconds=self.settle + 1)
+        for location in shards.locations():
+            with shards.using(location):
+                rows = db.session.execute(select(
+                    ReservationChange.id, ReservationChange.cafe_id, ReservationChange.data
+                ).where(or_(
+                    ReservationChange.id > self.cursors[location],
+                    ReservationChange.created_at >= recent
+                ))).all()
+            for id, cafe_id, data in rows:
+                self.cursors[location] = max(self.cursors[location], id)
+                day = date.fromisoformat(json.loads(data)['date'])
+                for touched in (day, day + timedelta(days=1)):
+                    if first <= touched <= last:
+                        dirty[cafe_id].add(touched)
+
+        written = 0
+        for cafe_id, days in dirty.items():
+            if cafe_id not in self.files:
+                continue
+            with shards.using(shards.cafe_location(cafe_id)[0]):
+                self.write_days(cafe_id, days)
+            written += len(days)
+        db.session.rollback()
+        return written
+
+    def run(self, stop, poll_interval=0.5, refresh_interval=60, once=False):
+        """Rebuild every file, then follow changes until `stop` (a threading.Event) is set"""
+        self.lock()
+        # Cursors and layout first, so changes made during the rebuild are applied after it
+        self.start_cursors()
+        self.layout = self.layout_version()
+        started = time.monotonic()
+        self.refresh(rebuild=True)
+        self.log(f"availability grid: built {len(self.files)} cafes, {self.days_written} days "
+                 f"in {time.monotonic() - started:.1f}s")
+        if once:
+            return
+        refreshed = time.monotonic()
+        while not stop.is_set():
+            if self.follow(refresh=time.monotonic() - refreshed >= refresh_interval):
+                refreshed = time.monotonic()
+            stop.wait(poll_interval)
+
+    def follow(self, refresh=False):
+        """Apply new changes and rebuild corrupt files; refresh when cafes, zones or tables changed, or with refresh
+
+        Returns whether it refreshed.
+        """
+        self.poll()
+        self.repair()
+        layout = self.layout_version()
+        if not refresh and layout == self.layout:
+            return False
+        self.refresh()
+        self.layout = layout
+        return True
@@ -0,0 +1,70 @@
+"""Gunicorn configuration for the BarSan backend
+
+Usage: gunicorn -c gunicorn.conf.py wsgi:app
+       GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:app
+
+Environment:
+  GUNICORN_WORKER_CLASS   sync | gthread | gevent | uvicorn.workers.UvicornWorker (default: gthread)
+  WEB_CONCURRENCY         worker processes (default: 2 x CPU + 1)
+  GUNICORN_THREADS        threads per gthread worker (default: 4)
+  GUNICORN_WORKER_CONNECTIONS  greenlets per gevent worker (default: 100)
+  GUNICORN_TIMEOUT        worker timeout in seconds (default: 30)
+  EVENTS_MAX_STREAMS      dashboard event streams per worker (default: half its threads,
+                          greenlets or ASGI_FLASK_THREADS, at least 1)
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# The app's .env, so values set there win over the defaults below
+load_dotenv()
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # The app is preloaded in the master, so patch before it is imported
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+# Each open dashboard stream (GET /admin/events/<cafe_id>) holds a thread or greenlet for up to
+# EVENTS_MAX_STREAM_SECONDS, so a worker keeps at most half of them for streams and answers the
+# rest with 503. On sync workers a stream holds the whole worker, so use gthread or gevent
+if worker_class == 'gthread':
+    stream_slots = threads // 2
+elif worker_class == 'gevent':
+    stream_slots = worker_connections // 2
+elif worker_class.startswith('uvicorn'):
+    stream_slots = int(os.getenv('ASGI_FLASK_THREADS', 8)) // 2
+else:
+    stream_slots = 1
+# Read by config.py when the app is preloaded below
+os.environ.setdefault('EVENTS_MAX_STREAMS', str(max(stream_slots, 1)))
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Drop pooled connections inherited from the master"""
+    from models import db
+
+    # The preloaded app: wsgi:app, or the Flask app inside asgi:app
+    app = server.app.wsgi()
+    app = getattr(app, 'flask_app', app)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the parent's sockets alone and just forgets them
+            engine.dispose(close=False)
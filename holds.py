@@ -0,0 +1,175 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app, jsonify
+from sqlalchemy import delete, exc, insert
+
+from metrics import metrics
+from models import db, TemporaryReservation
+from routing import is_lock_error
+
+_writers = {}
+_lock = threading.Lock()
+
+
+class HoldsBusy(RuntimeError):
+    """A hold could not be written before DB_WRITE_DEADLINE_SECONDS; answered with 503"""
+
+
+def init_app(app):
+    @app.errorhandler(HoldsBusy)
+    def holds_busy(error):
+        response = jsonify({'success': False, 'message': str(error)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+    if app.config['HOLD_COALESCING']:
+        metrics.register_collector('holds', status)
+
+
+def coalescing():
+    return current_app.config['HOLD_COALESCING']
+
+
+class HoldWriter:
+    """Writes the holds of concurrent requests to one database in shared transactions (group commit)
+
+    Requests queue their hold and wait for its outcome. A flusher thread takes
+    what queued up while it wrote the previous batch, optionally waits up to
+    `window` seconds for more (at most `max_batch` holds), and writes the
+    batch with one DELETE, one INSERT and one commit. A session holds one
+    hold at a time, so when a batch has several of a session's holds only the
+    latest is written, and each of those requests gets that one back. A batch
+    that fails for any reason other than a lock conflict is written again
+    session by session, so a bad hold only fails its own requests. Lock
+    conflicts are retried with backoff until the oldest request's deadline.
+    """
+
+    def __init__(self, engine, window=0.0, max_batch=100, deadline=10.0, backoff=0.02, max_backoff=0.5):
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self.deadline = deadline
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.batches = self.written = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, values):
+        """Queue one hold (column values); returns a Future of the session's hold as committed"""
+        self._ensure_flusher()
+        future = Future()
+        self._queue.put((values, time.monotonic() + self.deadline, future))
+        return future
+
+    def _ensure_flusher(self):
+        # Started lazily so it runs in each forked worker, not in the preloading master
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='hold-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._flush(self._collect())
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        closes = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, closes - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        latest = {values['session_id']: values for values, _, _ in batch}
+        try:
+            self._write(list(latest.values()), min(deadline for _, deadline, _ in batch))
+        except Exception as e:
+            if len(latest) > 1 and not isinstance(e, HoldsBusy):
+                metrics.incr('holds.batches_split')
+                for session_id in latest:
+                    self._flush([item for item in batch if item[0]['session_id'] == session_id])
+            else:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.written += len(latest)
+        metrics.incr('holds.batches')
+        metrics.incr('holds.written', len(latest))
+        for values, _, future in batch:
+            future.set_result(latest[values['session_id']])
+
+    def _write(self, latest, deadline):
+        """Replace each session's hold with its new one (one per session) in a single transaction"""
+        table = TemporaryReservation.__table__
+        attempt = 0
+        while True:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(delete(table).where(table.c.session_id.in_([v['session_id'] for v in latest])))
+                    conn.execute(insert(table), latest)
+                return
+            except exc.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+            attempt += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            if time.monotonic() + delay > deadline:
+                metrics.incr('db.write_timeouts')
+                raise HoldsBusy("The system is busy, please try again")
+            metrics.incr('db.write_retries')
+            time.sleep(delay)
+
+    def status(self):
+        return {
+            'queued': self._queue.qsize(),
+            'batches': self.batches,
+            'holdsPerBatch': round(self.written / self.batches, 1) if self.batches else None
+        }
+
+
+def writer_for(engine):
+    """This worker's HoldWriter for a database"""
+    with _lock:
+        writer = _writers.get(engine)
+        if writer is None:
+            config = current_app.config
+            writer = _writers[engine] = HoldWriter(
+                engine,
+                window=config['HOLD_COALESCE_WINDOW_MS'] / 1000,
+                max_batch=config['HOLD_COALESCE_MAX_BATCH'],
+                deadline=config['DB_WRITE_DEADLINE_SECONDS'],
+                backoff=config['DB_WRITE_BACKOFF_SECONDS'],
+                max_backoff=config['DB_WRITE_MAX_BACKOFF_SECONDS']
+            )
+        return writer
+
+
+def save(values):
+    """Write a hold together with other requests' holds and wait until it is committed
+
+    Returns the session's hold as committed: this one, or a later one of the
+    same session that was written in the same batch. Raises the error that
+    failed this hold, or HoldsBusy.
+    """
+    # The selected cafe's database: its shard, or the main one
+    engine = db.session.get_bind(mapper=TemporaryReservation)
+    # Nothing to keep from the view's reads; frees the connection while waiting
+    db.session.rollback()
+    return writer_for(engine).submit(values).result()
+
+
+def status():
+    with _lock:
+        writers = list(_writers.values())
+    return {str(writer.engine.url): writer.status() for writer in writers}
@@ -0,0 +1,103 @@
+import os
+import random
+import threading
+import time
+import uuid
+
+from sqlalchemy import LargeBinary, String
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
+
+# How primary/foreign keys are stored: 'string' (36-char text) or 'compact'
+# (16-byte binary, native UUID on Postgres). This shapes the table DDL, so it
+# is read once at import time and recorded in schema_version.id_format.
+ID_FORMAT = os.getenv('ID_FORMAT', 'string')
+
+# How new ids are generated: 'uuid4' (random) or 'uuid7' (time-ordered)
+ID_GENERATOR = os.getenv('ID_GENERATOR', 'uuid4')
+
+_uuid7_lock = threading.Lock()
+_uuid7_last = [0, 0]  # last (timestamp_ms, rand_a) handed out by this process
+
+
+def uuid7(timestamp_ms=None, rng=None):
+    """Generate a UUIDv7: 48-bit Unix ms timestamp, then random bits
+
+    Ids from one process are strictly increasing, since rand_a acts as a
+    counter within the same millisecond.
+    """
+    rng = rng or random.SystemRandom()
+    if timestamp_ms is None:
+        with _uuid7_lock:
+            timestamp_ms = time.time_ns() // 1_000_000
+            if timestamp_ms <= _uuid7_last[0]:
+                timestamp_ms = _uuid7_last[0]
+                rand_a = _uuid7_last[1] + 1
+                if rand_a > 0xFFF:
+                    timestamp_ms += 1
+                    rand_a = rng.getrandbits(11)
+            else:
+                rand_a = rng.getrandbits(11)
+            _uuid7_last[0], _uuid7_last[1] = timestamp_ms, rand_a
+    else:
+        rand_a = rng.getrandbits(12)
+
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80
+    value |= 0x7 << 76
+    value |= rand_a << 64
+    value |= 0b10 << 62
+    value |= rng.getrandbits(62)
+    return uuid.UUID(int=value)
+
+
+def new_id():
+    """Return a new primary key value as a canonical UUID string"""
+    if ID_GENERATOR == 'uuid7':
+        return str(uuid7())
+    return str(uuid.uuid4())
+
+
+class CompactUUID(TypeDecorator):
+    """UUID strings stored as 16 bytes (native UUID on Postgres)
+
+    Python code keeps seeing canonical strings, so ids in URLs, JSON and
+    comparisons are unchanged. Values that are not UUIDs bind as NULL and
+    match nothing, like an unknown id would.
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, uuid.UUID):
+            return str(value) if dialect.name == 'postgresql' else value.bytes
+        try:
+            # Cheaper than uuid.UUID() on the bulk insert path
+            raw = bytes.fromhex(str(value).replace('-', ''))
+        except ValueError:
+            return None
+        if len(raw) != 16:
+            return None
+        if dialect.name == 'postgresql':
+            return str(uuid.UUID(bytes=raw))
+        return raw
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return str(uuid.UUID(bytes=bytes(value)))
+        return str(value)
+
+
+def id_type(id_format=None):
+    """Column type for primary and foreign keys under the given (or configured) id format"""
+    if (id_format or ID_FORMAT) == 'compact':
+        return CompactUUID()
+    return String(36)
@@ -0,0 +1,28 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """In-process counters plus collectors evaluated at snapshot time (per worker)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._collectors = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def register_collector(self, name, collector):
+        self._collectors[name] = collector
+
+    def snapshot(self):
+        with self._lock:
+            data = {'counters': dict(self._counters)}
+        for name, collector in self._collectors.items():
+            data[name] = collector()
+        return data
+
+
+metrics = Metrics()
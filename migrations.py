@@ -0,0 +1,280 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import create_engine, exc, func, insert, inspect, select, text, MetaData
+
+from ids import ID_FORMAT, uuid7
+from models import db, Reservation, CafeDailyStats, TurnTime, ReservationChange, OutboxMessage, SchemaVersion
+import shards
+from stats import rebuild_daily_stats
+from turn_times import compute_turn_times
+from utils import service_minutes
+
+# Bump this and register an upgrade step in MIGRATIONS whenever the schema changes
+SCHEMA_VERSION = 9
+
+# version -> function that upgrades the schema from (version - 1) to version.
+# Steps run inside an app context and must be safe to re-run, because tables
+# created by db.create_all() may already have the new shape.
+MIGRATIONS = {}
+
+
+class SchemaVersionError(RuntimeError):
+    """The database schema does not match the code"""
+
+
+def migration(version):
+    """Register an upgrade step for the given schema version"""
+    def decorator(f):
+        MIGRATIONS[version] = f
+        return f
+    return decorator
+
+
+def current_version():
+    """Return the stored schema version, or None if the database is not initialized"""
+    try:
+        return db.session.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+    except exc.DBAPIError:
+        db.session.rollback()
+        return None
+
+
+def set_version(version, id_format=None):
+    row = db.session.get(SchemaVersion, 1)
+    if row:
+        row.version = version
+    else:
+        row = SchemaVersion(id=1, version=version)
+        db.session.add(row)
+    if id_format:
+        row.id_format = id_format
+    db.session.commit()
+
+
+def check_schema_version():
+    """Fail fast at boot if the schema is missing, out of date or uses another id format (one query)"""
+    try:
+        row = db.session.execute(
+            select(SchemaVersion.version, SchemaVersion.id_format).where(SchemaVersion.id == 1)
+        ).first()
+    except exc.DBAPIError:
+        db.session.rollback()
+        row = None
+        version = current_version()
+        if version is not None:
+            row = (version, None)
+
+    if row is None:
+        raise SchemaVersionError("Database is not initialized. Run `flask init-db` first.")
+
+    version, id_format = row
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, code expects {SCHEMA_VERSION}. "
+            "Run `flask init-db` to upgrade."
+        )
+    if id_format != ID_FORMAT:
+        raise SchemaVersionError(
+            f"Database stores '{id_format}' ids but ID_FORMAT is '{ID_FORMAT}'. "
+            "Use `flask convert-ids` to copy the data into a database with the new format."
+        )
+    return version
+
+
+def init_db(log=print):
+    """Create missing tables and apply pending upgrades, then create missing tables on the shards"""
+    version = upgrade_schema(log=log)
+    shards.init_shards(log=log)
+    return version
+
+
+def upgrade_schema(log=print):
+    """Create missing tables and apply pending upgrades on the main database; a no-op when up to date"""
+    version = current_version()
+
+    if version == SCHEMA_VERSION:
+        log(f"Database schema is up to date (version {version})")
+        return version
+
+    if version is not None and version > SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})"
+        )
+
+    if version is None:
+        # Databases created before versioning already have the version 1 tables
+        legacy = inspect(db.engine).has_table('reservations')
+        db.create_all()
+        if not legacy:
+            set_version(SCHEMA_VERSION, id_format=ID_FORMAT)
+            log(f"Database tables created (schema version {SCHEMA_VERSION})")
+            return SCHEMA_VERSION
+        set_version(1, id_format='string')
+        version = 1
+        log("Stamped existing database as schema version 1")
+    else:
+        db.create_all()
+
+    # Cafes can only be on a shard once the schema is current, so every step works on the main database
+    with shards.suspended():
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            MIGRATIONS[target]()
+            set_version(target)
+            log(f"Upgraded database schema to version {target}")
+
+    return SCHEMA_VERSION
+
+
+def add_column(table_name, column):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists"""
+    existing = {c['name'] for c in inspect(db.engine).get_columns(table_name)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    db.session.execute(text(ddl))
+    db.session.commit()
+
+
+@migration(2)
+def add_schema_id_format():
+    """Record the id storage format; databases before version 2 used string ids"""
+    add_column('schema_version', db.Column('id_format', db.String(20), server_default="'string'"))
+
+
+def convert_ids(source_url, rekey=False, batch_size=5000, log=print):
+    """Copy all model tables from source_url into the (empty) app database
+
+    Ids are converted to this process's ID_FORMAT on the way in. With rekey,
+    every row gets a new time-ordered UUIDv7 derived from its created_at, and
+    foreign keys are rewritten to match.
+    """
+    if current_version() is not None and db.session.execute(select(db.metadata.tables['cafes'])).first():
+        raise SchemaVersionError("Target database already has data; convert into an empty database")
+    init_db(log=log)
+
+    source = create_engine(source_url)
+    source_metadata = MetaData()
+    source_metadata.reflect(source)
+    new_ids = {}
+
+    tables = [table for metadata in db.metadatas.values() for table in metadata.sorted_tables]
+    for table in tables:
+        if table.name == 'schema_version' or table.name not in source_metadata.tables:
+            continue
+        source_table = source_metadata.tables[table.name]
+        engine = db.engines[table.metadata.info.get('bind_key')]
+        columns = [c.name for c in table.columns if c.name in source_table.c]
+        id_columns = [c.name for c in table.columns
+                      if c.name in source_table.c and (c.name == 'id' or c.foreign_keys)]
+        query = select(*[source_table.c[name] for name in columns])
+        if rekey and 'created_at' in source_table.c:
+            query = query.order_by(source_table.c.created_at)
+
+        copied = 0
+        with source.connect() as conn:
+            result = conn.execution_options(yield_per=batch_size).execute(query)
+            for partition in result.partitions(batch_size):
+                rows = [dict(zip(columns, values)) for values in partition]
+                for row in rows:
+                    for name in id_columns:
+                        row[name] = _canonical_id(row[name])
+                    if rekey:
+                        _rekey_row(row, id_columns, new_ids)
+                db.session.execute(insert(table), rows, bind_arguments={'bind': engine})
+                copied += len(rows)
+        db.session.commit()
+        log(f"Copied {copied} rows into {table.name}")
+
+    source.dispose()
+    # Sources before schema version 3 have no start/end minutes
+    backfill_reservation_minutes()
+
+
+def _canonical_id(value):
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return str(uuid.UUID(bytes=bytes(value)))
+    return str(value)
+
+
+def _rekey_row(row, id_columns, new_ids):
+    for name in id_columns:
+        if name != 'id' and row[name] is not None:
+            row[name] = new_ids.get(row[name], row[name])
+    if 'id' in id_columns and row['id'] is not None:
+        created_at = row.get('created_at') or datetime.utcnow()
+        new_id = str(uuid7(timestamp_ms=int(created_at.timestamp() * 1000)))
+        new_ids[row['id']] = new_id
+        row['id'] = new_id
+
+
+def backfill_reservation_minutes():
+    """Fill start_minute/end_minute where missing, one UPDATE per distinct start time"""
+    table = Reservation.__table__
+    times = db.session.execute(
+        select(table.c.time).where(table.c.start_minute.is_(None)).distinct()
+    ).scalars().all()
+    for time_str in times:
+        start = service_minutes(time_str)
+        db.session.execute(
+            table.update()
+            .where(table.c.time == time_str, table.c.start_minute.is_(None))
+            .values(start_minute=start, end_minute=start + func.coalesce(table.c.duration, 120))
+        )
+    db.session.commit()
+
+
+@migration(3)
+def add_reservation_minutes():
+    """Integer start/end minutes on reservations so overlap checks run as indexed range queries"""
+    add_column('reservations', db.Column('start_minute', db.Integer))
+    add_column('reservations', db.Column('end_minute', db.Integer))
+    backfill_reservation_minutes()
+    for index in Reservation.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+@migration(4)
+def add_reservation_archive():
+    """Archive table for old terminal reservations, plus the hot-table index the archive job scans"""
+    for index in Reservation.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    db.create_all(bind_key='archive')
+
+
+@migration(5)
+def add_cafe_daily_stats():
+    """Per-cafe daily reservation counters, backfilled from existing reservations"""
+    CafeDailyStats.__table__.create(db.engine, checkfirst=True)
+    rebuild_daily_stats(log=lambda message: None)
+
+
+@migration(6)
+def add_turn_times():
+    """Booking durations learned from seated/completed history"""
+    TurnTime.__table__.create(db.engine, checkfirst=True)
+    compute_turn_times(log=lambda message: None)
+
+
+@migration(7)
+def add_reservation_changes():
+    """Append-only reservation change log for incremental admin sync"""
+    ReservationChange.__table__.create(db.engine, checkfirst=True)
+
+
+@migration(8)
+def add_outbox_messages():
+    """Transactional outbox for booking emails and POS webhooks"""
+    OutboxMessage.__table__.create(db.engine, checkfirst=True)
+
+
+@migration(9)
+def add_cafe_shard():
+    """Per-cafe shard placement"""
+    add_column('cafes', db.Column('shard', db.String(50)))
+    add_column('cafes', db.Column('shard_moving', db.Boolean))
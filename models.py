@@ -1,34 +1,23 @@
-from sqlalchemy import event
-from sqlalchemy.engine import Engine
-import sqlite3
-
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import and_, event, or_
+from datetime import datetime, timedelta
 import json
-import uuid
 
-# Configure SQLite for WAL mode and performance
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    if 'sqlite' in str(dbapi_connection):
-        cursor = dbapi_connection.cursor()
-        # Enable WAL mode for better concurrency
-        cursor.execute("PRAGMA journal_mode=WAL")
-        # Enable foreign key constraints
-        cursor.execute("PRAGMA foreign_keys=ON")
-        # Optimize SQLite performance
-        cursor.execute("PRAGMA synchronous=NORMAL")
-        cursor.execute("PRAGMA cache_size=10000")
-        cursor.execute("PRAGMA temp_store=MEMORY")
-        cursor.close()
+from fieldsets import Shape, column, nested
+from ids import id_type, new_id, ID_FORMAT
+from routing import RoutingSession
+from utils import service_minutes, MINUTES_PER_DAY, SERVICE_DAY_START
 
+# SQLite PRAGMAs and pool settings are applied per engine in database.py.
+# Tables with info['sharded'] hold per-cafe data, which lives on the cafe's
+# shard database when SHARD_DATABASE_URLS is set (see routing.py and shards.py).
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'users'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(id_type(), primary_key=True, default=new_id)
     email = db.Column(db.String(255), unique=True, nullable=False)
     email_verified = db.Column(db.DateTime)
     full_name = db.Column(db.String(255))
@@ -60,15 +49,15 @@ class User(db.Model):
             'phone': self.phone,
             'image': self.image,
             'is_verified': self.is_verified,
-            'email_verified': self.email_verified.isoformat() if self.email_verified else None,
+            'email_verified': self.email_verified,
             'preferences': json.loads(self.preferences) if self.preferences else None,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at
         }
 
 class Cafe(db.Model):
     __tablename__ = 'cafes'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(id_type(), primary_key=True, default=new_id)
     name = db.Column(db.String(100), unique=True, nullable=False)
     display_name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -80,6 +69,9 @@ class Cafe(db.Model):
     opening_hours = db.Column(db.Text)  # JSON string
     is_active = db.Column(db.Boolean, default=True)
     settings = db.Column(db.Text)  # JSON string
+    # Shard holding the cafe's zones, tables and reservations; None keeps them in the main database
+    shard = db.Column(db.String(50))
+    shard_moving = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -106,26 +98,30 @@ class Cafe(db.Model):
     def settings_dict(self, value):
         self.settings = json.dumps(value) if value else None
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'display_name': self.display_name,
-            'description': self.description,
-            'address': self.address,
-            'phone': self.phone,
-            'email': self.email,
-            'website': self.website,
-            'image': self.image,
-            'opening_hours': json.loads(self.opening_hours) if self.opening_hours else None,
-            'is_active': self.is_active
-        }
+    # to_dict's keys and the columns each reads, for fields= (see fieldsets.py)
+    FIELDS = Shape({
+        'id': column('id'),
+        'name': column('name'),
+        'display_name': column('display_name'),
+        'description': column('description'),
+        'address': column('address'),
+        'phone': column('phone'),
+        'email': column('email'),
+        'website': column('website'),
+        'image': column('image'),
+        'opening_hours': column('opening_hours', lambda value: json.loads(value) if value else None),
+        'is_active': column('is_active')
+    })
+    
+    def to_dict(self, fields=None):
+        return self.FIELDS.dump(self, fields)
 
 class Zone(db.Model):
     __tablename__ = 'zones'
+    __table_args__ = {'info': {'sharded': True}}
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    cafe_id = db.Column(db.String(36), db.ForeignKey('cafes.id'), nullable=False)
+    id = db.Column(id_type(), primary_key=True, default=new_id)
+    cafe_id = db.Column(id_type(), db.ForeignKey('cafes.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     capacity = db.Column(db.Integer, default=0)
@@ -137,22 +133,24 @@ class Zone(db.Model):
     # Relationships
     tables = db.relationship('Table', backref='zone', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'capacity': self.capacity,
-            'is_active': self.is_active,
-            'sort_order': self.sort_order
-        }
+    FIELDS = Shape({
+        'id': column('id'),
+        'name': column('name'),
+        'description': column('description'),
+        'capacity': column('capacity'),
+        'is_active': column('is_active'),
+        'sort_order': column('sort_order')
+    })
+    
+    def to_dict(self, fields=None):
+        return self.FIELDS.dump(self, fields)
 
 class Table(db.Model):
     __tablename__ = 'tables'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    cafe_id = db.Column(db.String(36), db.ForeignKey('cafes.id'), nullable=False)
-    zone_id = db.Column(db.String(36), db.ForeignKey('zones.id'), nullable=False)
+    id = db.Column(id_type(), primary_key=True, default=new_id)
+    cafe_id = db.Column(id_type(), db.ForeignKey('cafes.id'), nullable=False)
+    zone_id = db.Column(id_type(), db.ForeignKey('zones.id'), nullable=False)
     number = db.Column(db.Integer, nullable=False)
     seats = db.Column(db.Integer, nullable=False)
     min_guests = db.Column(db.Integer, default=1)
@@ -169,7 +167,10 @@ class Table(db.Model):
     reservations = db.relationship('Reservation', backref='table', lazy=True)
     
     # Unique constraint
-    __table_args__ = (db.UniqueConstraint('cafe_id', 'number', name='unique_cafe_table_number'),)
+    __table_args__ = (
+        db.UniqueConstraint('cafe_id', 'number', name='unique_cafe_table_number'),
+        {'info': {'sharded': True}},
+    )
 
     @property
     def features_list(self):
@@ -179,31 +180,34 @@ class Table(db.Model):
     def features_list(self, value):
         self.features = json.dumps(value) if value else None
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'number': self.number,
-            'seats': self.seats,
-            'min_guests': self.min_guests,
-            'max_guests': self.max_guests,
-            'location': self.location,
-            'features': json.loads(self.features) if self.features else [],
-            'status': self.status,
-            'is_active': self.is_active,
-            'zone': self.zone.to_dict() if self.zone else None
-        }
+    FIELDS = Shape({
+        'id': column('id'),
+        'number': column('number'),
+        'seats': column('seats'),
+        'min_guests': column('min_guests'),
+        'max_guests': column('max_guests'),
+        'location': column('location'),
+        'features': column('features', lambda value: json.loads(value) if value else []),
+        'status': column('status'),
+        'is_active': column('is_active'),
+        'zone': nested('zone', 'zone_id', Zone.FIELDS, joined=True)
+    })
+    
+    def to_dict(self, fields=None):
+        return self.FIELDS.dump(self, fields)
 
 class TemporaryReservation(db.Model):
     __tablename__ = 'temporary_reservations'
+    __table_args__ = {'info': {'sharded': True}}
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'))
-    cafe_id = db.Column(db.String(36), db.ForeignKey('cafes.id'), nullable=False)
+    id = db.Column(id_type(), primary_key=True, default=new_id)
+    user_id = db.Column(id_type(), db.ForeignKey('users.id'))
+    cafe_id = db.Column(id_type(), db.ForeignKey('cafes.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
     time = db.Column(db.String(5), nullable=False)
     guests = db.Column(db.Integer, nullable=False)
-    zone_id = db.Column(db.String(36), db.ForeignKey('zones.id'))
-    table_id = db.Column(db.String(36), db.ForeignKey('tables.id'))
+    zone_id = db.Column(id_type(), db.ForeignKey('zones.id'))
+    table_id = db.Column(id_type(), db.ForeignKey('tables.id'))
     session_id = db.Column(db.String(255), nullable=False)
     expires_at = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -211,11 +215,11 @@ class TemporaryReservation(db.Model):
 class Reservation(db.Model):
     __tablename__ = 'reservations'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(id_type(), primary_key=True, default=new_id)
     reservation_number = db.Column(db.String(20), unique=True, nullable=False)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'))
-    cafe_id = db.Column(db.String(36), db.ForeignKey('cafes.id'), nullable=False)
-    table_id = db.Column(db.String(36), db.ForeignKey('tables.id'))
+    user_id = db.Column(id_type(), db.ForeignKey('users.id'))
+    cafe_id = db.Column(id_type(), db.ForeignKey('cafes.id'), nullable=False)
+    table_id = db.Column(id_type(), db.ForeignKey('tables.id'))
     
     # Guest information
     guest_name = db.Column(db.String(255), nullable=False)
@@ -229,6 +233,11 @@ class Reservation(db.Model):
     duration = db.Column(db.Integer, default=120)  # minutes
     status = db.Column(db.String(50), default='pending')
     
+    # Derived from time/duration on write: minutes since midnight of the service
+    # day, so a 01:00 booking on `date` starts at 1500 (see utils.service_minutes)
+    start_minute = db.Column(db.Integer)
+    end_minute = db.Column(db.Integer)
+    
     # Additional information
     special_requests = db.Column(db.Text)
     notes = db.Column(db.Text)
@@ -242,35 +251,231 @@ class Reservation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_reservations_cafe_date_start', 'cafe_id', 'date', 'start_minute', 'end_minute'),
+        db.Index('ix_reservations_status_date', 'status', 'date'),
+        {'info': {'sharded': True}},
+    )
+    
+    @property
+    def starts_at(self):
+        """Local start datetime; bookings after midnight fall on the day after `date`"""
+        return datetime.combine(self.date, datetime.min.time()) + timedelta(minutes=service_minutes(self.time))
+    
+    @classmethod
+    def overlapping(cls, cafe_id, service_date, start_minute, end_minute):
+        """Filter for reservations at a cafe that intersect [start_minute, end_minute) on a service day
+        
+        The neighbouring days only matter for bookings that run past the 06:00
+        service-day boundary. Listing the dates keeps each probe on
+        (cafe_id, date) of the covering index instead of the whole cafe.
+        """
+        previous_day = service_date - timedelta(days=1)
+        days = [previous_day, service_date]
+        clauses = [
+            and_(cls.date == service_date, cls.start_minute < end_minute, cls.end_minute > start_minute),
+            and_(cls.date == previous_day, cls.end_minute > start_minute + MINUTES_PER_DAY)
+        ]
+        if end_minute > SERVICE_DAY_START + MINUTES_PER_DAY:
+            next_day = service_date + timedelta(days=1)
+            days.append(next_day)
+            clauses.append(and_(cls.date == next_day, cls.start_minute < end_minute - MINUTES_PER_DAY))
+        return and_(cls.cafe_id == cafe_id, cls.date.in_(days), or_(*clauses))
+    
+    # The cafe may be in another database than the reservation, so only the table is joined
+    FIELDS = Shape({
+        'id': column('id'),
+        'reservation_number': column('reservation_number'),
+        'guest_name': column('guest_name'),
+        'guest_email': column('guest_email'),
+        'guest_phone': column('guest_phone'),
+        'date': column('date'),
+        'time': column('time'),
+        'guests': column('guests'),
+        'duration': column('duration'),
+        'status': column('status'),
+        'special_requests': column('special_requests'),
+        'notes': column('notes'),
+        'source': column('source'),
+        'cafe': nested('cafe', 'cafe_id', Cafe.FIELDS),
+        'table': nested('table', 'table_id', Table.FIELDS, joined=True),
+        'confirmed_at': column('confirmed_at'),
+        'seated_at': column('seated_at'),
+        'completed_at': column('completed_at'),
+        'cancelled_at': column('cancelled_at'),
+        'created_at': column('created_at'),
+        'updated_at': column('updated_at')
+    })
+    
+    def to_dict(self, fields=None):
+        return self.FIELDS.dump(self, fields)
+
+@event.listens_for(Reservation, 'before_insert')
+@event.listens_for(Reservation, 'before_update')
+def set_reservation_minutes(mapper, connection, target):
+    """Keep start_minute/end_minute in step with time and duration"""
+    if target.duration is None:
+        target.duration = 120
+    target.start_minute = service_minutes(target.time)
+    target.end_minute = target.start_minute + target.duration
+
+class ArchivedReservation(db.Model):
+    """Completed, cancelled and no-show reservations moved out of `reservations` (see archive.py)"""
+    __tablename__ = 'reservations_archive'
+    __bind_key__ = 'archive'
+    
+    # The archive may live in another database, so references are plain ids.
+    # date is part of the key so the table can be range-partitioned on Postgres.
+    id = db.Column(id_type(), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    reservation_number = db.Column(db.String(20), nullable=False, index=True)
+    user_id = db.Column(id_type())
+    cafe_id = db.Column(id_type(), nullable=False)
+    table_id = db.Column(id_type())
+    
+    guest_name = db.Column(db.String(255), nullable=False)
+    guest_email = db.Column(db.String(255), nullable=False)
+    guest_phone = db.Column(db.String(20), nullable=False)
+    
+    time = db.Column(db.String(5), nullable=False)
+    guests = db.Column(db.Integer, nullable=False)
+    duration = db.Column(db.Integer)
+    status = db.Column(db.String(50))
+    start_minute = db.Column(db.Integer)
+    end_minute = db.Column(db.Integer)
+    
+    special_requests = db.Column(db.Text)
+    notes = db.Column(db.Text)
+    source = db.Column(db.String(50))
+    
+    confirmed_at = db.Column(db.DateTime)
+    seated_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    cancelled_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_reservations_archive_cafe_created', 'cafe_id', 'created_at'),
+        db.Index('ix_reservations_archive_user_created', 'user_id', 'created_at'),
+    )
+    
+    @property
+    def cafe(self):
+        return db.session.get(Cafe, self.cafe_id)
+    
+    @property
+    def table(self):
+        return db.session.get(Table, self.table_id) if self.table_id else None
+    
+    # Same shape as a live reservation
+    FIELDS = Reservation.FIELDS
+    to_dict = Reservation.to_dict
+
+class CafeDailyStats(db.Model):
+    """Reservation counters per cafe, service day and booking source, kept up to date by stats.py"""
+    __tablename__ = 'cafe_daily_stats'
+    __table_args__ = {'info': {'sharded': True}}
+    
+    cafe_id = db.Column(id_type(), db.ForeignKey('cafes.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    source = db.Column(db.String(50), primary_key=True)
+    
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    covers = db.Column(db.Integer, nullable=False, default=0)  # guests seated or completed
+    cancellations = db.Column(db.Integer, nullable=False, default=0)
+    no_shows = db.Column(db.Integer, nullable=False, default=0)
+    # Sums and counts, so averages can be combined across days
+    confirm_to_seat_seconds = db.Column(db.BigInteger, nullable=False, default=0)
+    confirm_to_seat_count = db.Column(db.Integer, nullable=False, default=0)
+    seat_to_complete_seconds = db.Column(db.BigInteger, nullable=False, default=0)
+    seat_to_complete_count = db.Column(db.Integer, nullable=False, default=0)
+
+class TurnTime(db.Model):
+    """Expected booking length per cafe, party size bucket, weekday and hour (see turn_times.py)"""
+    __tablename__ = 'turn_times'
+    __table_args__ = {'info': {'sharded': True}}
+    
+    # weekday and hour are -1 in the coarser fallback rows
+    cafe_id = db.Column(id_type(), db.ForeignKey('cafes.id'), primary_key=True)
+    party_size = db.Column(db.Integer, primary_key=True)
+    weekday = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    minutes = db.Column(db.Integer, nullable=False)
+    samples = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ReservationChange(db.Model):
+    """Append-only log of reservation writes; the id is the sync cursor (see changes.py)"""
+    __tablename__ = 'reservation_changes'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    cafe_id = db.Column(id_type(), nullable=False)
+    reservation_id = db.Column(id_type(), nullable=False)
+    op = db.Column(db.String(20), nullable=False)  # created, updated, cancelled
+    data = db.Column(db.Text, nullable=False)  # JSON, the reservation as listed to admins
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_reservation_changes_cafe_id', 'cafe_id', 'id'),
+        db.Index('ix_reservation_changes_created', 'created_at'),
+        # Never reuse ids of pruned rows, or cursors would go backwards
+        {'sqlite_autoincrement': True, 'info': {'sharded': True}},
+    )
+    
+    def to_dict(self):
+        return {
+            'cursor': self.id,
+            'op': self.op,
+            'reservationId': self.reservation_id,
+            'reservation': json.loads(self.data),
+            'at': self.created_at
+        }
+
+class OutboxMessage(db.Model):
+    """An email or POS webhook queued with a reservation write, sent by `flask outbox-worker` (see outbox.py)"""
+    __tablename__ = 'outbox_messages'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), nullable=False)  # email, webhook
+    cafe_id = db.Column(id_type())
+    reservation_id = db.Column(id_type())
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sent, dead
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(32))
+    locked_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_outbox_messages_status_available', 'status', 'available_at'),
+        # Ids double as webhook delivery ids, so pruned ones must not come back
+        {'sqlite_autoincrement': True, 'info': {'sharded': True}},
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
-            'reservation_number': self.reservation_number,
-            'guest_name': self.guest_name,
-            'guest_email': self.guest_email,
-            'guest_phone': self.guest_phone,
-            'date': self.date.isoformat(),
-            'time': self.time,
-            'guests': self.guests,
-            'duration': self.duration,
+            'kind': self.kind,
+            'cafeId': self.cafe_id,
+            'reservationId': self.reservation_id,
+            'payload': json.loads(self.payload),
             'status': self.status,
-            'special_requests': self.special_requests,
-            'notes': self.notes,
-            'source': self.source,
-            'cafe': self.cafe.to_dict() if self.cafe else None,
-            'table': self.table.to_dict() if self.table else None,
-            'confirmed_at': self.confirmed_at.isoformat() if self.confirmed_at else None,
-            'seated_at': self.seated_at.isoformat() if self.seated_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'cancelled_at': self.cancelled_at.isoformat() if self.cancelled_at else None,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'attempts': self.attempts,
+            'lastError': self.last_error,
+            'availableAt': self.available_at,
+            'createdAt': self.created_at,
+            'sentAt': self.sent_at
         }
 
 class Admin(db.Model):
     __tablename__ = 'admins'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(id_type(), primary_key=True, default=new_id)
     username = db.Column(db.String(100), unique=True, nullable=False)
     email = db.Column(db.String(255), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
@@ -290,14 +495,14 @@ class Admin(db.Model):
             'email': self.email,
             'full_name': self.full_name,
             'is_active': self.is_active,
-            'last_login_at': self.last_login_at.isoformat() if self.last_login_at else None,
-            'created_at': self.created_at.isoformat()
+            'last_login_at': self.last_login_at,
+            'created_at': self.created_at
         }
 
 class Role(db.Model):
     __tablename__ = 'roles'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(id_type(), primary_key=True, default=new_id)
     name = db.Column(db.String(100), unique=True, nullable=False)
     display_name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -330,11 +535,18 @@ class Role(db.Model):
 class AdminRole(db.Model):
     __tablename__ = 'admin_roles'
     
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    admin_id = db.Column(db.String(36), db.ForeignKey('admins.id'), nullable=False)
-    role_id = db.Column(db.String(36), db.ForeignKey('roles.id'), nullable=False)
-    cafe_id = db.Column(db.String(36), db.ForeignKey('cafes.id'), nullable=False)
+    id = db.Column(id_type(), primary_key=True, default=new_id)
+    admin_id = db.Column(id_type(), db.ForeignKey('admins.id'), nullable=False)
+    role_id = db.Column(id_type(), db.ForeignKey('roles.id'), nullable=False)
+    cafe_id = db.Column(id_type(), db.ForeignKey('cafes.id'), nullable=False)
     
     # Unique constraint
     __table_args__ = (db.UniqueConstraint('admin_id', 'role_id', 'cafe_id', name='unique_admin_role_cafe'),)
 
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    id_format = db.Column(db.String(20), default=ID_FORMAT)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,359 @@
+import hashlib
+import hmac
+import json
+import logging
+import random
+import smtplib
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from flask import current_app
+from sqlalchemy import delete, func, or_, select, update
+
+from dashboard import admin_reservation
+from metrics import metrics
+from models import db, OutboxMessage
+import shards
+
+logger = logging.getLogger(__name__)
+
+# Guest emails go out for these reservation events; webhooks for every event
+EMAIL_SUBJECTS = {
+    'created': "We received your reservation {number}",
+    'confirmed': "Your reservation {number} is confirmed",
+    'cancelled': "Your reservation {number} has been cancelled"
+}
+
+EMAIL_LINES = {
+    'created': "We received your reservation and will confirm it shortly.",
+    'confirmed': "Your reservation is confirmed. We look forward to seeing you.",
+    'cancelled': "Your reservation has been cancelled."
+}
+
+# HTTP statuses worth retrying; any other 4xx fails the same way every time
+RETRYABLE_HTTP_STATUSES = (408, 409, 425, 429)
+
+
+class PermanentError(Exception):
+    """A delivery that would fail the same way on every attempt; dead-lettered at once"""
+
+
+def init_app(app):
+    metrics.register_collector('outbox', backlog_monitor.current)
+
+
+def add(kind, payload, cafe_id=None, reservation_id=None):
+    """Queue a message in the current transaction; it is only sent if the caller commits"""
+    message = OutboxMessage(
+        kind=kind,
+        cafe_id=cafe_id,
+        reservation_id=reservation_id,
+        payload=json.dumps(payload, default=str)
+    )
+    db.session.add(message)
+    return message
+
+
+def reservation_event(event, reservation):
+    """Queue the guest email and POS webhook for a reservation event (created, confirmed, ...)
+
+    Emails need SMTP_HOST. The webhook goes to the cafe's `pos_webhook_url`
+    setting, or POS_WEBHOOK_URL.
+    """
+    config = current_app.config
+    cafe = reservation.cafe
+    if event in EMAIL_SUBJECTS and config['SMTP_HOST']:
+        add('email', {
+            'to': reservation.guest_email,
+            'subject': EMAIL_SUBJECTS[event].format(number=reservation.reservation_number),
+            'body': _email_body(event, reservation, cafe)
+        }, reservation.cafe_id, reservation.id)
+
+    url = cafe.settings_dict.get('pos_webhook_url') or config['POS_WEBHOOK_URL']
+    if url:
+        add('webhook', {
+            'url': url,
+            'event': f'reservation.{event}',
+            'cafeId': reservation.cafe_id,
+            'reservation': admin_reservation(reservation)
+        }, reservation.cafe_id, reservation.id)
+
+
+def _email_body(event, reservation, cafe):
+    return (
+        f"Hello {reservation.guest_name},\n\n"
+        f"{EMAIL_LINES[event]}\n\n"
+        f"Reservation: {reservation.reservation_number}\n"
+        f"Cafe: {cafe.display_name}\n"
+        f"Date: {reservation.date.isoformat()} at {reservation.time}\n"
+        f"Guests: {reservation.guests}\n\n"
+        f"BarSan\n"
+    )
+
+
+def delivery_id(message_id, location=shards.CONTROL):
+    """The id a receiver sees for a message; row ids repeat across databases, so a shard's carry its name"""
+    return str(message_id) if location is shards.CONTROL else f'{location}-{message_id}'
+
+
+def send_email(delivery_id, payload, config):
+    email = EmailMessage()
+    email['From'] = config['EMAIL_FROM']
+    email['To'] = payload['to']
+    email['Subject'] = payload['subject']
+    email.set_content(payload['body'])
+    try:
+        with smtplib.SMTP(config['SMTP_HOST'], config['SMTP_PORT'], timeout=config['OUTBOX_SEND_TIMEOUT']) as smtp:
+            if config['SMTP_USE_TLS']:
+                smtp.starttls()
+            if config['SMTP_USER']:
+                smtp.login(config['SMTP_USER'], config['SMTP_PASS'])
+            smtp.send_message(email)
+    except smtplib.SMTPRecipientsRefused as e:
+        raise PermanentError(f"Recipient refused: {e.recipients}")
+    except smtplib.SMTPResponseException as e:
+        # 4xx replies are temporary, 5xx are not
+        if e.smtp_code >= 500:
+            raise PermanentError(f"SMTP {e.smtp_code}: {e.smtp_error!r}")
+        raise
+
+
+def send_webhook(delivery_id, payload, config):
+    body = json.dumps({
+        'id': delivery_id,
+        'event': payload['event'],
+        'cafeId': payload['cafeId'],
+        'reservation': payload['reservation']
+    }).encode()
+    headers = {
+        'Content-Type': 'application/json',
+        'X-BarSan-Event': payload['event'],
+        # Same id on every retry, so the receiver can drop duplicates
+        'X-BarSan-Delivery': delivery_id
+    }
+    if config['POS_WEBHOOK_SECRET']:
+        digest = hmac.new(config['POS_WEBHOOK_SECRET'].encode(), body, hashlib.sha256).hexdigest()
+        headers['X-BarSan-Signature'] = f'sha256={digest}'
+    request = urllib.request.Request(payload['url'], data=body, headers=headers, method='POST')
+    try:
+        urllib.request.urlopen(request, timeout=config['OUTBOX_SEND_TIMEOUT']).close()
+    except urllib.error.HTTPError as e:
+        if 400 <= e.code < 500 and e.code not in RETRYABLE_HTTP_STATUSES:
+            raise PermanentError(f"HTTP {e.code}")
+        raise
+
+
+SENDERS = {'email': send_email, 'webhook': send_webhook}
+
+
+def backoff_seconds(attempts, base, cap):
+    """Delay before the next attempt: exponential with jitter, so failed batches spread out"""
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+def backlog():
+    """Pending and dead-lettered counts and the age of the oldest pending message, over every database"""
+    pending, dead, oldest = 0, 0, None
+    for location in shards.locations():
+        with shards.using(location):
+            count, first = db.session.query(func.count(OutboxMessage.id), func.min(OutboxMessage.created_at)).filter(
+                OutboxMessage.status == 'pending'
+            ).one()
+            dead += OutboxMessage.query.filter(OutboxMessage.status == 'dead').count()
+        pending += count
+        if first and (oldest is None or first < oldest):
+            oldest = first
+    return {
+        'pending': pending,
+        'dead': dead,
+        'oldestPendingSeconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0
+    }
+
+
+class BacklogMonitor:
+    """Caches backlog() so scraping /metrics costs one query per database per interval per worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_at = None
+        self.value = None
+
+    def current(self):
+        with self._lock:
+            if self.checked_at is None or \
+                    time.monotonic() - self.checked_at >= current_app.config['OUTBOX_BACKLOG_CACHE_SECONDS']:
+                self.value = backlog()
+                self.checked_at = time.monotonic()
+            return self.value
+
+
+backlog_monitor = BacklogMonitor()
+
+
+class OutboxWorker:
+    """Claims batches of due messages and sends them from a thread pool
+
+    A claim is a conditional UPDATE that stamps the rows with a lease, so
+    several worker processes can drain the same table without sending a
+    message twice. Rows of a crashed worker are picked up again once their
+    lease runs out. Only the main thread uses the database session. With
+    sharding, each database is drained in turn.
+    """
+
+    def __init__(self, config, concurrency=8, batch_size=50, senders=None, log=print):
+        self.config = config
+        self.batch_size = batch_size
+        self.senders = senders or SENDERS
+        self.log = log
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='outbox')
+        self.totals = {'sent': 0, 'retried': 0, 'dead': 0}
+        self._window = {'started': time.monotonic(), 'sent': 0, 'lags': []}
+
+    def claim(self):
+        now = datetime.utcnow()
+        due = [
+            OutboxMessage.status == 'pending',
+            OutboxMessage.available_at <= now,
+            or_(OutboxMessage.locked_until.is_(None), OutboxMessage.locked_until < now)
+        ]
+        ids = db.session.execute(
+            select(OutboxMessage.id).where(*due).order_by(OutboxMessage.id).limit(self.batch_size)
+        ).scalars().all()
+        if not ids:
+            db.session.rollback()
+            return []
+        token = uuid.uuid4().hex
+        # Rows another worker claimed in the meantime no longer match
+        db.session.execute(
+            update(OutboxMessage).where(OutboxMessage.id.in_(ids), *due).values(
+                locked_by=token,
+                locked_until=now + timedelta(seconds=self.config['OUTBOX_LEASE_SECONDS'])
+            )
+        )
+        db.session.commit()
+        return OutboxMessage.query.filter(OutboxMessage.locked_by == token).order_by(OutboxMessage.id).all()
+
+    def _deliver(self, delivery_id, kind, payload):
+        try:
+            self.senders[kind](delivery_id, payload, self.config)
+            return None
+        except Exception as e:
+            return e
+
+    def process(self, messages, location=shards.CONTROL):
+        """Send a batch claimed from `location` concurrently and record each outcome"""
+        jobs = [
+            self.pool.submit(self._deliver, delivery_id(m.id, location), m.kind, json.loads(m.payload))
+            for m in messages
+        ]
+        now = datetime.utcnow()
+        for message, job in zip(messages, jobs):
+            error = job.result()
+            message.attempts += 1
+            message.locked_by = message.locked_until = None
+            if error is None:
+                message.status = 'sent'
+                message.sent_at = datetime.utcnow()
+                message.last_error = None
+                self._count('sent')
+                self._window['sent'] += 1
+                self._window['lags'].append((message.sent_at - message.created_at).total_seconds())
+                continue
+
+            message.last_error = f"{type(error).__name__}: {error}"[:1000]
+            if isinstance(error, PermanentError) or message.attempts >= self.config['OUTBOX_MAX_ATTEMPTS']:
+                message.status = 'dead'
+                self._count('dead')
+                logger.warning("Outbox message %s dead-lettered after %s attempts: %s",
+                               message.id, message.attempts, message.last_error)
+            else:
+                delay = backoff_seconds(message.attempts, self.config['OUTBOX_BACKOFF_SECONDS'],
+                                        self.config['OUTBOX_MAX_BACKOFF_SECONDS'])
+                message.available_at = now + timedelta(seconds=delay)
+                self._count('retried')
+        db.session.commit()
+
+    def _count(self, outcome):
+        self.totals[outcome] += 1
+        metrics.incr(f'outbox.{outcome}')
+
+    def run_once(self):
+        """Claim and send one batch from each database; returns how many messages were claimed"""
+        claimed = 0
+        for location in shards.locations():
+            with shards.using(location):
+                messages = self.claim()
+                if messages:
+                    self.process(messages, location)
+                # Ids repeat across databases, so no row may stay in the identity map for the next one
+                db.session.expunge_all()
+            claimed += len(messages)
+        return claimed
+
+    def run(self, stop, poll_interval=1.0, drain=False, report_every=30):
+        """Work until `stop` (a threading.Event) is set, or with drain until nothing is due"""
+        try:
+            while not stop.is_set():
+                if self.run_once():
+                    if time.monotonic() - self._window['started'] >= report_every:
+                        self.report()
+                elif drain:
+                    break
+                else:
+                    stop.wait(poll_interval)
+        finally:
+            self.pool.shutdown()
+            self.report()
+
+    def report(self):
+        """Log throughput and send lag since the last report"""
+        window, elapsed = self._window, time.monotonic() - self._window['started']
+        lags = sorted(window['lags'])
+        line = f"outbox: sent {window['sent']} ({window['sent'] / elapsed:.1f}/s)" if elapsed else "outbox: sent 0"
+        if lags:
+            line += (f", lag p50 {lags[len(lags) // 2]:.2f}s p95 {lags[int(len(lags) * 0.95)]:.2f}s"
+                     f" max {lags[-1]:.2f}s")
+        line += f"; totals sent {self.totals['sent']}, retried {self.totals['retried']}, dead {self.totals['dead']}"
+        self.log(line)
+        self._window = {'started': time.monotonic(), 'sent': 0, 'lags': []}
+
+
+def requeue_dead(ids=None, location=shards.CONTROL):
+    """Give dead-lettered messages a fresh set of attempts; returns how many were requeued
+
+    Without ids, every database's dead letters are requeued. Ids are only
+    unique within one database, the main one unless location names a shard.
+    """
+    requeued = 0
+    for database in ([location] if ids else shards.locations()):
+        with shards.using(database):
+            query = update(OutboxMessage).where(OutboxMessage.status == 'dead')
+            if ids:
+                query = query.where(OutboxMessage.id.in_(ids))
+            result = db.session.execute(query.values(status='pending', attempts=0, available_at=datetime.utcnow()))
+            db.session.commit()
+        requeued += result.rowcount
+    return requeued
+
+
+def prune_sent(older_than_days):
+    """Delete sent messages older than the given number of days; returns the number deleted"""
+    if older_than_days < 1:
+        raise ValueError("older_than_days must be at least 1")
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = 0
+    for location in shards.locations():
+        with shards.using(location):
+            result = db.session.execute(delete(OutboxMessage).where(
+                OutboxMessage.status == 'sent',
+                OutboxMessage.sent_at < cutoff
+            ))
+            db.session.commit()
+        deleted += result.rowcount
+    return deleted
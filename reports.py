@@ -0,0 +1,172 @@
+import numpy as np
+from flask import current_app
+
+from archive import may_be_archived
+from cache import TTLCache
+from models import db, Reservation, ArchivedReservation, Table, Zone
+from schedule import WEEKDAYS, get_schedule, minutes_to_label
+from utils import SERVICE_DAY_START, MINUTES_PER_DAY
+
+# Reservations that kept a table busy (no-shows left it empty)
+OCCUPYING_STATUSES = ('pending', 'confirmed', 'seated', 'completed')
+
+BUCKET_SIZES = (15, 30, 60)
+
+report_cache = TTLCache('reports', max_entries=128)
+
+
+def load_intervals(cafe_id, start_date, end_date):
+    """Busy intervals as arrays: (service date ordinals, table ids, start offsets, end offsets)
+
+    Offsets are minutes since the start of the service day, clipped to the day.
+    Archived reservations are included when the range reaches into the past.
+    Table ids stay a list, since their type depends on ID_FORMAT.
+    """
+    models = [Reservation]
+    if may_be_archived(target_date=start_date):
+        models.append(ArchivedReservation)
+
+    rows = []
+    for model in models:
+        rows += db.session.query(
+            model.date, model.table_id, model.start_minute, model.end_minute
+        ).filter(
+            model.cafe_id == cafe_id,
+            model.date >= start_date,
+            model.date <= end_date,
+            model.status.in_(OCCUPYING_STATUSES),
+            model.start_minute.isnot(None)
+        ).all()
+
+    # One pass per column; zip(*rows) is several times slower on large results
+    count = len(rows)
+    days = np.fromiter((row[0].toordinal() for row in rows), dtype=np.int64, count=count)
+    table_ids = [row[1] for row in rows]
+    starts = np.fromiter((row[2] for row in rows), dtype=np.int64, count=count)
+    ends = np.fromiter((row[3] for row in rows), dtype=np.int64, count=count)
+    starts = np.clip(starts - SERVICE_DAY_START, 0, MINUTES_PER_DAY)
+    ends = np.clip(ends - SERVICE_DAY_START, 0, MINUTES_PER_DAY)
+    return days, table_ids, starts, ends
+
+
+def trim_overlaps(tables, days, starts, ends):
+    """Sort intervals by table, day and start, and cut each one to begin after the
+    previous ones on its table and day, so double-booked time counts once"""
+    order = np.lexsort((starts, days, tables))
+    tables, days, starts, ends = tables[order], days[order], starts[order], ends[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (tables[1:] != tables[:-1]) | (days[1:] != days[:-1])
+    # Shift each group above the previous one so a running max never crosses groups
+    offset = np.cumsum(first) * (MINUTES_PER_DAY + 1)
+    reach = np.maximum.accumulate(ends + offset) - offset
+    starts = np.where(first, starts, np.maximum(starts, np.roll(reach, 1)))
+    return tables, days, np.minimum(starts, ends), ends
+
+
+def busy_minutes(groups, group_count, starts, ends):
+    """Bookings in progress per group x minute of the service day
+
+    Difference-array accumulation: +1 where an interval starts, -1 where it
+    ends, then a cumulative sum along the day.
+    """
+    diff = np.zeros((group_count, MINUTES_PER_DAY + 1), dtype=np.int32)
+    np.add.at(diff, (groups, starts), 1)
+    np.add.at(diff, (groups, ends), -1)
+    return np.cumsum(diff[:, :-1], axis=1, dtype=np.int32)
+
+
+def _window(schedule, bucket):
+    """Bucket-aligned [lo, hi) offsets covering every open day's hours"""
+    open_days = [day for day in schedule.days if day]
+    if not open_days:
+        return 0, 0
+    lo = min(day.open_minute for day in open_days) - SERVICE_DAY_START
+    hi = max(day.close_minute for day in open_days) - SERVICE_DAY_START
+    lo = max(0, lo // bucket * bucket)
+    hi = min(MINUTES_PER_DAY, -(-hi // bucket) * bucket)
+    return lo, max(lo, hi)
+
+
+def _percent(used, capacity):
+    result = np.divide(used * 100.0, capacity, out=np.zeros(np.broadcast(used, capacity).shape),
+                       where=capacity > 0)
+    return np.round(result, 1).tolist()
+
+
+def occupancy_report(cafe, start_date, end_date, bucket=30):
+    """Utilization heatmaps for a cafe over a date range, cached per (cafe, range, bucket)"""
+    key = (cafe.id, start_date, end_date, bucket)
+    report = report_cache.get(key)
+    if report is None:
+        report = build_occupancy_report(cafe, start_date, end_date, bucket)
+        report_cache.set(key, report, current_app.config['REPORT_CACHE_SECONDS'])
+    return report
+
+
+def build_occupancy_report(cafe, start_date, end_date, bucket=30):
+    """Occupied share of table time per zone, table, weekday and time bucket
+
+    Utilization is booked table-minutes over table-minutes in the range, where
+    each table counts for every day in the range, within the span of the
+    cafe's opening hours. Reservations without a table only show up in the
+    `unassigned` count.
+    """
+    tables = db.session.query(Table.id, Table.number, Table.seats, Table.zone_id, Zone.name).join(
+        Zone, Zone.id == Table.zone_id
+    ).filter(Table.cafe_id == cafe.id, Table.is_active == True).order_by(Table.number).all()
+    table_index = {t.id: i for i, t in enumerate(tables)}
+
+    days, table_ids, starts, ends = load_intervals(cafe.id, start_date, end_date)
+    table_idx = np.fromiter((table_index.get(t, -1) for t in table_ids), dtype=np.int64, count=len(table_ids))
+    assigned = table_idx >= 0
+
+    table_idx, days, starts, ends = trim_overlaps(table_idx[assigned], days[assigned],
+                                                  starts[assigned], ends[assigned])
+    # One row per (table, weekday); bucket totals summed over all matching days
+    busy = busy_minutes(table_idx * 7 + (days - 1) % 7, len(tables) * 7, starts, ends)
+    lo, hi = _window(get_schedule(cafe), bucket)
+    buckets = (hi - lo) // bucket
+    used = busy[:, lo:hi].reshape(len(tables), 7, buckets, bucket).sum(axis=3)  # table x weekday x bucket
+
+    # Number of each weekday in the range; date(1, 1, 1) is ordinal 1 and a Monday
+    first = start_date.toordinal()
+    day_count = end_date.toordinal() - first + 1
+    per_weekday = np.bincount((np.arange(first, first + day_count) - 1) % 7, minlength=7)
+
+    capacity = per_weekday[:, None] * bucket  # one table, weekday x bucket
+    table_count = len(tables)
+    window_minutes = buckets * bucket
+
+    zones = {}
+    for i, t in enumerate(tables):
+        zones.setdefault((t.zone_id, t.name), []).append(i)
+
+    return {
+        'from': start_date.isoformat(),
+        'to': end_date.isoformat(),
+        'days': day_count,
+        'bucketMinutes': bucket,
+        'buckets': [minutes_to_label(SERVICE_DAY_START + lo + i * bucket) for i in range(buckets)],
+        'weekdays': WEEKDAYS,
+        'reservations': len(table_ids),
+        'unassigned': int((~assigned).sum()),
+        'utilization': _percent(used.sum(), table_count * day_count * window_minutes),
+        'byWeekday': _percent(used.sum(axis=(0, 2)), table_count * per_weekday * window_minutes),
+        'byHour': _percent(used.sum(axis=(0, 1)), table_count * day_count * bucket),
+        'heatmap': _percent(used.sum(axis=0), table_count * capacity),
+        'zones': [{
+            'id': zone_id,
+            'name': name,
+            'tables': len(idx),
+            'utilization': _percent(used[idx].sum(), len(idx) * day_count * window_minutes),
+            'heatmap': _percent(used[idx].sum(axis=0), len(idx) * capacity)
+        } for (zone_id, name), idx in zones.items()],
+        'tables': [{
+            'id': t.id,
+            'number': t.number,
+            'seats': t.seats,
+            'zoneId': t.zone_id,
+            'utilization': _percent(used[i].sum(), day_count * window_minutes),
+            'byHour': _percent(used[i].sum(axis=0), day_count * bucket)
+        } for i, t in enumerate(tables)]
+    }
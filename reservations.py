@@ -1,21 +1,36 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta, date
-import uuid
+from sqlalchemy.orm import joinedload
 
-from models import db, Reservation, TemporaryReservation, Cafe, Table, Zone, User
+from models import db, Reservation, ArchivedReservation, TemporaryReservation, Cafe, Table, Zone, User
+from ids import new_id
 from utils import (
     generate_reservation_number, 
     is_valid_time_slot, 
-    is_time_slot_available,
+    service_minutes,
     validate_email, 
     validate_phone, 
     sanitize_string
 )
+from routing import plain_reads, read_only, reading_from_replica, use_primary, write_transaction
+from archive import find_archived, may_be_archived, paginate_history
+from fieldsets import FieldError
+from schedule import get_schedule, minutes_to_label
+from allocator import assign_table
+from stats import record_change, snapshot
+from turn_times import booking_duration
+import changes
+import dashboard
+import events
+import holds
+import outbox
+import shards
 
 reservations_bp = Blueprint('reservations', __name__)
 
 @reservations_bp.route('/temp', methods=['POST'])
+@write_transaction
 def create_temp_reservation():
     try:
         data = request.get_json()
@@ -40,6 +55,12 @@ def create_temp_reservation():
         if guests < 1 or guests > 20:
             return jsonify({'success': False, 'message': 'Invalid number of guests'}), 400
         
+        # The hold lives in the cafe's database, like the booking made from it
+        shards.use_cafe(cafe_id, write=True)
+        if holds.coalescing():
+            # A HoldWriter makes the write, so the checks below need no write lock
+            plain_reads()
+        
         # Check if cafe exists and is active
         cafe = Cafe.query.filter_by(id=cafe_id, is_active=True).first()
         if not cafe:
@@ -51,37 +72,53 @@ def create_temp_reservation():
         except ValueError:
             return jsonify({'success': False, 'message': 'Invalid date format'}), 400
         
-        # Delete existing temp reservation with same session
-        TemporaryReservation.query.filter_by(session_id=session_id).delete()
-        
-        # Create temporary reservation
-        temp_reservation = TemporaryReservation(
-            id=str(uuid.uuid4()),
-            cafe_id=cafe_id,
-            date=reservation_date,
-            time=time,
-            guests=guests,
-            zone_id=zone_id,
-            session_id=session_id,
-            expires_at=datetime.utcnow() + timedelta(minutes=15)
-        )
-        
-        db.session.add(temp_reservation)
-        db.session.commit()
+        # The time must be one of the slots compiled from the cafe's opening hours
+        day_schedule = get_schedule(cafe).for_date(reservation_date)
+        if not day_schedule:
+            return jsonify({'success': False, 'message': 'Cafe is closed on this date'}), 400
+        
+        start_minute = service_minutes(time)
+        if start_minute not in day_schedule.slot_set:
+            return jsonify({'success': False, 'message': 'Time is not an available booking slot'}), 400
+        time = minutes_to_label(start_minute)
+        
+        hold = {
+            'id': new_id(),
+            'cafe_id': cafe_id,
+            'date': reservation_date,
+            'time': time,
+            'guests': guests,
+            'zone_id': zone_id,
+            'session_id': session_id,
+            'expires_at': datetime.utcnow() + timedelta(minutes=15)
+        }
+        
+        if holds.coalescing():
+            # A later request of the same session may have been written in the same batch; it is the hold now
+            hold = holds.save(hold)
+        else:
+            # Delete existing temp reservation with same session
+            TemporaryReservation.query.filter_by(session_id=session_id).delete()
+            db.session.add(TemporaryReservation(**hold))
+            db.session.commit()
         
         return jsonify({
             'success': True,
             'tempReservation': {
-                'id': temp_reservation.id,
-                'expiresAt': temp_reservation.expires_at.isoformat()
+                'id': hold['id'],
+                'expiresAt': hold['expires_at'].isoformat()
             }
         })
         
+    except (shards.CafeUnavailable, holds.HoldsBusy):
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @reservations_bp.route('/', methods=['POST'])
+@write_transaction
 def create_reservation():
     try:
         data = request.get_json()
@@ -110,7 +147,7 @@ def create_reservation():
             return jsonify({'success': False, 'message': 'Guest name too short'}), 400
         
         # Get temporary reservation
-        temp_reservation = TemporaryReservation.query.get(temp_reservation_id)
+        temp_reservation = shards.find(lambda: TemporaryReservation.query.get(temp_reservation_id), write=True)
         if not temp_reservation:
             return jsonify({'success': False, 'message': 'Temporary reservation not found or expired'}), 404
         
@@ -119,42 +156,62 @@ def create_reservation():
             db.session.commit()
             return jsonify({'success': False, 'message': 'Temporary reservation expired'}), 400
         
-        # Check for conflicts with existing reservations
-        existing_reservations = Reservation.query.filter(
-            Reservation.cafe_id == temp_reservation.cafe_id,
-            Reservation.date == temp_reservation.date,
-            Reservation.status.in_(['pending', 'confirmed', 'seated'])
-        ).all()
-        
-        existing_times = [{'time': r.time, 'duration': r.duration} for r in existing_reservations]
+        # Seat the party at the best-fitting free table, moving unseated parties if that makes room
+        start_minute = service_minutes(temp_reservation.time)
+        duration = booking_duration(temp_reservation.cafe, temp_reservation.date, temp_reservation.guests, start_minute)
+        table_id, moves = assign_table(
+            temp_reservation.cafe_id,
+            temp_reservation.date,
+            temp_reservation.guests,
+            start_minute,
+            start_minute + duration,
+            zone_id=temp_reservation.zone_id
+        )
         
-        if not is_time_slot_available(temp_reservation.time, 120, existing_times):
+        if not table_id:
             return jsonify({'success': False, 'message': 'Time slot no longer available'}), 400
         
+        changes.apply_table_moves(moves)
+        
         # Create reservation
+        # Numbers are random within the second; the write lock makes this check race-free
         reservation_number = generate_reservation_number()
+        while Reservation.query.filter_by(reservation_number=reservation_number).first():
+            reservation_number = generate_reservation_number()
         
         reservation = Reservation(
-            id=str(uuid.uuid4()),
+            id=new_id(),
             reservation_number=reservation_number,
             user_id=user_id,
             cafe_id=temp_reservation.cafe_id,
+            table_id=table_id,
             guest_name=sanitize_string(guest_name),
             guest_email=guest_email,
             guest_phone=guest_phone.replace('-', '').replace(' ', ''),
             date=temp_reservation.date,
             time=temp_reservation.time,
             guests=temp_reservation.guests,
+            duration=duration,
             special_requests=sanitize_string(special_requests) if special_requests else None,
             status='pending'
         )
         
         db.session.add(reservation)
+        # Flush so column defaults such as source are set before counting
+        db.session.flush()
+        record_change(None, reservation)
+        change = changes.record('created', reservation)
+        outbox.reservation_event('created', reservation)
         
         # Delete temporary reservation
         db.session.delete(temp_reservation)
         db.session.commit()
         
+        dashboard.publish_reservation('reservation.created', reservation, change)
+        if moves:
+            events.publish(reservation.cafe_id, 'reservations.repacked',
+                           {'date': reservation.date.isoformat(), 'moved': len(moves)})
+        
         # Get cafe info for response
         cafe = Cafe.query.get(reservation.cafe_id)
         
@@ -174,12 +231,16 @@ def create_reservation():
             }
         })
         
+    except shards.CafeUnavailable:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @reservations_bp.route('/my', methods=['GET'])
 @jwt_required()
+@read_only
 def get_my_reservations():
     try:
         user_id = get_jwt_identity()
@@ -188,40 +249,73 @@ def get_my_reservations():
         status = request.args.get('status')
         limit = int(request.args.get('limit', 10))
         offset = int(request.args.get('offset', 0))
+        try:
+            fields = Reservation.FIELDS.select(request.args.get('fields'))
+        except FieldError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         # Build query
-        query = Reservation.query.filter_by(user_id=user_id)
+        filters = {'user_id': user_id}
         
         if status:
-            query = query.filter_by(status=status)
-        
-        reservations = query.order_by(Reservation.created_at.desc()).offset(offset).limit(limit).all()
+            filters['status'] = status
+        
+        # Past visits may have been moved to the archive. Tables are loaded with the rows, which
+        # can come from several cafe databases. With fields=, only the columns and relationships
+        # those fields use are read, plus created_at for the paging
+        if fields is None:
+            query = Reservation.query.options(joinedload(Reservation.table).joinedload(Table.zone))
+        else:
+            query = Reservation.query.options(*Reservation.FIELDS.options(Reservation, fields, extra=('created_at',)))
+        query = query.filter_by(**filters)
+        archived_options = ArchivedReservation.FIELDS.only(ArchivedReservation, fields, extra=('created_at',))
+        archived_query = ArchivedReservation.query.options(*archived_options).filter_by(**filters) \
+            if may_be_archived(status) else None
+        _, reservations = paginate_history(query, archived_query, offset, limit, count=False, all_shards=True)
         
         return jsonify({
             'success': True,
-            'reservations': [r.to_dict() for r in reservations]
+            'reservations': [r.to_dict(fields) for r in reservations]
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @reservations_bp.route('/<reservation_number>', methods=['GET'])
+@read_only
 def get_reservation(reservation_number):
     try:
-        reservation = Reservation.query.filter_by(reservation_number=reservation_number).first()
+        try:
+            fields = Reservation.FIELDS.select(request.args.get('fields'))
+        except FieldError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        options = Reservation.FIELDS.only(Reservation, fields)
+        lookup = lambda: Reservation.query.options(*options).filter_by(reservation_number=reservation_number).first()
+        reservation = shards.find(lookup)
+        
+        # A reservation created moments ago may not have reached the replica yet
+        if not reservation and reading_from_replica():
+            use_primary()
+            reservation = shards.find(lookup)
+        
+        # Old completed/cancelled bookings live in the archive
+        if not reservation:
+            reservation = find_archived(reservation_number, ArchivedReservation.FIELDS.only(ArchivedReservation, fields))
         
         if not reservation:
             return jsonify({'success': False, 'message': 'Reservation not found'}), 404
         
         return jsonify({
             'success': True,
-            'reservation': reservation.to_dict()
+            'reservation': reservation.to_dict(fields)
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @reservations_bp.route('/<reservation_number>', methods=['DELETE'])
+@write_transaction
 def cancel_reservation(reservation_number):
     try:
         data = request.get_json()
@@ -231,33 +325,41 @@ def cancel_reservation(reservation_number):
         
         email = data.get('email').lower().strip()
         
-        reservation = Reservation.query.filter(
+        reservation = shards.find(lambda: Reservation.query.filter(
             Reservation.reservation_number == reservation_number,
             Reservation.guest_email == email,
             Reservation.status.in_(['pending', 'confirmed'])
-        ).first()
+        ).first(), write=True)
         
         if not reservation:
             return jsonify({'success': False, 'message': 'Reservation not found or cannot be cancelled'}), 404
         
         # Check if cancellation is allowed (at least 2 hours before)
-        reservation_datetime = datetime.combine(reservation.date, datetime.strptime(reservation.time, '%H:%M').time())
         two_hours_from_now = datetime.now() + timedelta(hours=2)
         
-        if reservation_datetime < two_hours_from_now:
+        if reservation.starts_at < two_hours_from_now:
             return jsonify({'success': False, 'message': 'Cannot cancel reservation less than 2 hours before the scheduled time'}), 400
         
         # Update reservation status
+        before = snapshot(reservation)
         reservation.status = 'cancelled'
         reservation.cancelled_at = datetime.utcnow()
+        record_change(before, reservation)
+        change = changes.record('cancelled', reservation)
+        outbox.reservation_event('cancelled', reservation)
         
         db.session.commit()
         
+        dashboard.publish_reservation('reservation.cancelled', reservation, change)
+        
         return jsonify({
             'success': True,
             'message': 'Reservation cancelled successfully'
         })
         
+    except shards.CafeUnavailable:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -0,0 +1,279 @@
+import random
+import threading
+import time
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, jsonify, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import exc, text
+from sqlalchemy.sql.util import find_tables
+
+from metrics import metrics
+
+REPLICA_BIND = 'replica'
+SHARD_BIND_PREFIX = 'shard:'
+READ_YOUR_WRITES_COOKIE = 'db-primary-until'
+
+# Seconds the replica is behind the primary, per replica dialect
+DEFAULT_LAG_SQL = {
+    'postgresql': (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    ),
+}
+
+
+# Lock conflicts a retry can get past: SQLite busy errors, Postgres serialization failures and deadlocks
+LOCK_ERROR_MESSAGES = ('database is locked', 'database table is locked')
+LOCK_ERROR_PGCODES = ('40001', '40P01')
+
+
+class ShardNotSelected(RuntimeError):
+    """A per-cafe table was used before a cafe or shard was selected (see shards.py)"""
+
+
+class RoutingSession(Session):
+    """Session that sends per-cafe tables to the selected shard, and reads to the replica bind while a read-only view is running"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = _shard_engine(self._db, mapper, clause)
+            if engine is not None:
+                return engine
+        if bind is None and not self._flushing and _route_to_replica(mapper):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _end_write_transaction(session):
+    # Whatever the view reads after its commit is a plain read, and must not make it run again
+    if has_app_context() and g.get('db_write'):
+        g.db_write, g.db_write_committed = False, True
+
+
+def _is_sharded(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.info.get('sharded', False)
+    if clause is not None:
+        return any(table.info.get('sharded') for table in find_tables(clause, include_crud=True))
+    return False
+
+
+def _shard_engine(db, mapper, clause):
+    """Engine of the selected shard for per-cafe tables, None for everything else"""
+    if not has_app_context() or not current_app.config.get('SHARDS') or not _is_sharded(mapper, clause):
+        return None
+    if 'db_shard' not in g:
+        raise ShardNotSelected("Per-cafe data was queried before a cafe was selected")
+    # None is the main database, which still holds cafes that were never moved
+    if g.db_shard is None:
+        return None
+    return db.engines[SHARD_BIND_PREFIX + g.db_shard]
+
+
+def _route_to_replica(mapper):
+    if not has_app_context() or g.get('db_route') != REPLICA_BIND:
+        return False
+    if mapper is None:
+        return True
+    # Only models on the default bind have a copy on the replica
+    return sa.inspect(mapper).local_table.metadata.info.get('bind_key') is None
+
+
+class ReplicaMonitor:
+    """Caches replica health and lag so the check costs one query per interval per worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_at = None
+        self.healthy = False
+        self.lag_seconds = None
+
+    def is_usable(self):
+        config = current_app.config
+        with self._lock:
+            if self.is_due(config):
+                self._check(config)
+            return self.last_verdict(config)
+
+    def is_due(self, config):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= config['REPLICA_LAG_CHECK_INTERVAL']
+
+    def last_verdict(self, config):
+        """Whether the replica was usable at the last check, without checking again"""
+        return self.healthy and self.lag_seconds is not None \
+            and self.lag_seconds <= config['REPLICA_MAX_LAG_SECONDS']
+
+    def _check(self, config):
+        self.checked_at = time.monotonic()
+        engine = current_app.extensions['sqlalchemy'].engines[REPLICA_BIND]
+        lag_sql = config['REPLICA_LAG_SQL'] or DEFAULT_LAG_SQL.get(engine.dialect.name)
+        try:
+            with engine.connect() as conn:
+                self.lag_seconds = float(conn.execute(text(lag_sql)).scalar() or 0) if lag_sql else 0.0
+            self.healthy = True
+        except exc.DBAPIError:
+            self.healthy = False
+            self.lag_seconds = None
+            metrics.incr('db.replica.check_failed')
+
+    def status(self):
+        return {
+            'healthy': self.healthy,
+            'lag_seconds': self.lag_seconds,
+            'checked_seconds_ago': round(time.monotonic() - self.checked_at, 1) if self.checked_at else None
+        }
+
+
+monitor = ReplicaMonitor()
+
+
+def replica_configured():
+    return REPLICA_BIND in current_app.config.get('SQLALCHEMY_BINDS', {})
+
+
+def choose_route():
+    """Pick the bind for a read-only request"""
+    if not replica_configured():
+        return 'primary'
+
+    primary_until = request.cookies.get(READ_YOUR_WRITES_COOKIE, type=float)
+    if primary_until and primary_until > time.time():
+        metrics.incr('db.reads.primary_read_your_writes')
+        return 'primary'
+
+    if not monitor.is_usable():
+        metrics.incr('db.reads.primary_replica_unavailable')
+        return 'primary'
+
+    metrics.incr('db.reads.replica')
+    return REPLICA_BIND
+
+
+def read_only(f):
+    """Decorator for views that only read; they are served from the replica when it is fresh"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_route = choose_route()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def is_lock_error(error):
+    """Whether a database error is a lock conflict that running the transaction again can get past"""
+    orig = getattr(error, 'orig', None) or error
+    if getattr(orig, 'pgcode', None) in LOCK_ERROR_PGCODES:
+        return True
+    return any(message in str(orig) for message in LOCK_ERROR_MESSAGES)
+
+
+def note_db_error(error):
+    """Flag a lock conflict for write_transaction, even when the view turns the exception into a response"""
+    if has_app_context() and is_lock_error(error):
+        g.db_lock_conflict = True
+
+
+def writes_to(engine):
+    """Whether a transaction starting on this engine is the write transaction of a write_transaction view
+
+    That is the database holding the selected cafe's data: its shard, or the
+    main database.
+    """
+    if not has_app_context() or not g.get('db_write'):
+        return False
+    engines = current_app.extensions['sqlalchemy'].engines
+    shard = g.get('db_shard')
+    return engine is (engines[SHARD_BIND_PREFIX + shard] if shard else engines[None])
+
+
+def write_transaction(f):
+    """Decorator for views that write; they take the write lock up front and are retried on lock conflicts
+
+    On SQLite the view's transaction starts with BEGIN IMMEDIATE, so it waits
+    for the write lock (up to busy_timeout) before its first read, instead of
+    failing when it later upgrades a read lock that another writer has
+    overtaken. A view that still hits a lock conflict is rolled back and run
+    again after a jittered backoff until DB_WRITE_DEADLINE_SECONDS, then
+    answered with 503. Once the view has committed it is never run again.
+
+    The views turn their exceptions into error responses, so conflicts are
+    not seen as exceptions here: every engine's handle_error event reports
+    them through note_db_error (see database.init_engines), which sets
+    g.db_lock_conflict whatever the view does with the exception.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        config = current_app.config
+        session = current_app.extensions['sqlalchemy'].session
+        deadline = time.monotonic() + config['DB_WRITE_DEADLINE_SECONDS']
+        attempt = 0
+        while True:
+            g.db_write, g.db_write_committed, g.db_lock_conflict = True, False, False
+            try:
+                response = f(*args, **kwargs)
+            except exc.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                g.db_lock_conflict = True
+            if not g.db_lock_conflict or g.db_write_committed:
+                return response
+
+            session.rollback()
+            attempt += 1
+            delay = min(config['DB_WRITE_MAX_BACKOFF_SECONDS'],
+                        config['DB_WRITE_BACKOFF_SECONDS'] * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            if time.monotonic() + delay > deadline:
+                metrics.incr('db.write_timeouts')
+                response = jsonify({'success': False, 'message': 'The system is busy, please try again'})
+                response.status_code = 503
+                response.headers['Retry-After'] = '1'
+                return response
+            metrics.incr('db.write_retries')
+            time.sleep(delay)
+    return decorated_function
+
+
+def plain_reads():
+    """Let the rest of a write_transaction view read without the write lock, e.g. when its write is made elsewhere"""
+    g.db_write = False
+
+
+def start_writes():
+    """After plain_reads(), end the reads' transaction so the view's next query starts its write transaction"""
+    current_app.extensions['sqlalchemy'].session.rollback()
+    g.db_write = True
+
+
+def reading_from_replica():
+    return g.get('db_route') == REPLICA_BIND
+
+
+def use_primary():
+    """Switch the rest of this request to the primary, e.g. after a miss on the replica"""
+    if reading_from_replica():
+        metrics.incr('db.reads.primary_replica_miss')
+    g.db_route = 'primary'
+
+
+def init_app(app):
+    """Register the read-your-writes cookie and replica metrics"""
+    @app.after_request
+    def mark_recent_write(response):
+        if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400 \
+                and replica_configured():
+            window = app.config['READ_YOUR_WRITES_SECONDS']
+            response.set_cookie(
+                READ_YOUR_WRITES_COOKIE,
+                str(time.time() + window),
+                max_age=window,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
+
+    if REPLICA_BIND in app.config.get('SQLALCHEMY_BINDS', {}):
+        metrics.register_collector('replica', monitor.status)
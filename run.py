@@ -1,11 +1,12 @@
 import os
-from app import app, create_tables, seed_data, configure_database
+import time
+from app import create_app, verify_startup
 
 if __name__ == '__main__':
-    with app.app_context():
-        configure_database()
-        create_tables()
-        seed_data()
+    started = time.perf_counter()
+    app = create_app()
+    # Schema creation and seeding are explicit: flask init-db / flask seed
+    verify_startup(app, started)
 
     debug = os.getenv('FLASK_ENV') == 'development'
     host = os.getenv('HOST', '0.0.0.0')
@@ -15,5 +16,3 @@ if __name__ == '__main__':
     print(f"Debug mode: {debug}")
 
     app.run(debug=debug, host=host, port=port)
-
-# need seed to fun seperate to prevent that it will ride it self
@@ -0,0 +1,107 @@
+import threading
+from collections import namedtuple
+
+from utils import service_minutes, MINUTES_PER_DAY
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Used for weekdays missing from opening_hours; gives the historical 17:00-23:00 grid
+DEFAULT_HOURS = {'open': '17:00', 'close': '01:00'}
+
+# Cafe.settings keys, all in minutes. last_seating_before_close defaults to the
+# booking duration, so the last booking ends at closing time.
+DEFAULT_SLOT_INTERVAL = 30
+DEFAULT_DURATION = 120
+
+DaySchedule = namedtuple('DaySchedule', [
+    'open_minute',    # service-day minutes (see utils.service_minutes)
+    'close_minute',
+    'duration',       # default booking length
+    'slots',          # tuple of slot start minutes
+    'labels',         # matching "HH:MM" strings
+    'slot_set'        # frozenset(slots) for validation
+])
+
+
+class CafeSchedule:
+    """Slot grids for one cafe, one per weekday (None when closed)"""
+
+    def __init__(self, days, duration):
+        self.days = days
+        self.duration = duration
+
+    def for_date(self, service_date):
+        return self.days[service_date.weekday()]
+
+
+def minutes_to_label(minutes):
+    minutes %= MINUTES_PER_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def compile_day(hours, interval, duration, last_seating_before_close):
+    """Build the slot grid for one day's {'open', 'close'[, 'last_seating']} entry"""
+    if not hours or hours.get('closed'):
+        return None
+
+    open_minute = service_minutes(hours['open'])
+    close_minute = service_minutes(hours['close'])
+    # Overnight hours, e.g. 17:00-02:00 is 1020-1560
+    if close_minute <= open_minute:
+        close_minute += MINUTES_PER_DAY
+
+    if hours.get('last_seating'):
+        last_seating = service_minutes(hours['last_seating'])
+        if last_seating < open_minute:
+            last_seating += MINUTES_PER_DAY
+    else:
+        last_seating = close_minute - last_seating_before_close
+
+    slots = tuple(range(open_minute, min(last_seating, close_minute) + 1, interval))
+    if not slots:
+        return None
+    return DaySchedule(
+        open_minute=open_minute,
+        close_minute=close_minute,
+        duration=duration,
+        slots=slots,
+        labels=tuple(minutes_to_label(m) for m in slots),
+        slot_set=frozenset(slots)
+    )
+
+
+def compile_schedule(opening_hours, settings):
+    """Compile a cafe's opening_hours and settings dicts into per-weekday slot grids
+
+    Weekdays missing from opening_hours use DEFAULT_HOURS; a day set to null or
+    {"closed": true} has no slots. A slot_interval below 1 uses DEFAULT_SLOT_INTERVAL.
+    """
+    interval = int(settings.get('slot_interval', DEFAULT_SLOT_INTERVAL))
+    # A zero interval would fail every availability request and a negative one would close every day
+    if interval <= 0:
+        interval = DEFAULT_SLOT_INTERVAL
+    duration = int(settings.get('default_duration', DEFAULT_DURATION))
+    before_close = int(settings.get('last_seating_before_close', duration))
+
+    days = []
+    for weekday in WEEKDAYS:
+        hours = opening_hours.get(weekday, DEFAULT_HOURS) if opening_hours else DEFAULT_HOURS
+        days.append(compile_day(hours, interval, duration, before_close))
+    return CafeSchedule(days, duration)
+
+
+_cache_lock = threading.Lock()
+_cache = {}  # cafe id -> (cafe.updated_at, CafeSchedule)
+
+
+def get_schedule(cafe):
+    """Compiled schedule for a cafe, recompiled only when the cafe row has changed"""
+    with _cache_lock:
+        cached = _cache.get(cafe.id)
+    if cached and cached[0] == cafe.updated_at:
+        return cached[1]
+
+    schedule = compile_schedule(cafe.opening_hours_dict, cafe.settings_dict)
+    with _cache_lock:
+        _cache[cafe.id] = (cafe.updated_at, schedule)
+    return schedule
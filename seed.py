@@ -0,0 +1,129 @@
+from werkzeug.security import generate_password_hash
+import json
+
+from models import db, Cafe, Zone, Table, Admin, Role, AdminRole
+import shards
+
+# Open every evening until 02:00; see schedule.py for how these become booking slots
+OPENING_HOURS = {
+    day: {'open': '17:00', 'close': '02:00'}
+    for day in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+}
+BOOKING_SETTINGS = {'slot_interval': 30, 'default_duration': 120}
+
+
+def seed_data():
+    """Seed initial data (requires an app context); safe to run repeatedly"""
+    # Create cafes
+    if not Cafe.query.filter_by(name='BarSan').first():
+        barsan = Cafe(
+            name='BarSan',
+            display_name='BarSan.',
+            description='BarSan Cafe',
+            address='123 Main St',
+            phone='02-123-4567',
+            opening_hours=json.dumps(OPENING_HOURS),
+            settings=json.dumps(BOOKING_SETTINGS),
+            is_active=True
+        )
+        db.session.add(barsan)
+        print("Initial data barsan successfully")
+
+    if not Cafe.query.filter_by(name='NOIR').first():
+        noir = Cafe(
+            name='NOIR',
+            display_name='N O I R',
+            description='NOIR Cafe',
+            address='456 Oak St',
+            phone='02-765-4321',
+            opening_hours=json.dumps(OPENING_HOURS),
+            settings=json.dumps(BOOKING_SETTINGS),
+            is_active=True
+        )
+        db.session.add(noir)
+        print("Initial data noir successfully")
+
+    db.session.commit()
+
+    # Create zones and tables
+    barsan_cafe = Cafe.query.filter_by(name='BarSan').first()
+    if barsan_cafe:
+        shards.use_cafe(barsan_cafe.id)
+    if barsan_cafe and not Zone.query.filter_by(cafe_id=barsan_cafe.id).first():
+        zone_a = Zone(
+            cafe_id=barsan_cafe.id,
+            name='Zone A',
+            description='Main dining area',
+            capacity=20,
+            is_active=True
+        )
+        db.session.add(zone_a)
+        db.session.commit()
+        print("Initial data zones and tables successfully")
+
+        # Add tables to Zone A
+        for i in range(1, 11):
+            table = Table(
+                cafe_id=barsan_cafe.id,
+                zone_id=zone_a.id,
+                number=i,
+                seats=4,
+                min_guests=1,
+                max_guests=4,
+                location='Main area',
+                features=json.dumps(['standard']),
+                status='available',
+                is_active=True
+            )
+            db.session.add(table)
+
+    # Create admin roles
+    if not Role.query.filter_by(name='super_admin').first():
+        super_admin_role = Role(
+            name='super_admin',
+            display_name='Super Admin',
+            description='Full access to all cafes',
+            permissions=json.dumps({'all': True}),
+            is_system=True
+        )
+        db.session.add(super_admin_role)
+
+        admin_role = Role(
+            name='admin',
+            display_name='Admin',
+            description='Full access to assigned cafe',
+            permissions=json.dumps({
+                'manage_reservations': True,
+                'manage_tables': True,
+                'view_reports': True
+            })
+        )
+        db.session.add(admin_role)
+        print("Initial data admin roles successfully")
+
+    db.session.commit()
+
+    # Create admin user
+    if not Admin.query.filter_by(username='admin').first():
+        admin_user = Admin(
+            username='admin',
+            email='admin@barsan.cafe',
+            password_hash=generate_password_hash('admin123'),
+            full_name='System Admin',
+            is_active=True
+        )
+        db.session.add(admin_user)
+        db.session.commit()
+
+        # Assign super admin role
+        super_admin_role = Role.query.filter_by(name='super_admin').first()
+        admin_role_assignment = AdminRole(
+            admin_id=admin_user.id,
+            role_id=super_admin_role.id,
+            cafe_id=barsan_cafe.id
+        )
+        db.session.add(admin_role_assignment)
+        print("Initial data admin user successfully")
+
+    db.session.commit()
+    print("Initial data seeded successfully")
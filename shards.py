@@ -0,0 +1,363 @@
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, jsonify, request
+from sqlalchemy import MetaData, delete, distinct, func, insert, select, update
+
+from cache import TTLCache
+from metrics import metrics
+from models import db, Cafe, Reservation
+from routing import SHARD_BIND_PREFIX
+
+# The main database, which keeps the global tables and every cafe not moved to a shard
+CONTROL = None
+
+# Left behind on a move: the outbox worker drains every database anyway,
+# and integer ids from one database would clash in another
+STAYS_ON_MOVE = ('outbox_messages',)
+
+# Copied without their ids, which the target database assigns
+RENUMBERED_ON_MOVE = ('reservation_changes',)
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_locations = TTLCache('cafe_shards', max_entries=4096)
+
+
+class CafeUnavailable(RuntimeError):
+    """The cafe is being moved between databases; its writes are refused until the move ends"""
+
+
+def init_app(app):
+    """Route every request with a cafe_id in its URL to that cafe's database"""
+    @app.url_value_preprocessor
+    def route_by_cafe(endpoint, values):
+        if values and 'cafe_id' in values and app.config['SHARDS']:
+            use_cafe(values['cafe_id'], write=request.method in WRITE_METHODS)
+
+    @app.errorhandler(CafeUnavailable)
+    def cafe_unavailable(error):
+        return jsonify({'success': False, 'message': str(error)}), 503
+
+
+def enabled():
+    return bool(current_app.config['SHARDS'])
+
+
+def locations():
+    """Every database that can hold per-cafe rows: the main database, then each shard"""
+    return [CONTROL] + current_app.config['SHARDS']
+
+
+def engine_for(location):
+    return db.engine if location is CONTROL else db.engines[SHARD_BIND_PREFIX + location]
+
+
+def sharded_tables():
+    """Per-cafe tables in dependency order"""
+    return [table for table in db.metadata.sorted_tables if table.info.get('sharded')]
+
+
+def location_query(cafe_id):
+    return select(Cafe.shard, Cafe.shard_moving).where(Cafe.id == cafe_id)
+
+
+def cached_location(cafe_id):
+    """(shard, moving) of a cafe if this worker has a fresh copy, else None"""
+    return _locations.get(cafe_id)
+
+
+def remember_location(cafe_id, row, ttl):
+    """Cache a cafe's location_query row for ttl seconds; returns (shard, moving)"""
+    entry = (row.shard, bool(row.shard_moving)) if row else (CONTROL, False)
+    _locations.set(cafe_id, entry, ttl)
+    return entry
+
+
+def cafe_location(cafe_id):
+    """(shard, moving) of a cafe, cached per worker for SHARD_MAP_CACHE_SECONDS"""
+    entry = cached_location(cafe_id)
+    if entry is None:
+        # Always from the main database, since a lagging replica could point at the old shard, and
+        # outside the session, so a write request's transaction there has not begun yet
+        with db.engine.connect() as conn:
+            row = conn.execute(location_query(cafe_id)).first()
+        entry = remember_location(cafe_id, row, current_app.config['SHARD_MAP_CACHE_SECONDS'])
+    return entry
+
+
+def use_location(location):
+    """Send this request's or job's per-cafe queries to one database"""
+    g.db_shard = location
+
+
+def use_cafe(cafe_id, write=False):
+    """Send per-cafe queries to the cafe's database; with write, refuse a cafe that is moving"""
+    if not enabled():
+        return
+    shard, moving = cafe_location(cafe_id)
+    if write and moving:
+        metrics.incr('shards.writes_refused')
+        raise CafeUnavailable("This cafe is briefly unavailable for changes, please try again in a minute")
+    use_location(shard)
+
+
+@contextmanager
+def using(location):
+    """Send per-cafe queries to one database for the duration of the block"""
+    previous = g.get('db_shard', CONTROL)
+    use_location(location)
+    try:
+        yield
+    finally:
+        use_location(previous)
+
+
+@contextmanager
+def suspended():
+    """Treat every cafe as living in the main database for the duration of the block, e.g. during schema upgrades"""
+    shards = current_app.config['SHARDS']
+    current_app.config['SHARDS'] = []
+    try:
+        yield
+    finally:
+        current_app.config['SHARDS'] = shards
+
+
+def find(lookup, write=False):
+    """Run lookup() against each database until it returns a row, and stay on that row's cafe
+
+    For requests that only know a reservation's id or number; a miss costs
+    one query per database. Rows of a cafe that is being moved can exist in
+    two places, so a hit is read again from the cafe's current database.
+    With write, the probes run as plain reads and the hit is read again in
+    the view's write transaction (see routing.write_transaction).
+    """
+    if not enabled():
+        return lookup()
+    writing = g.pop('db_write', False)
+    try:
+        for location in locations():
+            use_location(location)
+            row = lookup()
+            if row is None:
+                continue
+            shard, moving = cafe_location(row.cafe_id)
+            if write and moving:
+                raise CafeUnavailable("This cafe is briefly unavailable for changes, please try again in a minute")
+            break
+        else:
+            return None
+    finally:
+        if writing:
+            g.db_write = True
+    if shard == location and not writing:
+        return row
+    if writing:
+        # Ends the probes' transactions, so the next read begins the write transaction
+        db.session.rollback()
+    else:
+        db.session.expunge(row)
+    use_location(shard)
+    return lookup()
+
+
+def gather(fetch):
+    """Concatenate fetch() from every database, e.g. one guest's reservations at all cafes"""
+    if not enabled():
+        return fetch()
+    rows = []
+    for location in locations():
+        use_location(location)
+        rows.extend(fetch())
+    return rows
+
+
+def homes(cafe_id=None):
+    """Select each database in turn and yield the ids of the cafes living in it
+
+    For jobs that cover every cafe (or the one given). Without sharding it
+    yields once: None for every cafe, or [cafe_id].
+    """
+    if not enabled():
+        yield [cafe_id] if cafe_id else None
+        return
+    if cafe_id:
+        use_cafe(cafe_id)
+        yield [cafe_id]
+        return
+    placements = db.session.execute(select(Cafe.id, Cafe.shard), bind_arguments={'bind': db.engine}).all()
+    for location in locations():
+        cafe_ids = [id for id, shard in placements if shard == location]
+        if cafe_ids:
+            with using(location):
+                yield cafe_ids
+
+
+def shard_metadata():
+    """The per-cafe tables as created on a shard, without foreign keys to main-database tables"""
+    metadata = MetaData()
+    for table in sharded_tables():
+        table.to_metadata(metadata)
+    for table in metadata.tables.values():
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split('.')[0] not in metadata.tables:
+                table.constraints.discard(constraint)
+                for fk in constraint.elements:
+                    fk.parent.foreign_keys.discard(fk)
+                    table.foreign_keys.discard(fk)
+    return metadata
+
+
+def init_shards(log=print):
+    """Create missing per-cafe tables on every shard"""
+    metadata = shard_metadata()
+    for name in current_app.config['SHARDS']:
+        metadata.create_all(engine_for(name))
+        log(f"Shard {name} is ready")
+
+
+def _cafe_rows(table, cafe_id):
+    return table.c.cafe_id == cafe_id
+
+
+def _copy_cafe(cafe_id, source, target, batch_size):
+    """Replace the cafe's rows on target with a copy of those on source; returns rows copied"""
+    tables = [table for table in sharded_tables() if table.name not in STAYS_ON_MOVE]
+    copied = 0
+    with engine_for(source).connect() as reader, engine_for(target).begin() as writer:
+        # Leftovers of an interrupted move
+        for table in reversed(tables):
+            writer.execute(delete(table).where(_cafe_rows(table, cafe_id)))
+        for table in tables:
+            columns = [c for c in table.c if not (table.name in RENUMBERED_ON_MOVE and c.primary_key)]
+            query = select(*columns).where(_cafe_rows(table, cafe_id)).order_by(*table.primary_key.columns)
+            result = reader.execute(query.execution_options(yield_per=batch_size))
+            for rows in result.mappings().partitions():
+                writer.execute(insert(table), [dict(row) for row in rows])
+                copied += len(rows)
+    return copied
+
+
+def _delete_cafe(cafe_id, location):
+    tables = [table for table in sharded_tables() if table.name not in STAYS_ON_MOVE]
+    with engine_for(location).begin() as conn:
+        for table in reversed(tables):
+            conn.execute(delete(table).where(_cafe_rows(table, cafe_id)))
+
+
+def move_cafes(moves, batch_size=5000, wait=None, log=print):
+    """Move cafes ([(cafe_id, target)]) to other databases; returns the number of rows copied
+
+    The cafes are marked as moving first, and after every worker has seen
+    that (SHARD_MAP_CACHE_SECONDS), writes for them get 503. Each cafe is
+    copied and switched over in turn, and its rows are deleted from the old
+    database once no worker can still be reading them. An interrupted run
+    can be started again.
+    """
+    if wait is None:
+        wait = current_app.config['SHARD_MAP_CACHE_SECONDS'] + 1
+    cafes = {cafe.id: cafe for cafe in Cafe.query.filter(Cafe.id.in_([cafe_id for cafe_id, _ in moves]))}
+    for cafe_id, target in moves:
+        if cafe_id not in cafes:
+            raise ValueError(f"Unknown cafe {cafe_id}")
+        if target not in locations():
+            raise ValueError(f"Unknown shard {target!r}; configured: {', '.join(current_app.config['SHARDS'])}")
+    if not moves:
+        return 0
+
+    db.session.execute(update(Cafe).where(Cafe.id.in_(list(cafes))).values(shard_moving=True))
+    db.session.commit()
+    _locations.clear()
+    time.sleep(wait)
+
+    copied, sources = 0, []
+    for cafe_id, target in moves:
+        cafe = cafes[cafe_id]
+        source = cafe.shard
+        started = time.perf_counter()
+        if source != target:
+            copied += _copy_cafe(cafe_id, source, target, batch_size)
+            sources.append((cafe_id, source))
+        cafe.shard = target
+        cafe.shard_moving = False
+        db.session.commit()
+        log(f"Moved {cafe.name} from {source or 'main'} to {target or 'main'} "
+            f"in {time.perf_counter() - started:.1f}s")
+
+    # Workers may read a cached old location until it expires
+    _locations.clear()
+    time.sleep(wait)
+    for cafe_id, source in sources:
+        _delete_cafe(cafe_id, source)
+    return copied
+
+
+def cafe_loads():
+    """Reservations per cafe in its current database"""
+    loads = {}
+    for cafe_ids in homes():
+        query = db.session.query(Reservation.cafe_id, func.count(Reservation.id)).group_by(Reservation.cafe_id)
+        if cafe_ids is not None:
+            query = query.filter(Reservation.cafe_id.in_(cafe_ids))
+        loads.update(query.all())
+    return loads
+
+
+def plan_rebalance(even=False):
+    """Moves [(cafe, target)] that put every cafe on a shard, busiest cafes first
+
+    Cafes already on a configured shard stay there. With even, cafes are
+    then moved off the busiest shard while that lowers its load.
+    """
+    shards = current_app.config['SHARDS']
+    cafes = Cafe.query.order_by(Cafe.name).all()
+    loads = cafe_loads()
+    shard_loads = dict.fromkeys(shards, 0)
+    placement = {}
+    for cafe in cafes:
+        if cafe.shard in shard_loads:
+            placement[cafe.id] = cafe.shard
+            shard_loads[cafe.shard] += loads.get(cafe.id, 0)
+
+    for cafe in sorted((c for c in cafes if c.id not in placement), key=lambda c: -loads.get(c.id, 0)):
+        target = min(shards, key=shard_loads.get)
+        placement[cafe.id] = target
+        shard_loads[target] += loads.get(cafe.id, 0)
+
+    while even:
+        busiest, quietest = max(shards, key=shard_loads.get), min(shards, key=shard_loads.get)
+        gap = shard_loads[busiest] - shard_loads[quietest]
+        # A cafe smaller than the gap lowers the busiest shard without making the other one busier
+        movable = [cafe_id for cafe_id, shard in placement.items()
+                   if shard == busiest and 0 < loads.get(cafe_id, 0) < gap]
+        if not movable:
+            break
+        cafe_id = max(movable, key=loads.get)
+        placement[cafe_id] = quietest
+        shard_loads[busiest] -= loads[cafe_id]
+        shard_loads[quietest] += loads[cafe_id]
+
+    moves = [(cafe, placement[cafe.id]) for cafe in cafes if placement[cafe.id] != cafe.shard or cafe.shard_moving]
+    return moves, shard_loads, loads
+
+
+def remove_stray_rows(log=print):
+    """Delete per-cafe rows from databases their cafe does not live in, e.g. after an interrupted move"""
+    placements = {id: (shard, moving) for id, shard, moving in db.session.execute(
+        select(Cafe.id, Cafe.shard, Cafe.shard_moving), bind_arguments={'bind': db.engine}
+    )}
+    tables = [table for table in sharded_tables() if table.name not in STAYS_ON_MOVE]
+    removed = 0
+    for location in locations():
+        with engine_for(location).connect() as conn:
+            present = set()
+            for table in tables:
+                present.update(conn.execute(select(distinct(table.c.cafe_id))).scalars())
+        for cafe_id in present:
+            home = placements.get(cafe_id)
+            if home and home[0] != location and not home[1]:
+                _delete_cafe(cafe_id, location)
+                removed += 1
+                log(f"Removed stray rows of cafe {cafe_id} from {location or 'main'}")
+    return removed
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'barsan:singleflight:'
+# Long enough for every waiting worker's next poll to see the leader's result
+REDIS_RESULT_TTL_MS = 2000
+
+# Deletes the leader's lock only if it still holds it
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class Group:
+    """Concurrent calls with the same key share one computation (stampede protection)
+
+    The first call for a key runs the function; calls arriving while it runs
+    wait for it and get its result, or its exception. A waiter that is still
+    waiting after `timeout` seconds gives up and computes for itself. With a
+    Redis backend the leaders of every worker also coordinate through Redis,
+    so one worker computes and the others read its result; those results must
+    be JSON serializable.
+    """
+
+    def __init__(self, name, timeout=10.0):
+        self.name = name
+        self.timeout = timeout
+        self.enabled = True
+        self.backend = None
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future of the call in flight
+        self._tasks = {}  # key -> asyncio task in flight
+
+    def do(self, key, fn):
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            metrics.incr(f'singleflight.{self.name}.shared')
+            try:
+                return future.result(self.timeout)
+            except TimeoutError:
+                metrics.incr(f'singleflight.{self.name}.timeouts')
+                return fn()
+
+        metrics.incr(f'singleflight.{self.name}.leaders')
+        try:
+            value = self.backend.do(self, key, fn) if self.backend else fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, fn):
+        """do() for coroutines on this worker's event loop; fn() returns the coroutine to share"""
+        if not self.enabled:
+            return await fn()
+        task = self._tasks.get(key)
+        if task is None:
+            metrics.incr(f'singleflight.{self.name}.leaders')
+            # A task of its own, so a leader whose client goes away does not cancel it for the waiters
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._tasks.pop(key) if self._tasks.get(key) is done else None)
+        else:
+            metrics.incr(f'singleflight.{self.name}.shared')
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self._calls) + len(self._tasks)
+
+
+class RedisBackend:
+    """Coordinates the leaders of all workers with a lock and a result key per computation
+
+    A leader takes the lock `<key>` with a fresh token and stores its result
+    under `<key>:<token>` before releasing it. Leaders of other workers that
+    find the lock taken poll for that token's result instead of computing,
+    and try to take the lock themselves if it goes away without a result (the
+    leader failed). The lock expires after the group's timeout, in case a
+    leader dies holding it.
+    """
+
+    def __init__(self, url, poll_interval=0.005):
+        import redis  # optional dependency, only needed with SINGLE_FLIGHT_REDIS_URL
+        self.redis = redis.Redis.from_url(url)
+        self.poll_interval = poll_interval
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    def do(self, group, key, fn):
+        lock_key = f'{REDIS_PREFIX}{group.name}:{key}'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + group.timeout
+        try:
+            while not self.redis.set(lock_key, token, nx=True, px=int(group.timeout * 1000)):
+                leader = self.redis.get(lock_key)
+                if leader is None:
+                    continue  # Released just now; try to take it
+                found, value = self._wait(lock_key, leader, deadline)
+                if found:
+                    metrics.incr(f'singleflight.{group.name}.remote_shared')
+                    return value
+                if time.monotonic() >= deadline:
+                    metrics.incr(f'singleflight.{group.name}.timeouts')
+                    return fn()
+        except Exception:
+            # Redis is only an optimization; compute as if it were not configured
+            logger.exception("Single-flight lock for %s unavailable; computing locally", lock_key)
+            metrics.incr(f'singleflight.{group.name}.redis_errors')
+            return fn()
+
+        try:
+            value = fn()
+            self.redis.set(f'{lock_key}:{token}', json.dumps(value, default=str), px=REDIS_RESULT_TTL_MS)
+            return value
+        finally:
+            try:
+                self._release(keys=[lock_key], args=[token])
+            except Exception:
+                logger.exception("Could not release single-flight lock %s; it expires on its own", lock_key)
+
+    def _wait(self, lock_key, leader, deadline):
+        """Poll for the result of the leader holding `leader`'s token; (False, None) if it let go without one"""
+        result_key = f'{lock_key}:{leader.decode()}'
+        while time.monotonic() < deadline:
+            # Both in one round trip: the result is written before the lock is released
+            result, holder = self.redis.mget(result_key, lock_key)
+            if result is not None:
+                return True, json.loads(result)
+            if holder != leader:
+                return False, None
+            time.sleep(self.poll_interval)
+        return False, None
+
+
+availability = Group('availability')
+groups = [availability]
+
+
+def init_app(app):
+    """Set the timeout and the cross-worker backend from the SINGLE_FLIGHT_* settings"""
+    backend = None
+    if app.config.get('SINGLE_FLIGHT_REDIS_URL'):
+        backend = RedisBackend(app.config['SINGLE_FLIGHT_REDIS_URL'], app.config['SINGLE_FLIGHT_POLL_MS'] / 1000)
+    for group in groups:
+        group.enabled = app.config['SINGLE_FLIGHT']
+        group.timeout = app.config['SINGLE_FLIGHT_TIMEOUT_SECONDS']
+        group.backend = backend
+    metrics.register_collector('singleflight', lambda: {group.name: group.in_flight() for group in groups})
@@ -0,0 +1,207 @@
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from models import db, Reservation, ArchivedReservation, CafeDailyStats
+import shards
+
+COUNTERS = (
+    'bookings', 'covers', 'cancellations', 'no_shows',
+    'confirm_to_seat_seconds', 'confirm_to_seat_count',
+    'seat_to_complete_seconds', 'seat_to_complete_count'
+)
+
+# Guests in these states showed up
+COVER_STATUSES = ('seated', 'completed')
+
+# Rows written before `source` had a default
+DEFAULT_SOURCE = Reservation.__table__.c.source.default.arg
+
+# The reservation fields the counters depend on
+Snapshot = namedtuple('Snapshot', [
+    'cafe_id', 'date', 'source', 'guests', 'status', 'confirmed_at', 'seated_at', 'completed_at'
+])
+
+
+def snapshot(reservation):
+    """Capture a reservation's counted fields, e.g. before changing its status"""
+    return Snapshot(
+        reservation.cafe_id, reservation.date, reservation.source or DEFAULT_SOURCE, reservation.guests,
+        reservation.status, reservation.confirmed_at, reservation.seated_at, reservation.completed_at
+    )
+
+
+def _seconds(start, end):
+    return int((end - start).total_seconds()) if start and end and end >= start else None
+
+
+def contribution(s):
+    """What one reservation adds to its day's counters"""
+    counts = dict.fromkeys(COUNTERS, 0)
+    counts['bookings'] = 1
+    if s.status in COVER_STATUSES:
+        counts['covers'] = s.guests
+    if s.status == 'cancelled':
+        counts['cancellations'] = 1
+    elif s.status == 'no_show':
+        counts['no_shows'] = 1
+
+    # Timestamps are only ever set once, so these change at most once per reservation
+    wait = _seconds(s.confirmed_at, s.seated_at)
+    if wait is not None:
+        counts['confirm_to_seat_seconds'] = wait
+        counts['confirm_to_seat_count'] = 1
+    dining = _seconds(s.seated_at, s.completed_at)
+    if dining is not None:
+        counts['seat_to_complete_seconds'] = dining
+        counts['seat_to_complete_count'] = 1
+    return (s.cafe_id, s.date, s.source), counts
+
+
+def record_change(before, reservation):
+    """Apply a reservation's change to the daily counters in the current transaction
+
+    `before` is the snapshot taken before the change, or None for a new
+    reservation. The caller commits.
+    """
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for sign, state in ((-1, before), (1, snapshot(reservation))):
+        if state is None:
+            continue
+        key, counts = contribution(state)
+        for name, value in counts.items():
+            deltas[key][name] += sign * value
+
+    for key, delta in deltas.items():
+        delta = {name: value for name, value in delta.items() if value}
+        if delta:
+            _increment(key, delta)
+
+
+def _increment(key, delta):
+    """Add delta to one counters row, creating the row if needed (single statement where supported)"""
+    cafe_id, day, source = key
+    row = dict.fromkeys(COUNTERS, 0)
+    row.update(delta, cafe_id=cafe_id, date=day, source=source)
+    table = CafeDailyStats.__table__
+    dialect = db.session.get_bind(mapper=CafeDailyStats).dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        module = sqlite if dialect == 'sqlite' else postgresql
+        stmt = module.insert(CafeDailyStats).values(row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['cafe_id', 'date', 'source'],
+            set_={name: table.c[name] + stmt.excluded[name] for name in delta}
+        )
+        db.session.execute(stmt)
+    elif dialect in ('mysql', 'mariadb'):
+        stmt = mysql.insert(CafeDailyStats).values(row)
+        stmt = stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in delta})
+        db.session.execute(stmt)
+    else:
+        result = db.session.execute(
+            update(CafeDailyStats)
+            .where(CafeDailyStats.cafe_id == cafe_id, CafeDailyStats.date == day,
+                   CafeDailyStats.source == source)
+            .values({name: getattr(CafeDailyStats, name) + value for name, value in delta.items()})
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(CafeDailyStats).values(row))
+
+
+def rebuild_daily_stats(cafe_id=None, start_date=None, end_date=None, batch_size=5000, log=print):
+    """Recompute the counters from live and archived reservations, replacing what is stored
+
+    Use it to backfill, or after changing reservations outside the API.
+    Returns the number of counter rows written.
+    """
+    written = 0
+    for cafe_ids in shards.homes(cafe_id):
+        written += _rebuild_daily_stats(cafe_ids, start_date, end_date, batch_size, log)
+    return written
+
+
+def _rebuild_daily_stats(cafe_ids, start_date, end_date, batch_size, log):
+    def in_range(model):
+        conditions = []
+        if cafe_ids is not None:
+            conditions.append(model.cafe_id.in_(cafe_ids))
+        if start_date:
+            conditions.append(model.date >= start_date)
+        if end_date:
+            conditions.append(model.date <= end_date)
+        return conditions
+
+    totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    seen = set()
+    # Live rows first: a row caught mid-archive is in both tables and counted once
+    for model in (Reservation, ArchivedReservation):
+        query = select(
+            model.id, model.cafe_id, model.date, model.source, model.guests, model.status,
+            model.confirmed_at, model.seated_at, model.completed_at
+        ).where(*in_range(model)).execution_options(yield_per=batch_size)
+        for row in db.session.execute(query):
+            if row.id in seen:
+                continue
+            seen.add(row.id)
+            key, counts = contribution(Snapshot(*row[1:])._replace(source=row.source or DEFAULT_SOURCE))
+            total = totals[key]
+            for name, value in counts.items():
+                total[name] += value
+        log(f"Scanned {len(seen)} reservations")
+
+    db.session.execute(delete(CafeDailyStats).where(*in_range(CafeDailyStats)))
+    rows = [dict(counts, cafe_id=key[0], date=key[1], source=key[2]) for key, counts in totals.items()]
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(insert(CafeDailyStats), rows[i:i + batch_size])
+    db.session.commit()
+    log(f"Wrote {len(rows)} daily stats rows")
+    return len(rows)
+
+
+def daily_report(cafe_id, start_date, end_date):
+    """Per-day totals and bookings by source for a cafe, read from the counters only"""
+    rows = CafeDailyStats.query.filter(
+        CafeDailyStats.cafe_id == cafe_id,
+        CafeDailyStats.date >= start_date,
+        CafeDailyStats.date <= end_date
+    ).order_by(CafeDailyStats.date).all()
+
+    days = {}
+    summary = _empty_day()
+    for row in rows:
+        day = days.setdefault(row.date, _empty_day())
+        for target in (day, summary):
+            for name in COUNTERS:
+                target[name] += getattr(row, name)
+            target['bySource'][row.source] = target['bySource'].get(row.source, 0) + row.bookings
+
+    return {
+        'from': start_date.isoformat(),
+        'to': end_date.isoformat(),
+        'summary': _finish(summary),
+        'days': [dict(_finish(day), date=d.isoformat()) for d, day in days.items()]
+    }
+
+
+def _empty_day():
+    day = dict.fromkeys(COUNTERS, 0)
+    day['bySource'] = {}
+    return day
+
+
+def _average_minutes(seconds, count):
+    return round(seconds / count / 60, 1) if count else None
+
+
+def _finish(day):
+    return {
+        'bookings': day['bookings'],
+        'bySource': day['bySource'],
+        'covers': day['covers'],
+        'cancellations': day['cancellations'],
+        'noShows': day['no_shows'],
+        'avgConfirmToSeatMinutes': _average_minutes(day['confirm_to_seat_seconds'], day['confirm_to_seat_count']),
+        'avgSeatToCompleteMinutes': _average_minutes(day['seat_to_complete_seconds'], day['seat_to_complete_count'])
+    }
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from migrations import init_db
+from metrics import metrics
+from models import db
+from routing import SHARD_BIND_PREFIX
+from seed import seed_data
+
+
+def make_app(tmp_path, **config):
+    """An app on fresh SQLite files under tmp_path, initialized and seeded; config overrides settings"""
+    settings = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'main.db'}",
+        # Nothing from the developer's environment
+        'ARCHIVE_DATABASE_URL': None,
+        'REPLICA_DATABASE_URL': None,
+        'SHARD_DATABASE_URLS': None,
+        'EVENTS_REDIS_URL': None,
+        'SINGLE_FLIGHT_REDIS_URL': None,
+        'AVAILABILITY_GRID_DIR': None,
+        'HOLD_COALESCING': False,
+    }
+    settings.update(config)
+    app = create_app(settings)
+    with app.app_context():
+        init_db(log=lambda message: None)
+        seed_data()
+        db.session.remove()
+    return app
+
+
+def close_app(app):
+    """Close the app's connections and forget its shard binds, which db (shared by every app) registered"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    for key in list(db.metadatas):
+        if key and key.startswith(SHARD_BIND_PREFIX):
+            del db.metadatas[key]
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path)
+    yield app
+    close_app(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def counter(app, name):
+    """A metrics counter's current value"""
+    with app.app_context():
+        return metrics.snapshot()['counters'].get(name, 0)
+
+
+@contextmanager
+def write_lock(path, release_after=None):
+    """Hold the database's write lock from a second connection, for release_after seconds or the whole block"""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute('BEGIN IMMEDIATE')
+    timer = threading.Timer(release_after, conn.rollback) if release_after else None
+    if timer:
+        timer.start()
+    try:
+        yield
+    finally:
+        if timer:
+            timer.join()
+        else:
+            conn.rollback()
+        conn.close()
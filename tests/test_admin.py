@@ -0,0 +1,51 @@
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from models import db, Cafe
+
+DAY = (date.today() + timedelta(days=7)).isoformat()
+
+
+def admin_headers(client):
+    token = client.post('/auth/login', json={'email': 'admin', 'password': 'admin123'}).json['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+def book(client, cafe_id, session_id):
+    hold = client.post('/reservations/temp', json={
+        'cafeId': cafe_id, 'date': DAY, 'time': '19:00', 'guests': 2, 'sessionId': session_id
+    }).json['tempReservation']['id']
+    response = client.post('/reservations/', json={
+        'tempReservationId': hold, 'guestName': 'Tester', 'guestEmail': 't@example.com', 'guestPhone': '0812345678'
+    })
+    assert response.status_code == 200, response.json
+
+
+def test_reservation_list_loads_tables_with_the_rows(app, client):
+    with app.app_context():
+        cafe_id = Cafe.query.filter_by(name='BarSan').first().id
+        engine = db.engine
+    headers = admin_headers(client)
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+
+    def listed():
+        statements.clear()
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = client.get(f'/admin/reservations/{cafe_id}', headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        assert response.status_code == 200
+        return response.json['reservations'], len(statements)
+
+    book(client, cafe_id, 's0')
+    rows, one = listed()
+    for i in range(1, 4):
+        book(client, cafe_id, f's{i}')
+    rows, four = listed()
+    assert len(rows) == 4 and len({row['table']['id'] for row in rows}) == 4
+    assert all(row['table']['zone'] for row in rows)
+    # No query per row for its table or zone
+    assert four == one
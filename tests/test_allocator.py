@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allocator import Booking, TableAllocator, TableInfo, repack
+
+TABLES = [
+    TableInfo('A2', 'A', 1, 2, 1, 2),
+    TableInfo('A4', 'A', 2, 4, 1, 4),
+    TableInfo('B4', 'B', 3, 4, 1, 4),
+]
+
+
+def test_repack_keeps_existing_parties_in_their_zone():
+    # r2 (2 guests) sits at A4; a new 4-guest party wants zone A, and A2 is too small for it
+    bookings = [Booking('r2', 2, 600, 720, 'A4', 'confirmed')]
+    plan = repack(TABLES, bookings + [Booking(None, 4, 600, 720, None, 'pending', 'A')])
+    # Moving r2 to B4 would change the zone its guest chose; A2 fits r2 within zone A
+    assert plan == {'r2': 'A2', None: 'A4'}
+
+
+def test_repack_fails_rather_than_moving_a_party_out_of_its_zone():
+    bookings = [
+        Booking('r1', 2, 600, 720, 'A2', 'confirmed'),
+        Booking('r2', 2, 600, 720, 'A4', 'confirmed'),
+    ]
+    assert repack(TABLES, bookings + [Booking(None, 4, 600, 720, None, 'pending', 'A')]) is None
+
+
+def test_repack_seats_a_booking_without_a_table_in_any_zone():
+    bookings = [Booking('r1', 4, 600, 720, 'A4', 'confirmed'), Booking('r2', 3, 600, 720, None, 'pending')]
+    assert repack(TABLES, bookings) == {'r1': 'A4', 'r2': 'B4'}
+
+
+def test_best_fit_picks_the_smallest_free_table():
+    allocator = TableAllocator(TABLES)
+    assert allocator.best_fit(2, 600, 720).id == 'A2'
+    allocator.reserve('A2', 600, 720)
+    assert allocator.best_fit(2, 660, 780).id == 'A4'
+    assert allocator.best_fit(2, 720, 840).id == 'A2'
@@ -0,0 +1,77 @@
+import pytest
+from flask import g
+
+import batch
+from conftest import close_app, make_app
+from models import db, Cafe
+
+
+def admin_headers(client):
+    token = client.post('/auth/login', json={'email': 'admin', 'password': 'admin123'}).json['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+def cafe_id(app, name):
+    with app.app_context():
+        return Cafe.query.filter_by(name=name).first().id
+
+
+def run(client, paths, **kwargs):
+    return client.post('/batch', json={'requests': [{'id': str(n), 'path': path} for n, path in enumerate(paths)]},
+                       **kwargs)
+
+
+def test_batch_answers_each_sub_request(app, client):
+    barsan = cafe_id(app, 'BarSan')
+    response = run(client, ['/cafes/', f'/cafes/{barsan}?fields=name', '/cafes/missing', '/auth/me'],
+                   headers=admin_headers(client))
+    assert response.status_code == 200
+    responses = response.json['responses']
+    assert [(r['id'], r['status']) for r in responses] == [('0', 200), ('1', 200), ('2', 404), ('3', 200)]
+    assert responses[1]['body']['cafe'] == {'name': 'BarSan'}
+    # The batch's Authorization header reaches the sub-requests
+    assert responses[3]['body']['type'] == 'admin'
+
+
+def test_batch_size_is_limited(app, client):
+    app.config['BATCH_MAX_REQUESTS'] = 2
+    assert run(client, ['/cafes/'] * 2).status_code == 200
+    response = run(client, ['/cafes/'] * 3)
+    assert response.status_code == 400
+    assert response.json['message'] == 'At most 2 requests per batch'
+    assert run(client, []).status_code == 400
+
+
+def test_only_allowed_blueprints_can_be_batched(app, client):
+    barsan = cafe_id(app, 'BarSan')
+    paths = [f'/admin/dashboard/{barsan}', f'/admin/events/{barsan}', '/batch', '//evil.example/cafes/',
+             'cafes/', '/unknown']
+    responses = run(client, paths, headers=admin_headers(client)).json['responses']
+    # Routes it cannot resolve (here a POST-only one) get the usual 404/405
+    assert [r['status'] for r in responses] == [400, 400, 405, 400, 400, 404]
+    assert responses[0]['body']['message'] == 'This endpoint cannot be batched'
+
+
+@pytest.fixture
+def sharded_app(tmp_path):
+    app = make_app(tmp_path, SHARD_DATABASE_URLS=f"a=sqlite:///{tmp_path / 'a.db'}")
+    with app.app_context():
+        # NOIR has no zones or tables, so pointing it at the empty shard is a complete move
+        Cafe.query.filter_by(name='NOIR').update({'shard': 'a'})
+        db.session.commit()
+    yield app
+    close_app(app)
+
+
+def test_sub_requests_do_not_leave_state_in_g(sharded_app):
+    noir = cafe_id(sharded_app, 'NOIR')
+    with sharded_app.test_client() as client:
+        headers = admin_headers(client)
+    with sharded_app.test_request_context('/batch', method='POST', headers=headers):
+        g.marker = 'batch'
+        before = dict(g.__dict__)
+        assert batch.dispatch(f'/cafes/{noir}')[0] == 200
+        assert batch.dispatch('/auth/me')[0] == 200
+        # Neither the cafe's shard nor the sub-request's decoded JWT is left for the next one
+        assert g.__dict__ == before
+        assert g.get('db_shard') is None
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import changes
+from models import db, Cafe, ReservationChange
+
+
+def admin_headers(client):
+    token = client.post('/auth/login', json={'email': 'admin', 'password': 'admin123'}).json['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def cafe_id(app):
+    with app.app_context():
+        return Cafe.query.filter_by(name='BarSan').first().id
+
+
+def log(app, cafe_id, *ages):
+    """Add a change for each age (a timedelta back from now); returns their cursors"""
+    with app.app_context():
+        rows = [
+            ReservationChange(cafe_id=cafe_id, reservation_id=f'r{n}', op='updated', data='{}',
+                              created_at=datetime.utcnow() - age)
+            for n, age in enumerate(ages)
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+        return [row.id for row in rows]
+
+
+def test_changes_are_paged_by_cursor(app, client, cafe_id):
+    headers = admin_headers(client)
+    log(app, 'other-cafe', timedelta(minutes=5))
+    cursors = log(app, cafe_id, *[timedelta(minutes=5)] * 5)
+    assert client.get(f'/admin/changes/{cafe_id}', headers=headers).json['cursor'] == cursors[-1]
+
+    pages, since = [], 0
+    while True:
+        page = client.get(f'/admin/changes/{cafe_id}?since={since}&limit=2', headers=headers).json
+        pages.append(([change['cursor'] for change in page['changes']], page['hasMore']))
+        since = page['cursor']
+        if not page['hasMore']:
+            break
+    assert pages == [(cursors[:2], True), (cursors[2:4], True), (cursors[4:], False)]
+    assert since == cursors[-1]
+
+    # Up to date: nothing new, and the cursor stays
+    page = client.get(f'/admin/changes/{cafe_id}?since={since}', headers=headers).json
+    assert (page['changes'], page['cursor'], page['hasMore'], page['retryAfter']) == ([], since, False, None)
+
+
+def test_young_changes_are_held_back_until_they_settle(app, client, cafe_id):
+    app.config['CHANGES_SETTLE_SECONDS'] = 10
+    headers = admin_headers(client)
+    old, young = log(app, cafe_id, timedelta(minutes=5), timedelta(seconds=4))
+
+    page = client.get(f'/admin/changes/{cafe_id}?since=0', headers=headers).json
+    assert [change['cursor'] for change in page['changes']] == [old]
+    assert page['cursor'] == old
+    # The young change is listed once it is 10 seconds old
+    assert 5 < page['retryAfter'] <= 6
+
+    with app.app_context():
+        assert changes.changes_since(cafe_id, old, settle_seconds=3)[0][0].id == young
+        assert changes.changes_since(cafe_id, old, settle_seconds=0) == ([db.session.get(ReservationChange, young)],
+                                                                         False, None)
+
+
+def test_retry_after_is_left_out_while_there_are_more_pages(app, cafe_id):
+    log(app, cafe_id, timedelta(minutes=5), timedelta(minutes=5), timedelta(seconds=0))
+    with app.app_context():
+        rows, has_more, retry_after = changes.changes_since(cafe_id, 0, limit=1)
+        assert (len(rows), has_more, retry_after) == (1, True, None)
+        rows, has_more, retry_after = changes.changes_since(cafe_id, rows[0].id, limit=1)
+        assert (len(rows), has_more) == (1, False)
+        assert 0 < retry_after <= 1
+
+
+def test_pruning_keeps_the_newest_change(app, client, cafe_id):
+    headers = admin_headers(client)
+    cursors = log(app, cafe_id, *[timedelta(days=40)] * 3)
+    with app.app_context():
+        assert changes.prune_changes(30) == 2
+        assert [row.id for row in ReservationChange.query] == [cursors[-1]]
+        # Nothing left to prune: the head stays however old it is
+        assert changes.prune_changes(30) == 0
+
+    expired = client.get(f'/admin/changes/{cafe_id}?since={cursors[0]}', headers=headers)
+    assert expired.status_code == 410
+    assert expired.json['cursor'] == cursors[-1]
+    # A cursor just before the head can still sync
+    page = client.get(f'/admin/changes/{cafe_id}?since={cursors[1]}', headers=headers).json
+    assert [change['cursor'] for change in page['changes']] == [cursors[-1]]
+
+    with app.app_context():
+        with pytest.raises(ValueError):
+            changes.prune_changes(0)
+
+
+def test_pruning_keeps_recent_changes(app, cafe_id):
+    cursors = log(app, cafe_id, timedelta(days=40), timedelta(days=2), timedelta(days=1))
+    with app.app_context():
+        assert changes.prune_changes(30) == 1
+        assert [row.id for row in ReservationChange.query.order_by(ReservationChange.id)] == cursors[1:]
+        assert not changes.is_expired(cursors[0])
+        assert changes.is_expired(cursors[0] - 1)
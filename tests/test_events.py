@@ -0,0 +1,129 @@
+import json
+import uuid
+
+import pytest
+
+import events
+from models import Cafe
+
+
+@pytest.fixture
+def cafe_id():
+    # The bus is per process, so each test gets its own cafe
+    return str(uuid.uuid4())
+
+
+def parse(chunks):
+    """(id, type, data) of each event in SSE text chunks"""
+    parsed = []
+    for chunk in chunks:
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n') if ': ' in line)
+        if 'event' in fields:
+            parsed.append((int(fields['id']) if 'id' in fields else None, fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+def read(stream):
+    try:
+        return parse(list(stream))
+    finally:
+        stream.close()
+
+
+def published(cafe_id, count):
+    listener = events.bus.subscribe(cafe_id)
+    try:
+        for n in range(count):
+            events.publish(cafe_id, 'reservation.created', {'n': n})
+        return [listener.get_nowait()['id'] for _ in range(count)]
+    finally:
+        events.bus.unsubscribe(cafe_id, listener)
+
+
+def test_stream_replays_events_after_last_event_id(cafe_id):
+    ids = published(cafe_id, 3)
+    stream = events.stream(cafe_id, last_id=ids[0], snapshot={'today': 1}, max_seconds=0)
+    assert read(stream) == [
+        (ids[1], 'reservation.created', {'n': 1}),
+        (ids[2], 'reservation.created', {'n': 2}),
+        (None, 'counters', {'today': 1}),
+    ]
+
+
+def test_stream_resets_when_events_were_missed(cafe_id):
+    ids = published(cafe_id, 3)
+    events.bus.buffer_size, size = 1, events.bus.buffer_size
+    try:
+        events.bus._buffers.pop(cafe_id)
+        published(cafe_id, 2)
+    finally:
+        events.bus.buffer_size = size
+    assert [event[1] for event in read(events.stream(cafe_id, last_id=ids[0], max_seconds=0))] == ['reset']
+
+
+def test_stream_resets_after_a_skipped_event(cafe_id):
+    ids = published(cafe_id, 1)
+    # Nobody listens, so the event is not built and its id is used up
+    events.publish(cafe_id, 'reservation.created', lambda: pytest.fail("built without a listener"))
+    assert [event[1] for event in read(events.stream(cafe_id, last_id=ids[0], max_seconds=0))] == ['reset']
+
+
+def test_up_to_date_stream_starts_with_the_counters(cafe_id):
+    ids = published(cafe_id, 2)
+    assert read(events.stream(cafe_id, last_id=ids[-1], snapshot={'today': 2}, max_seconds=0)) == [
+        (None, 'counters', {'today': 2})
+    ]
+
+
+def test_closing_an_unstarted_stream_unsubscribes(cafe_id):
+    stream = events.stream(cafe_id, max_streams=1)
+    assert events.bus.has_subscribers(cafe_id)
+    stream.close()
+    assert not events.bus.has_subscribers(cafe_id)
+
+
+def admin_headers(client):
+    token = client.post('/auth/login', json={'email': 'admin', 'password': 'admin123'}).json['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def barsan(app):
+    app.config['EVENTS_MAX_STREAM_SECONDS'] = 0
+    with app.app_context():
+        return Cafe.query.filter_by(name='BarSan').first().id
+
+
+def test_stream_token_opens_only_its_cafes_stream(app, client, barsan):
+    headers = admin_headers(client)
+    token = client.post(f'/admin/events/{barsan}/token', headers=headers).json['token']
+
+    response = client.get(f'/admin/events/{barsan}?jwt={token}')
+    assert response.status_code == 200
+    assert [event[1] for event in parse(response.get_data(as_text=True).split('\n\n'))] == ['counters']
+
+    assert client.get(f'/admin/events/{uuid.uuid4()}?jwt={token}').status_code == 403
+    # Not an admin token anywhere else
+    assert client.get(f'/admin/dashboard/{barsan}', headers={'Authorization': f'Bearer {token}'}).status_code == 403
+
+
+def test_admin_token_is_refused_in_the_url(app, client, barsan):
+    headers = admin_headers(client)
+    admin_token = headers['Authorization'].split()[1]
+    assert client.get(f'/admin/events/{barsan}?jwt={admin_token}').status_code == 403
+    assert client.get(f'/admin/events/{barsan}', headers=headers).status_code == 200
+
+
+def test_streams_beyond_the_limit_get_503(app, client, barsan):
+    app.config['EVENTS_MAX_STREAMS'] = events.bus.subscriber_count() + 1
+    headers = admin_headers(client)
+    first = client.get(f'/admin/events/{barsan}', headers=headers)
+    try:
+        second = client.get(f'/admin/events/{barsan}', headers=headers)
+        assert second.status_code == 503
+        assert second.headers['Retry-After'] == '5'
+    finally:
+        first.close()
+    third = client.get(f'/admin/events/{barsan}', headers=headers)
+    assert third.status_code == 200
+    third.close()
@@ -0,0 +1,121 @@
+import re
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event, select
+
+from fieldsets import FieldError
+from models import db, Cafe, Reservation
+
+DAY = date.today() + timedelta(days=7)
+
+
+def columns(statement, table):
+    """The columns of `table` in a SELECT's column list"""
+    column_list = re.split(r'\sFROM\s', statement, 1)[0]
+    return sorted(set(re.findall(rf'\b{table}\.(\w+)', column_list)))
+
+
+@contextmanager
+def statements(app):
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield seen
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_select_parses_fields():
+    shape = Reservation.FIELDS
+    assert shape.select(None) is None
+    assert shape.select('') is None
+    assert shape.select(' , ') is None
+    assert shape.select('id, time,table.number,table.zone.name') == {
+        'id': None, 'time': None, 'table': {'number': None, 'zone': {'name': None}}
+    }
+    # The whole object wins over some of its fields, in either order
+    assert shape.select('table.number,table') == {'table': None}
+    assert shape.select('table,table.number') == {'table': None}
+
+
+@pytest.mark.parametrize('fields', ['nope', 'id,nope', 'table.nope', 'time.hour', 'table.zone.name.x'])
+def test_select_rejects_unknown_fields(fields):
+    with pytest.raises(FieldError, match='Unknown field'):
+        Reservation.FIELDS.select(fields)
+
+
+def compiled(app, model, selection, **kwargs):
+    with app.app_context():
+        statement = select(model).options(*model.FIELDS.options(model, selection, **kwargs))
+        return str(statement.compile(db.engine))
+
+
+def test_options_read_only_the_selected_columns(app):
+    statement = compiled(app, Reservation, Reservation.FIELDS.select('time,guests'))
+    assert columns(statement, 'reservations') == ['guests', 'id', 'time']
+    assert 'JOIN' not in statement
+
+
+def test_options_join_only_the_related_columns_they_need(app):
+    statement = compiled(app, Reservation, Reservation.FIELDS.select('time,table.number,table.zone.name'),
+                         extra=('created_at',))
+    assert columns(statement, 'reservations') == ['created_at', 'id', 'table_id', 'time']
+    assert columns(statement, 'tables_1') == ['id', 'number', 'zone_id']
+    assert columns(statement, 'zones_1') == ['id', 'name']
+
+
+def test_options_leave_other_databases_relationships_unjoined(app):
+    statement = compiled(app, Reservation, Reservation.FIELDS.select('cafe.name'))
+    assert columns(statement, 'reservations') == ['cafe_id', 'id']
+    assert 'cafes' not in statement
+
+
+def test_only_changes_nothing_without_fields():
+    assert Cafe.FIELDS.only(Cafe, None) == []
+
+
+def test_cafe_list_reads_the_chosen_columns(app, client):
+    with statements(app) as seen:
+        response = client.get('/cafes/?fields=name,opening_hours')
+    assert response.status_code == 200
+    assert all(set(cafe) == {'name', 'opening_hours'} for cafe in response.json['cafes'])
+    [statement] = [s for s in seen if 'FROM cafes' in s]
+    assert columns(statement, 'cafes') == ['id', 'name', 'opening_hours']
+
+
+def test_reservation_reads_the_chosen_columns(app, client):
+    with app.app_context():
+        cafe_id = Cafe.query.filter_by(name='BarSan').first().id
+    hold = client.post('/reservations/temp', json={
+        'cafeId': cafe_id, 'date': DAY.isoformat(), 'time': '19:00', 'guests': 2, 'sessionId': 's1'
+    }).json['tempReservation']['id']
+    number = client.post('/reservations/', json={
+        'tempReservationId': hold, 'guestName': 'Ann', 'guestEmail': 'ann@example.com', 'guestPhone': '0812345678'
+    }).json['reservation']['reservationNumber']
+
+    with statements(app) as seen:
+        response = client.get(f'/reservations/{number}?fields=status,table.number')
+    reservation = response.json['reservation']
+    assert set(reservation) == {'status', 'table'} and set(reservation['table']) == {'number'}
+    [statement] = [s for s in seen if 'FROM reservations' in s]
+    assert columns(statement, 'reservations') == ['id', 'status', 'table_id']
+    assert columns(statement, 'tables_1') == ['id', 'number']
+
+
+@pytest.mark.parametrize('path', ['/cafes/?fields=nope', '/cafes/{cafe_id}?fields=zones.tables.nope',
+                                  '/cafes/{cafe_id}/zones/{zone_id}/tables?fields=zone.nope'])
+def test_unknown_fields_get_400(app, client, path):
+    with app.app_context():
+        cafe = Cafe.query.filter_by(name='BarSan').first()
+        cafe_id, zone_id = cafe.id, cafe.zones[0].id
+    response = client.get(path.format(cafe_id=cafe_id, zone_id=zone_id))
+    assert response.status_code == 400
+    assert response.json['message'].startswith('Unknown field: ')
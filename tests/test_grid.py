@@ -0,0 +1,118 @@
+import os
+from datetime import date, timedelta
+
+import pytest
+
+import grid
+from conftest import close_app, counter, make_app
+from models import db, Cafe, Table
+from utils import service_minutes
+
+DAY = date.today() + timedelta(days=7)
+SEVEN_PM = service_minutes('19:00')
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path, AVAILABILITY_GRID_DIR=str(tmp_path / 'grid'), CHANGES_SETTLE_SECONDS=0)
+    with app.app_context():
+        app.config['CAFE_ID'] = Cafe.query.filter_by(name='BarSan').first().id
+    yield app
+    close_app(app)
+
+
+@pytest.fixture
+def writer(app):
+    writer = grid.GridWriter(app.config, log=lambda message: None)
+    with app.app_context():
+        writer.lock()
+        writer.start_cursors()
+        writer.layout = writer.layout_version()
+        writer.refresh(rebuild=True)
+    return writer
+
+
+def free_at_seven(app, guests=2):
+    with app.app_context():
+        day = grid.read_day(app.config['CAFE_ID'], DAY)
+        return None if day is None else len(day.free_tables(guests, SEVEN_PM, SEVEN_PM + 120))
+
+
+def availability(app):
+    response = app.test_client().get(f"/cafes/{app.config['CAFE_ID']}/availability?date={DAY}&guests=2")
+    assert response.status_code == 200
+    return response.json
+
+
+def test_day_mid_update_is_a_miss(app, writer):
+    tables = free_at_seven(app)
+    file = writer.files[app.config['CAFE_ID']]
+    slot = file.slot(DAY)
+    # The writer is between its two seq increments
+    file.days['seq'][slot] += 1
+    assert free_at_seven(app) is None
+    file.days['seq'][slot] += 1
+    assert free_at_seven(app) == tables
+
+
+def test_crc_mismatch_is_a_miss_and_gets_the_file_rebuilt(app, writer):
+    expected = availability(app)
+    file = writer.files[app.config['CAFE_ID']]
+    # Bits that changed without the writer's seqlock, e.g. a torn page
+    file.data[file.slot(DAY)][0][0] ^= 1
+    corrupt = counter(app, 'grid.corrupt')
+    assert free_at_seven(app) is None
+    assert counter(app, 'grid.corrupt') == corrupt + 1
+    assert os.path.exists(grid.grid_path(app.config['AVAILABILITY_GRID_DIR'], app.config['CAFE_ID']) + '.corrupt')
+    # The view falls back to the database and answers the same
+    assert availability(app) == expected
+
+    with app.app_context():
+        writer.follow()
+    assert free_at_seven(app) is not None
+    assert availability(app) == expected
+
+
+def test_second_writer_is_refused(app, writer):
+    with pytest.raises(grid.WriterRunning):
+        grid.GridWriter(app.config).lock()
+
+
+def test_booking_shows_up_after_the_follower_polls(app, writer):
+    tables = free_at_seven(app)
+    client = app.test_client()
+    hold = client.post('/reservations/temp', json={
+        'cafeId': app.config['CAFE_ID'], 'date': DAY.isoformat(), 'time': '19:00', 'guests': 2, 'sessionId': 's'
+    }).json['tempReservation']['id']
+    assert client.post('/reservations/', json={
+        'tempReservationId': hold, 'guestName': 'Tester', 'guestEmail': 't@example.com', 'guestPhone': '0812345678'
+    }).status_code == 200
+    assert free_at_seven(app) == tables
+
+    with app.app_context():
+        writer.follow()
+    assert free_at_seven(app) == tables - 1
+
+
+def test_switched_off_table_leaves_the_grid_at_the_next_poll(app, writer):
+    tables = free_at_seven(app)
+    old = writer.files[app.config['CAFE_ID']]
+    with app.app_context():
+        table = Table.query.filter_by(cafe_id=app.config['CAFE_ID']).first()
+        table.is_active = False
+        db.session.commit()
+        assert writer.follow() is True
+    # The old file is retired, and readers move to the new one
+    assert old.retired
+    assert free_at_seven(app) == tables - 1
+    with app.app_context():
+        assert writer.follow() is False
+
+
+def test_reader_reopens_a_retired_file(app, writer):
+    with app.app_context():
+        first = grid.read_day(app.config['CAFE_ID'], DAY).grid
+        writer.refresh(rebuild=True)
+        second = grid.read_day(app.config['CAFE_ID'], DAY).grid
+    assert first.retired and not second.retired
+    assert second is not first
@@ -0,0 +1,105 @@
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import holds
+from conftest import close_app, make_app, write_lock
+from models import db, Cafe, TemporaryReservation
+
+DAY = date.today() + timedelta(days=7)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path, HOLD_COALESCING=True, HOLD_COALESCE_WINDOW_MS=300, SQLITE_BUSY_TIMEOUT_MS=20,
+                   DB_WRITE_BACKOFF_SECONDS=0.01, DB_WRITE_MAX_BACKOFF_SECONDS=0.02)
+    app.config['DB_PATH'] = str(tmp_path / 'main.db')
+    with app.app_context():
+        app.config['CAFE_ID'] = Cafe.query.filter_by(name='BarSan').first().id
+    yield app
+    close_app(app)
+
+
+def hold(app, id, session_id):
+    return {
+        'id': id, 'cafe_id': app.config['CAFE_ID'], 'date': DAY, 'time': '19:00', 'guests': 2, 'zone_id': None,
+        'session_id': session_id, 'expires_at': datetime.utcnow() + timedelta(minutes=15)
+    }
+
+
+def writer(app, **options):
+    with app.app_context():
+        return holds.HoldWriter(db.engine, **{'window': 0.2, 'deadline': 2, 'backoff': 0.01, **options})
+
+
+def stored(app):
+    with app.app_context():
+        return sorted((t.session_id, t.id) for t in TemporaryReservation.query)
+
+
+def test_concurrent_holds_share_one_transaction(app):
+    hold_writer = writer(app)
+    futures = [hold_writer.submit(hold(app, f'h{i}', f's{i}')) for i in range(5)]
+    assert [future.result(timeout=5)['id'] for future in futures] == [f'h{i}' for i in range(5)]
+    assert hold_writer.batches == 1
+    assert stored(app) == [(f's{i}', f'h{i}') for i in range(5)]
+
+
+def test_earlier_hold_of_a_session_gets_the_winning_hold(app):
+    hold_writer = writer(app)
+    first = hold_writer.submit(hold(app, 'old', 'same'))
+    second = hold_writer.submit(hold(app, 'new', 'same'))
+    assert first.result(timeout=5)['id'] == second.result(timeout=5)['id'] == 'new'
+    assert stored(app) == [('same', 'new')]
+
+
+def test_bad_hold_only_fails_its_own_request(app):
+    hold_writer = writer(app)
+    bad = hold(app, 'bad', 'broken')
+    bad['guests'] = None
+    futures = [hold_writer.submit(hold(app, 'good', 's1')), hold_writer.submit(bad)]
+    assert futures[0].result(timeout=5)['id'] == 'good'
+    assert futures[1].exception(timeout=5) is not None
+    assert stored(app) == [('s1', 'good')]
+
+
+def test_lock_held_past_the_deadline_raises_holds_busy(app):
+    hold_writer = writer(app, window=0, deadline=0.2)
+    with write_lock(app.config['DB_PATH']):
+        future = hold_writer.submit(hold(app, 'h', 's'))
+        assert isinstance(future.exception(timeout=5), holds.HoldsBusy)
+    assert stored(app) == []
+
+
+def test_view_answers_503_when_holds_are_busy(app):
+    app.config['DB_WRITE_DEADLINE_SECONDS'] = 0.2
+    client = app.test_client()
+    with write_lock(app.config['DB_PATH']):
+        response = client.post('/reservations/temp', json={
+            'cafeId': app.config['CAFE_ID'], 'date': DAY.isoformat(), 'time': '19:00', 'guests': 2, 'sessionId': 's'
+        })
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_both_requests_of_a_session_in_one_batch_can_book(app):
+    responses = []
+
+    def post(time):
+        responses.append(app.test_client().post('/reservations/temp', json={
+            'cafeId': app.config['CAFE_ID'], 'date': DAY.isoformat(), 'time': time, 'guests': 2, 'sessionId': 'twice'
+        }))
+
+    threads = [threading.Thread(target=post, args=(time,)) for time in ('19:00', '20:00')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [response.status_code for response in responses] == [200, 200]
+    ids = {response.json['tempReservation']['id'] for response in responses}
+    assert len(ids) == 1
+    booking = app.test_client().post('/reservations/', json={
+        'tempReservationId': ids.pop(), 'guestName': 'Tester', 'guestEmail': 't@example.com', 'guestPhone': '0812345678'
+    })
+    assert booking.status_code == 200, booking.json
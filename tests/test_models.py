@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+
+import pytest
+
+from models import db, Cafe, Reservation
+from utils import service_minutes
+
+DAY = date.today() + timedelta(days=7)
+
+
+@pytest.fixture
+def reserve(app):
+    """Add a booking at BarSan named `name`, `time` on the service day `day`"""
+    with app.app_context():
+        cafe_id = Cafe.query.filter_by(name='BarSan').first().id
+
+    def reserve(name, day, time, duration=120):
+        with app.app_context():
+            db.session.add(Reservation(
+                reservation_number=name, cafe_id=cafe_id, guest_name='Tester', guest_email='t@example.com',
+                guest_phone='0812345678', date=day, time=time, guests=2, duration=duration
+            ))
+            db.session.commit()
+
+    reserve.cafe_id = cafe_id
+    return reserve
+
+
+def overlapping(app, cafe_id, day, time, duration=120):
+    start = service_minutes(time)
+    with app.app_context():
+        query = Reservation.query.filter(Reservation.overlapping(cafe_id, day, start, start + duration))
+        return sorted(r.reservation_number for r in query)
+
+
+def test_bookings_after_midnight_overlap_the_same_service_day(app, reserve):
+    reserve('late', DAY, '23:30')
+    # 00:30 and 01:00 are on DAY's service day, within 23:30-01:30
+    assert overlapping(app, reserve.cafe_id, DAY, '00:30') == ['late']
+    assert overlapping(app, reserve.cafe_id, DAY, '22:00', 120) == ['late']
+    # Touching ends do not overlap
+    assert overlapping(app, reserve.cafe_id, DAY, '01:30') == []
+    assert overlapping(app, reserve.cafe_id, DAY, '21:30') == []
+    # Nor does the next service day's evening
+    assert overlapping(app, reserve.cafe_id, DAY + timedelta(days=1), '00:30') == []
+
+
+def test_bookings_of_the_previous_day_past_06_00_overlap(app, reserve):
+    # 05:00-07:00 on the calendar day after DAY, booked on DAY's service day
+    reserve('dawn', DAY, '05:00')
+    next_day = DAY + timedelta(days=1)
+    assert overlapping(app, reserve.cafe_id, next_day, '06:30') == ['dawn']
+    assert overlapping(app, reserve.cafe_id, next_day, '06:59', 30) == ['dawn']
+    assert overlapping(app, reserve.cafe_id, next_day, '07:00') == []
+    assert overlapping(app, reserve.cafe_id, next_day + timedelta(days=1), '06:30') == []
+
+
+def test_bookings_past_06_00_overlap_the_next_days_early_bookings(app, reserve):
+    next_day = DAY + timedelta(days=1)
+    reserve('early', next_day, '06:30')
+    reserve('breakfast', next_day, '07:00')
+    assert overlapping(app, reserve.cafe_id, DAY, '05:00') == ['early']
+    assert overlapping(app, reserve.cafe_id, DAY, '05:00', 60) == []
+    assert overlapping(app, reserve.cafe_id, DAY, '05:30', 120) == ['breakfast', 'early']
+
+
+def test_other_cafes_bookings_do_not_overlap(app, reserve):
+    reserve('late', DAY, '23:30')
+    with app.app_context():
+        noir = Cafe.query.filter_by(name='NOIR').first().id
+    assert overlapping(app, noir, DAY, '23:30') == []
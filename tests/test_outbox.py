@@ -0,0 +1,167 @@
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+import outbox
+import shards
+from conftest import close_app, make_app
+from models import db, OutboxMessage
+
+
+@pytest.fixture
+def sharded_app(tmp_path):
+    app = make_app(tmp_path, SHARD_DATABASE_URLS=f"a=sqlite:///{tmp_path / 'a.db'},b=sqlite:///{tmp_path / 'b.db'}")
+    yield app
+    close_app(app)
+
+
+def queue_webhook(event='reservation.created'):
+    outbox.add('webhook', {'url': 'http://pos.example/hook', 'event': event, 'cafeId': 'c', 'reservation': {}})
+    db.session.commit()
+
+
+def test_webhook_delivery_ids_differ_between_shards(sharded_app, monkeypatch):
+    sent = []
+
+    def urlopen(request, timeout=None):
+        sent.append((request.get_header('X-barsan-delivery'), json.loads(request.data)['id']))
+        return open('/dev/null', 'rb')
+
+    monkeypatch.setattr(urllib.request, 'urlopen', urlopen)
+    with sharded_app.app_context():
+        for location in shards.locations():
+            with shards.using(location):
+                queue_webhook()
+        # Each database numbers its own outbox, so all three rows are id 1
+        for location in shards.locations():
+            with shards.using(location):
+                assert [m.id for m in OutboxMessage.query] == [1]
+
+        worker = outbox.OutboxWorker(sharded_app.config, concurrency=2)
+        assert worker.run_once() == 3
+        worker.pool.shutdown()
+
+    assert sorted(sent) == [('1', '1'), ('a-1', 'a-1'), ('b-1', 'b-1')]
+
+
+def fail_with(error):
+    def send(delivery_id, payload, config):
+        raise error
+    return {'webhook': send}
+
+
+def messages():
+    db.session.expire_all()
+    return OutboxMessage.query.order_by(OutboxMessage.id).all()
+
+
+def test_claimed_messages_are_leased_until_the_lease_runs_out(app):
+    with app.app_context():
+        for _ in range(3):
+            queue_webhook()
+        first, second = outbox.OutboxWorker(app.config, batch_size=2), outbox.OutboxWorker(app.config)
+        claimed = first.claim()
+        assert [m.id for m in claimed] == [1, 2]
+        # The other worker only gets what is left
+        assert [m.id for m in second.claim()] == [3]
+        assert second.claim() == []
+
+        # A crashed worker's rows come back once its lease is over
+        db.session.execute(update(OutboxMessage).where(OutboxMessage.id == 1).values(
+            locked_until=datetime.utcnow() - timedelta(seconds=1)
+        ))
+        db.session.commit()
+        assert [m.id for m in second.claim()] == [1]
+        for worker in (first, second):
+            worker.pool.shutdown()
+
+
+def test_failed_sends_back_off(app):
+    app.config.update(OUTBOX_BACKOFF_SECONDS=60, OUTBOX_MAX_BACKOFF_SECONDS=3600)
+    with app.app_context():
+        queue_webhook()
+        worker = outbox.OutboxWorker(app.config, senders=fail_with(ConnectionResetError('reset by peer')))
+        started = datetime.utcnow()
+        assert worker.run_once() == 1
+        [message] = messages()
+        assert (message.status, message.attempts, message.locked_by) == ('pending', 1, None)
+        assert message.last_error == 'ConnectionResetError: reset by peer'
+        assert started + timedelta(seconds=29) <= message.available_at <= datetime.utcnow() + timedelta(seconds=60)
+        # Not due again until the backoff is over
+        assert worker.run_once() == 0
+        worker.pool.shutdown()
+
+
+def test_backoff_doubles_up_to_the_cap():
+    for attempts, full in ((1, 10), (2, 20), (4, 80), (10, 300)):
+        for _ in range(20):
+            assert full / 2 <= outbox.backoff_seconds(attempts, 10, 300) <= full
+
+
+def test_permanent_errors_are_dead_lettered_at_once(app):
+    with app.app_context():
+        queue_webhook()
+        worker = outbox.OutboxWorker(app.config, senders=fail_with(outbox.PermanentError('HTTP 404')))
+        worker.run_once()
+        worker.pool.shutdown()
+        [message] = messages()
+        assert (message.status, message.attempts, message.last_error) == ('dead', 1, 'PermanentError: HTTP 404')
+
+
+def test_messages_are_dead_lettered_after_the_last_attempt(app):
+    app.config['OUTBOX_MAX_ATTEMPTS'] = 3
+    with app.app_context():
+        queue_webhook()
+        worker = outbox.OutboxWorker(app.config, senders=fail_with(TimeoutError('timed out')))
+        statuses = []
+        for _ in range(3):
+            # Due again at once instead of after the backoff
+            db.session.execute(update(OutboxMessage).values(available_at=datetime.utcnow()))
+            db.session.commit()
+            worker.run_once()
+            statuses.append(messages()[0].status)
+        worker.pool.shutdown()
+        assert statuses == ['pending', 'pending', 'dead']
+        assert outbox.backlog() == {'pending': 0, 'dead': 1, 'oldestPendingSeconds': 0}
+
+
+def dead_letter(ids):
+    db.session.execute(update(OutboxMessage).where(OutboxMessage.id.in_(ids)).values(status='dead', attempts=8))
+    db.session.commit()
+
+
+def test_requeue_outbox_gives_dead_letters_new_attempts(sharded_app):
+    runner = sharded_app.test_cli_runner()
+    with sharded_app.app_context():
+        for location in (shards.CONTROL, 'a'):
+            with shards.using(location):
+                for _ in range(3):
+                    queue_webhook()
+                dead_letter([1, 2])
+
+        assert runner.invoke(args=['requeue-outbox', '1']).output == "Requeued 1 messages\n"
+        assert [(m.status, m.attempts) for m in messages()] == [('pending', 0), ('dead', 8), ('pending', 0)]
+        assert runner.invoke(args=['requeue-outbox', '2', '--shard', 'a']).output == "Requeued 1 messages\n"
+        with shards.using('a'):
+            assert [m.status for m in messages()] == ['dead', 'pending', 'pending']
+
+        # Without ids, every database's dead letters
+        assert runner.invoke(args=['requeue-outbox']).output == "Requeued 2 messages\n"
+        for location in (shards.CONTROL, 'a'):
+            with shards.using(location):
+                assert [m.status for m in messages()] == ['pending'] * 3
+
+
+def test_backlog_metrics_are_cached(app, monkeypatch):
+    app.config['OUTBOX_BACKLOG_CACHE_SECONDS'] = 60
+    monkeypatch.setattr(outbox, 'backlog_monitor', outbox.BacklogMonitor())
+    with app.app_context():
+        queue_webhook()
+        assert outbox.backlog_monitor.current()['pending'] == 1
+        queue_webhook()
+        assert outbox.backlog_monitor.current()['pending'] == 1
+        monkeypatch.setattr(outbox.backlog_monitor, 'checked_at', outbox.backlog_monitor.checked_at - 60)
+        assert outbox.backlog_monitor.current()['pending'] == 2
@@ -0,0 +1,67 @@
+from datetime import date
+
+import pytest
+
+from schedule import compile_schedule, DEFAULT_HOURS, WEEKDAYS
+
+MONDAY = date(2026, 1, 5)
+
+
+def monday(hours, **settings):
+    return compile_schedule({'monday': hours}, {'slot_interval': 30, 'default_duration': 120, **settings}) \
+        .for_date(MONDAY)
+
+
+def test_overnight_hours_run_into_the_next_calendar_day():
+    day = monday({'open': '17:00', 'close': '02:00'})
+    assert (day.open_minute, day.close_minute) == (17 * 60, 26 * 60)
+    # The last booking of the default 120 minutes ends at closing time
+    assert day.labels[0] == '17:00' and day.labels[-1] == '00:00'
+    assert len(day.slots) == 15
+    assert day.slots[-1] == 24 * 60 and day.slots[-1] in day.slot_set
+
+
+def test_hours_closing_at_opening_time_last_a_full_day():
+    day = monday({'open': '18:00', 'close': '18:00'})
+    assert day.close_minute - day.open_minute == 24 * 60
+    assert day.labels[-1] == '16:00'
+
+
+@pytest.mark.parametrize('hours, settings, last', [
+    ({'open': '17:00', 'close': '02:00', 'last_seating': '23:30'}, {}, '23:30'),
+    # A last seating after midnight belongs to the same night
+    ({'open': '17:00', 'close': '02:00', 'last_seating': '01:00'}, {}, '01:00'),
+    # But never after closing
+    ({'open': '17:00', 'close': '02:00', 'last_seating': '03:00'}, {}, '02:00'),
+    ({'open': '17:00', 'close': '02:00'}, {'last_seating_before_close': 30}, '01:30'),
+    ({'open': '17:00', 'close': '23:00'}, {'default_duration': 90}, '21:30'),
+    # Slots stay on the interval from opening time
+    ({'open': '17:00', 'close': '23:00', 'last_seating': '21:45'}, {}, '21:30'),
+])
+def test_last_seating_cuts_off_the_slots(hours, settings, last):
+    assert monday(hours, **settings).labels[-1] == last
+
+
+def test_days_without_a_seating_are_closed():
+    assert monday(None) is None
+    assert monday({'closed': True}) is None
+    assert monday({'open': '17:00', 'close': '18:00'}) is None
+
+
+def test_missing_weekdays_use_the_default_hours():
+    schedule = compile_schedule({'monday': None}, {})
+    assert schedule.days[0] is None
+    for day in schedule.days[1:]:
+        assert day.labels[0] == DEFAULT_HOURS['open'] and day.labels[-1] == '23:00'
+    assert len(compile_schedule(None, {}).days) == len(WEEKDAYS)
+
+
+@pytest.mark.parametrize('interval', [0, -15, '0'])
+def test_slot_intervals_below_one_minute_use_the_default(interval):
+    day = monday({'open': '17:00', 'close': '23:00'}, slot_interval=interval)
+    assert day.labels == ('17:00', '17:30', '18:00', '18:30', '19:00', '19:30', '20:00', '20:30', '21:00')
+
+
+def test_slot_interval_setting():
+    day = monday({'open': '17:00', 'close': '19:00'}, slot_interval=15, default_duration=60)
+    assert day.labels == ('17:00', '17:15', '17:30', '17:45', '18:00')
@@ -0,0 +1,157 @@
+import threading
+import time
+from datetime import date
+
+import fakeredis
+import pytest
+import redis
+
+import singleflight
+from conftest import counter
+
+WAITERS = 4
+
+
+def eventually(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def run_together(app, fn):
+    """Call availability.do from a leader and WAITERS more threads while the leader's fn is still running"""
+    release = threading.Event()
+    calls = []
+    outcomes = [None] * (WAITERS + 1)
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return fn()
+
+    def call(n):
+        try:
+            outcomes[n] = ('value', singleflight.availability.do('cafe:day:2:primary', compute))
+        except Exception as e:
+            outcomes[n] = ('error', e)
+
+    shared = counter(app, 'singleflight.availability.shared')
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(WAITERS + 1)]
+    threads[0].start()
+    eventually(lambda: calls)
+    for thread in threads[1:]:
+        thread.start()
+    eventually(lambda: counter(app, 'singleflight.availability.shared') == shared + WAITERS)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return len(calls), outcomes
+
+
+def test_concurrent_calls_share_one_computation(app):
+    result = (['19:00'], [])
+    calls, outcomes = run_together(app, lambda: result)
+    assert calls == 1
+    assert all(outcome == ('value', result) for outcome in outcomes)
+    assert singleflight.availability.in_flight() == 0
+
+
+def test_every_waiter_gets_the_leaders_exception(app):
+    error = ValueError('database went away')
+
+    def fail():
+        raise error
+
+    calls, outcomes = run_together(app, fail)
+    assert calls == 1
+    assert all(outcome == ('error', error) for outcome in outcomes)
+    # The next call computes again
+    assert singleflight.availability.do('cafe:day:2:primary', lambda: 'fresh') == 'fresh'
+
+
+def test_waiter_computes_for_itself_after_the_timeout(app, monkeypatch):
+    monkeypatch.setattr(singleflight.availability, 'timeout', 0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=singleflight.availability.do, args=('key', lambda: release.wait(5)))
+    leader.start()
+    try:
+        eventually(lambda: singleflight.availability.in_flight())
+        assert singleflight.availability.do('key', lambda: 'own') == 'own'
+    finally:
+        release.set()
+        leader.join(5)
+
+
+@pytest.fixture
+def workers(app, monkeypatch):
+    """Two workers' groups, each with a Redis backend on the same (fake) server"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', classmethod(lambda cls, url: fakeredis.FakeRedis(server=server)))
+    groups = []
+    for _ in range(2):
+        group = singleflight.Group('availability', timeout=5)
+        group.backend = singleflight.RedisBackend('redis://fake', poll_interval=0.001)
+        groups.append(group)
+    return groups
+
+
+def test_redis_backend_shares_the_result_between_workers(app, workers):
+    first, second = workers
+    leader_released, waiting = threading.Event(), threading.Event()
+    value = (['19:00', '19:30'], [{'zone': 'Bar', 'date': date(2026, 1, 2)}])
+    results = {}
+
+    def wait(*args):
+        waiting.set()
+        return original_wait(*args)
+
+    original_wait = second.backend._wait
+    second.backend._wait = wait
+
+    def lead():
+        results['first'] = first.do('cafe:day:2:primary', lambda: leader_released.wait(5) and value)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    lock_key = f'{singleflight.REDIS_PREFIX}availability:cafe:day:2:primary'
+    eventually(lambda: first.backend.redis.exists(lock_key))
+
+    follower = threading.Thread(
+        target=lambda: results.update(second=second.do('cafe:day:2:primary', lambda: pytest.fail("computed twice")))
+    )
+    follower.start()
+    assert waiting.wait(5)
+    leader_released.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert results['first'] == value
+    # The other worker gets the leader's result as it comes back from JSON
+    assert results['second'] == [['19:00', '19:30'], [{'zone': 'Bar', 'date': '2026-01-02'}]]
+    assert not first.backend.redis.exists(lock_key)
+    result_keys = first.backend.redis.keys(f'{lock_key}:*')
+    assert len(result_keys) == 1
+    assert 0 < first.backend.redis.pttl(result_keys[0]) <= singleflight.REDIS_RESULT_TTL_MS
+
+
+def test_redis_backend_takes_over_when_the_leader_fails(app, workers):
+    first, second = workers
+    lock_key = f'{singleflight.REDIS_PREFIX}availability:key'
+    # A leader of another worker let go of the lock without storing a result
+    first.backend.redis.set(lock_key, 'gone', px=5000)
+    threading.Timer(0.05, first.backend.redis.delete, args=(lock_key,)).start()
+    assert second.do('key', lambda: 'computed') == 'computed'
+    assert not second.backend.redis.exists(lock_key)
+
+
+def test_redis_errors_fall_back_to_computing(app, workers, monkeypatch):
+    group = workers[0]
+
+    def unavailable(*args, **kwargs):
+        raise redis.ConnectionError()
+
+    monkeypatch.setattr(group.backend.redis, 'set', unavailable)
+    errors = counter(app, 'singleflight.availability.redis_errors')
+    assert group.do('key', lambda: 'computed') == 'computed'
+    assert counter(app, 'singleflight.availability.redis_errors') == errors + 1
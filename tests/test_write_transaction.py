@@ -0,0 +1,162 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+from flask import jsonify
+from sqlalchemy import event
+
+from conftest import close_app, counter, make_app, write_lock
+from models import db, Cafe, Reservation, TemporaryReservation
+from routing import note_db_error, plain_reads, start_writes, write_transaction
+
+DAY = (date.today() + timedelta(days=7)).isoformat()
+
+
+@pytest.fixture
+def app(tmp_path):
+    # Lock waits and backoff short enough to hit the deadline within a test
+    app = make_app(tmp_path, SQLITE_BUSY_TIMEOUT_MS=20, DB_WRITE_BACKOFF_SECONDS=0.01,
+                   DB_WRITE_MAX_BACKOFF_SECONDS=0.02, DB_WRITE_DEADLINE_SECONDS=2)
+    app.config['DB_PATH'] = str(tmp_path / 'main.db')
+    yield app
+    close_app(app)
+
+
+def cafe_id(app):
+    with app.app_context():
+        return Cafe.query.filter_by(name='BarSan').first().id
+
+
+def hold(client, cafe, session_id='s1'):
+    return client.post('/reservations/temp', json={
+        'cafeId': cafe, 'date': DAY, 'time': '19:00', 'guests': 2, 'sessionId': session_id
+    })
+
+
+def book(client, hold_id):
+    return client.post('/reservations/', json={
+        'tempReservationId': hold_id, 'guestName': 'Tester', 'guestEmail': 't@example.com', 'guestPhone': '0812345678'
+    })
+
+
+def test_hold_is_retried_until_the_lock_is_released(app):
+    client, cafe, retries = app.test_client(), cafe_id(app), counter(app, 'db.write_retries')
+    with write_lock(app.config['DB_PATH'], release_after=0.2):
+        response = hold(client, cafe)
+    assert response.status_code == 200, response.json
+    assert counter(app, 'db.write_retries') > retries
+    with app.app_context():
+        assert TemporaryReservation.query.filter_by(session_id='s1').count() == 1
+
+
+def test_booking_is_retried_until_the_lock_is_released(app):
+    client, cafe, retries = app.test_client(), cafe_id(app), counter(app, 'db.write_retries')
+    hold_id = hold(client, cafe).json['tempReservation']['id']
+    with write_lock(app.config['DB_PATH'], release_after=0.2):
+        response = book(client, hold_id)
+    assert response.status_code == 200, response.json
+    assert counter(app, 'db.write_retries') > retries
+    with app.app_context():
+        assert Reservation.query.count() == 1
+        assert TemporaryReservation.query.count() == 0
+
+
+def test_lock_held_past_the_deadline_answers_503(app):
+    app.config['DB_WRITE_DEADLINE_SECONDS'] = 0.2
+    client, cafe, timeouts = app.test_client(), cafe_id(app), counter(app, 'db.write_timeouts')
+    with write_lock(app.config['DB_PATH']):
+        response = hold(client, cafe)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert counter(app, 'db.write_timeouts') == timeouts + 1
+    with app.app_context():
+        assert TemporaryReservation.query.count() == 0
+
+
+def test_conflict_rolls_back_and_runs_the_view_again(app):
+    calls = []
+
+    @app.route('/test/conflict-once', methods=['POST'])
+    @write_transaction
+    def conflict_once():
+        calls.append(1)
+        db.session.add(TemporaryReservation(cafe_id=cafe, date=date.today(), time='19:00', guests=2,
+                                            session_id=f'run{len(calls)}', expires_at=date.today()))
+        db.session.flush()
+        if len(calls) == 1:
+            # As the engines' handle_error event does when a view catches the lock error itself
+            note_db_error(sqlite3.OperationalError('database is locked'))
+            return jsonify({'success': False}), 500
+        db.session.commit()
+        return jsonify({'success': True})
+
+    cafe = cafe_id(app)
+    response = app.test_client().post('/test/conflict-once')
+    assert response.status_code == 200
+    assert len(calls) == 2
+    with app.app_context():
+        assert [t.session_id for t in TemporaryReservation.query] == ['run2']
+
+
+def test_conflict_after_the_commit_is_not_retried(app):
+    calls = []
+
+    @app.route('/test/conflict-after-commit', methods=['POST'])
+    @write_transaction
+    def conflict_after_commit():
+        calls.append(1)
+        db.session.add(TemporaryReservation(cafe_id=cafe, date=date.today(), time='19:00', guests=2,
+                                            session_id='once', expires_at=date.today()))
+        db.session.commit()
+        note_db_error(sqlite3.OperationalError('database is locked'))
+        return jsonify({'success': True})
+
+    cafe = cafe_id(app)
+    assert app.test_client().post('/test/conflict-after-commit').status_code == 200
+    assert len(calls) == 1
+    with app.app_context():
+        assert TemporaryReservation.query.count() == 1
+
+
+def test_plain_reads_then_start_writes(app):
+    statements = []
+
+    @app.route('/test/reads-then-writes', methods=['POST'])
+    @write_transaction
+    def reads_then_writes():
+        plain_reads()
+        Cafe.query.first()
+        statements.append('-- start_writes')
+        start_writes()
+        Cafe.query.first()
+        db.session.commit()
+        return jsonify({'success': True})
+
+    with app.app_context():
+        engine = db.engine
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement.split()[0] + (' IMMEDIATE' if 'IMMEDIATE' in statement else ''))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert app.test_client().post('/test/reads-then-writes').status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    # The reads before start_writes() take no write lock; the write transaction begins right after it
+    assert statements == ['SELECT', '-- start_writes', 'BEGIN IMMEDIATE', 'SELECT']
+
+
+def test_plain_reads_do_not_wait_for_the_write_lock(app):
+    app.config['DB_WRITE_DEADLINE_SECONDS'] = 0.2
+
+    @app.route('/test/plain-reads', methods=['POST'])
+    @write_transaction
+    def plain():
+        plain_reads()
+        return jsonify({'cafes': Cafe.query.count()})
+
+    with write_lock(app.config['DB_PATH']):
+        response = app.test_client().post('/test/plain-reads')
+    assert response.status_code == 200
+    assert response.json['cafes'] == 2
@@ -0,0 +1,158 @@
+import math
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, insert, select
+
+from cache import TTLCache
+from models import db, Reservation, ArchivedReservation, TurnTime
+from schedule import get_schedule
+import shards
+
+# Party sizes are grouped as 1-2, 3-4, 5-6 and 7+ (stored as 2, 4, 6 and 7)
+PARTY_SIZE_BUCKETS = (2, 4, 6)
+
+# weekday/hour value of the coarser fallback rows
+ANY = -1
+
+# Durations are rounded up to this many minutes
+ROUND_TO = 15
+
+_cache = TTLCache('turn_times', max_entries=1024)
+
+
+def party_bucket(guests):
+    for size in PARTY_SIZE_BUCKETS:
+        if guests <= size:
+            return size
+    return PARTY_SIZE_BUCKETS[-1] + 1
+
+
+class TurnTimeModel:
+    """Expected minutes at the table, looked up from the most specific row with enough history"""
+
+    def __init__(self, durations):
+        self.durations = durations  # (party_size, weekday, hour) -> minutes
+
+    def duration(self, guests, weekday, start_minute, default):
+        size = party_bucket(guests)
+        # Service-day hour, so 01:00 is hour 25 of the previous day
+        hour = start_minute // 60
+        for key in ((size, weekday, hour), (size, weekday, ANY), (size, ANY, ANY)):
+            minutes = self.durations.get(key)
+            if minutes:
+                return minutes
+        return default
+
+
+def turn_times_query(cafe_id):
+    return select(TurnTime.party_size, TurnTime.weekday, TurnTime.hour, TurnTime.minutes).where(
+        TurnTime.cafe_id == cafe_id
+    )
+
+
+def cached_turn_times(cafe_id):
+    """A cafe's turn-time model if this worker has a fresh copy, else None"""
+    return _cache.get(cafe_id)
+
+
+def remember_turn_times(cafe_id, rows, ttl):
+    """Build a cafe's turn-time model from turn_times_query rows and cache it for ttl seconds"""
+    model = TurnTimeModel({(size, weekday, hour): minutes for size, weekday, hour, minutes in rows})
+    _cache.set(cafe_id, model, ttl)
+    return model
+
+
+def get_turn_times(cafe_id):
+    """A cafe's turn-time model, reloaded from turn_times at most every TURN_TIME_CACHE_SECONDS"""
+    model = cached_turn_times(cafe_id)
+    if model is None:
+        model = remember_turn_times(cafe_id, db.session.execute(turn_times_query(cafe_id)),
+                                    current_app.config['TURN_TIME_CACHE_SECONDS'])
+    return model
+
+
+def booking_duration(cafe, service_date, guests, start_minute, turn_times=None):
+    """Minutes to book for a party, falling back to the cafe's default duration"""
+    default = get_schedule(cafe).duration
+    model = turn_times or get_turn_times(cafe.id)
+    return model.duration(guests, service_date.weekday(), start_minute, default)
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+def compute_turn_times(cafe_id=None, batch_size=5000, log=print):
+    """Recompute turn_times from seated-to-completed times of recent reservations
+
+    For each cafe, party size bucket, weekday and booked hour with at least
+    TURN_TIME_MIN_SAMPLES completed reservations, stores the
+    TURN_TIME_PERCENTILE dining time rounded up to ROUND_TO minutes. Coarser
+    rows (any hour, then any weekday) cover sparse buckets. Returns the number
+    of rows written.
+    """
+    written = 0
+    for cafe_ids in shards.homes(cafe_id):
+        written += _compute_turn_times(cafe_ids, batch_size, log)
+    _cache.clear()
+    return written
+
+
+def _compute_turn_times(cafe_ids, batch_size, log):
+    config = current_app.config
+    since = date.today() - timedelta(days=config['TURN_TIME_HISTORY_DAYS'])
+    samples = defaultdict(list)
+    seen = set()
+
+    for model in (Reservation, ArchivedReservation):
+        query = select(
+            model.id, model.cafe_id, model.date, model.guests, model.start_minute, model.seated_at,
+            model.completed_at
+        ).where(
+            model.date >= since,
+            model.status == 'completed',
+            model.seated_at.isnot(None),
+            model.completed_at > model.seated_at,
+            model.start_minute.isnot(None)
+        ).execution_options(yield_per=batch_size)
+        if cafe_ids is not None:
+            query = query.where(model.cafe_id.in_(cafe_ids))
+
+        for id, cafe, day, guests, start, seated_at, completed_at in db.session.execute(query):
+            if id in seen:
+                continue
+            seen.add(id)
+            minutes = (completed_at - seated_at).total_seconds() / 60
+            size, weekday = party_bucket(guests), day.weekday()
+            for key in ((size, weekday, start // 60), (size, weekday, ANY), (size, ANY, ANY)):
+                samples[(cafe,) + key].append(minutes)
+    log(f"Read {len(seen)} completed reservations since {since.isoformat()}")
+
+    computed_at = datetime.utcnow()
+    rows = []
+    for (cafe, size, weekday, hour), values in samples.items():
+        if len(values) < config['TURN_TIME_MIN_SAMPLES']:
+            continue
+        minutes = math.ceil(_percentile(sorted(values), config['TURN_TIME_PERCENTILE']) / ROUND_TO) * ROUND_TO
+        rows.append({
+            'cafe_id': cafe,
+            'party_size': size,
+            'weekday': weekday,
+            'hour': hour,
+            'minutes': min(max(minutes, config['TURN_TIME_MIN_MINUTES']), config['TURN_TIME_MAX_MINUTES']),
+            'samples': len(values),
+            'computed_at': computed_at
+        })
+
+    stale = delete(TurnTime)
+    if cafe_ids is not None:
+        stale = stale.where(TurnTime.cafe_id.in_(cafe_ids))
+    db.session.execute(stale)
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(insert(TurnTime), rows[i:i + batch_size])
+    db.session.commit()
+    log(f"Wrote {len(rows)} turn time rows")
+    return len(rows)
@@ -3,6 +3,10 @@ import random
 import string
 from datetime import datetime, time
 
+# Service days run 06:00-06:00, so bookings after midnight belong to the previous evening
+SERVICE_DAY_START = 6 * 60
+MINUTES_PER_DAY = 24 * 60
+
 def generate_reservation_number():
     """Generate a unique reservation number"""
     timestamp = str(int(datetime.now().timestamp()))[-6:]
@@ -19,13 +23,20 @@ def time_to_minutes(time_str):
     hours, minutes = map(int, time_str.split(':'))
     return hours * 60 + minutes
 
+def service_minutes(time_str):
+    """Convert time string to minutes since midnight of its service day (01:00 -> 1500)"""
+    minutes = time_to_minutes(time_str)
+    if minutes < SERVICE_DAY_START:
+        minutes += MINUTES_PER_DAY
+    return minutes
+
 def is_time_slot_available(requested_time, duration, existing_reservations):
     """Check if a time slot is available"""
-    requested_start = time_to_minutes(requested_time)
+    requested_start = service_minutes(requested_time)
     requested_end = requested_start + duration
     
     for reservation in existing_reservations:
-        existing_start = time_to_minutes(reservation['time'])
+        existing_start = service_minutes(reservation['time'])
         existing_end = existing_start + reservation['duration']
         
         # Check for overlap
@@ -0,0 +1,9 @@
+"""WSGI entry point for production servers (gunicorn -c gunicorn.conf.py wsgi:app)"""
+import time
+
+from app import create_app, verify_startup
+
+started = time.perf_counter()
+app = create_app()
+# Runs once in the gunicorn master when the app is preloaded
+verify_startup(app, started)